@@ -0,0 +1,195 @@
+"""
+Emergency term detection.
+
+The vocabulary is compiled into an Aho-Corasick automaton (flattened into a
+DFA, so each character costs one dictionary lookup) and matched with word
+boundaries, so "acute" no longer fires on "acuteness". A term is ignored
+only when a negation heads its own noun phrase ("no signs of stroke", "denies
+chest pain"); a comma, "but" or any other word in between ends the negation,
+so "Do not delay, seek emergency care" and "No fever, but acute chest pain"
+still alert. A matcher
+keeps its state between chunks, so it can be fed a Groq stream token by
+token and report a red-flag term the moment it is generated.
+"""
+import os
+import re
+
+DEFAULT_EMERGENCY_TERMS = (
+    "stroke", "heart attack", "myocardial infarction", "sepsis",
+    "anaphylaxis", "pulmonary embolism", "meningitis", "acute",
+    "immediate", "emergency", "urgent", "critical",
+    # Bosnian / Croatian / Serbian
+    "moždani udar", "srčani udar", "infarkt", "infarkt miokarda", "sepsa",
+    "anafilaksa", "anafilaktički šok", "plućna embolija", "hitno", "hitan slučaj",
+    "kritično", "kritično stanje",
+)
+
+# Words that negate a term in the noun phrase they head
+NEGATION_CUES = frozenset((
+    "no", "not", "without", "denies", "denied", "negative", "absent",
+    "nema", "bez", "ne", "nije",
+))
+
+# Words that may stand between a negation and its term ("no signs of stroke",
+# "not an emergency"); any other word ends the negation
+NEGATION_FILLERS = frozenset((
+    "a", "an", "any", "the", "of", "for", "signs", "sign", "symptoms", "evidence",
+    "history", "suspected", "suspicion", "known", "need",
+    "znakova", "znaci", "simptoma", "za", "potrebe",
+))
+NEGATION_WINDOW = 3  # fillers at most
+
+# Characters of trailing context kept between chunks for the negation check
+_NEGATION_CONTEXT = 60
+
+_WORD = re.compile(r"\w+")
+_CLAUSE_BREAK = re.compile(r"[.,;:!?\n]|\b(?:but|however|although|ali|međutim)\b")
+
+
+def _is_word_char(ch):
+    return ch.isalnum() or ch == "_"
+
+
+class _Automaton:
+    """Aho-Corasick automaton over lowercase terms, flattened into a DFA"""
+
+    def __init__(self, terms):
+        self.terms = tuple(dict.fromkeys(term.lower() for term in terms if term.strip()))
+        self.max_length = max((len(term) for term in self.terms), default=0)
+
+        goto = [{}]
+        outputs = [[]]
+        for index, term in enumerate(self.terms):
+            state = 0
+            for ch in term:
+                if ch not in goto[state]:
+                    goto.append({})
+                    outputs.append([])
+                    goto[state][ch] = len(goto) - 1
+                state = goto[state][ch]
+            outputs[state].append(index)
+
+        # Breadth-first: fail links, merged outputs and fully resolved transitions
+        fail = [0] * len(goto)
+        self.delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = list(goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            # Transitions not in the trie follow the fail state's (already resolved) ones
+            transitions = dict(self.delta[fail[state]])
+            transitions.update(goto[state])
+            self.delta[state] = transitions
+            for ch, child in goto[state].items():
+                fail[child] = self.delta[fail[state]].get(ch, 0)
+                queue.append(child)
+        self.outputs = [tuple(out) for out in outputs]
+
+
+class EmergencyMatcher:
+    """Incremental matcher over one stream of text"""
+
+    def __init__(self, detector):
+        self._detector = detector
+        self._automaton = detector._automaton
+        self._state = 0
+        self._context = ""  # trailing lowercase text, for left boundaries and negations
+        self._pending = []  # matches waiting for the next character to confirm the right boundary
+        self.matches = []
+
+    def feed(self, chunk):
+        """Consume the next piece of text; returns terms confirmed by it"""
+        automaton = self._automaton
+        delta, outputs, terms = automaton.delta, automaton.outputs, automaton.terms
+        text = chunk.lower()
+        buffer = self._context + text
+        offset = len(self._context)
+        found = []
+        state = self._state
+
+        for i, ch in enumerate(text):
+            if self._pending:
+                if not _is_word_char(ch):
+                    self._confirm(found)
+                self._pending.clear()
+            state = delta[state].get(ch, 0)
+            for term_index in outputs[state]:
+                term = terms[term_index]
+                start = offset + i - len(term) + 1
+                if start > 0 and _is_word_char(buffer[start - 1]):
+                    continue
+                self._pending.append((term, buffer[max(0, start - _NEGATION_CONTEXT):start]))
+
+        self._state = state
+        self._context = buffer[-(automaton.max_length + _NEGATION_CONTEXT):]
+        return found
+
+    def finish(self):
+        """Flush matches at the very end of the text; returns terms confirmed by it"""
+        found = []
+        self._confirm(found)
+        self._pending.clear()
+        return found
+
+    def _confirm(self, found):
+        for term, preceding in self._pending:
+            if not self._detector.is_negated(preceding):
+                self.matches.append(term)
+                found.append(term)
+
+
+class EmergencyDetector:
+    """Compiled, extensible vocabulary of emergency terms"""
+
+    def __init__(self, terms=DEFAULT_EMERGENCY_TERMS, negation_cues=NEGATION_CUES, negation_fillers=NEGATION_FILLERS):
+        self.negation_cues = frozenset(negation_cues)
+        self.negation_fillers = frozenset(negation_fillers)
+        self._automaton = _Automaton(terms)
+
+    @property
+    def terms(self):
+        return self._automaton.terms
+
+    def add_terms(self, terms):
+        """Extend the vocabulary (e.g. with local-language terms)"""
+        self._automaton = _Automaton(self._automaton.terms + tuple(terms))
+
+    def is_negated(self, preceding):
+        """Whether the text right before a match negates it: a cue, then only fillers, in the same clause"""
+        clause = _CLAUSE_BREAK.split(preceding)[-1]
+        fillers = 0
+        for word in reversed(_WORD.findall(clause)):
+            if word in self.negation_cues:
+                return True
+            if word not in self.negation_fillers or fillers == NEGATION_WINDOW:
+                return False
+            fillers += 1
+        return False
+
+    def matcher(self):
+        """A fresh incremental matcher, e.g. for one streamed response"""
+        return EmergencyMatcher(self)
+
+    def find(self, text):
+        """All (non-negated) emergency terms in a complete text, in order"""
+        matcher = self.matcher()
+        matcher.feed(text)
+        matcher.finish()
+        return matcher.matches
+
+    def contains(self, text):
+        return bool(self.find(text))
+
+
+def load_terms_file(path):
+    """Read extra terms from a file, one per line ('#' starts a comment)"""
+    with open(path, encoding="utf-8") as f:
+        return [line.split("#", 1)[0].strip() for line in f if line.split("#", 1)[0].strip()]
+
+
+# Shared detector; EMERGENCY_TERMS_FILE adds site-specific vocabulary
+default_detector = EmergencyDetector()
+if os.getenv("EMERGENCY_TERMS_FILE"):
+    default_detector.add_terms(load_terms_file(os.getenv("EMERGENCY_TERMS_FILE")))
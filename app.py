@@ -1,56 +1,119 @@
 import streamlit as st
 from helpers import (
-    get_next_api_key, 
-    get_groq_client, 
-    get_assistant_response, 
-    create_patient_intake_form,
-    get_diagnostic_analysis, 
-    create_medical_report, 
     get_medical_assistant_response, 
-    check_medical_alerts, 
-    convert_md_to_html, 
-    strip_before_marker, 
-    generate_pdf_report, 
-    get_special_response, 
-    send_feedback_email,
     process_stream_with_format_enforcement,
-    API_KEYS
+    summarize_conversation,
+    get_special_response,
+    special_prefetcher
 )
+import logging
+import os
+import re
+import time
 import uuid
 from datetime import datetime
 from streamlit_option_menu import option_menu
+from conversation_store import get_store, join_questions, to_chat_history
+from message_log import MessageLog
+from context_window import ContextWindow
+from metrics import current_conversation
+from triage_classifier import pending_user_text, provisional_triage
 
-# Add key rotation counter to session state
-if "api_key_index" not in st.session_state:
-    st.session_state.api_key_index = 0
+logger = logging.getLogger(__name__)
+
+# Messages fetched from the store when a conversation is opened, and per older page
+HISTORY_PAGE_MESSAGES = 40
+
+# Turns (user/assistant pairs) shown by default; "Show older messages" adds as many again
+HISTORY_VISIBLE_TURNS = 10
+
+# Conversations shown per sidebar page ("Load more" adds another page)
+SIDEBAR_PAGE_SIZE = 20
+
+# Follow-ups offered under the latest answer (keys of SPECIAL_PROMPTS)
+FOLLOW_UPS = {
+    "clinical_reasoning": "Clinical reasoning",
+    "medical_literature": "Medical literature",
+}
+
+# Request header carrying the signed-in user when the app runs behind an
+# authenticating proxy (e.g. X-Forwarded-Email from oauth2-proxy). Without it,
+# conversations belong to the browser that holds the OWNER_COOKIE.
+OWNER_ID_HEADER = os.getenv("OWNER_ID_HEADER")
+OWNER_COOKIE = "asa_owner"
+OWNER_COOKIE_MAX_AGE = 365 * 24 * 3600
+_OWNER_TOKEN = re.compile(r"^[0-9a-f]{32}$")
+
+store = get_store()
+
+def get_owner_id():
+    """
+    Owner of this session's conversations: the authenticated user from
+    OWNER_ID_HEADER if configured, otherwise a random id kept in a browser
+    cookie (so it survives reloads and new tabs but is not in the URL). A
+    legacy ?user= id is moved into the cookie and removed from the URL.
+    """
+    if OWNER_ID_HEADER:
+        owner = st.context.headers.get(OWNER_ID_HEADER)
+        if not owner:
+            st.error("Sign-in required.")
+            st.stop()
+        return f"user:{owner}"
+
+    owner = st.context.cookies.get(OWNER_COOKIE)
+    legacy = st.query_params.get("user")
+    if legacy is not None:
+        del st.query_params["user"]
+    if not _is_owner_token(owner):
+        owner = legacy if _is_owner_token(legacy) else uuid.uuid4().hex
+        # Written by main() once the page config is set
+        st.session_state.owner_cookie_pending = owner
+    return owner
+
+def _is_owner_token(value):
+    return isinstance(value, str) and _OWNER_TOKEN.match(value) is not None
+
+def persist_owner_cookie():
+    """Store a newly issued owner id in the browser cookie"""
+    owner = st.session_state.pop("owner_cookie_pending", None)
+    if owner is None:
+        return
+    # window.parent is the app page both inline (st.html) and inside a component iframe
+    script = (
+        "<script>window.parent.document.cookie = "
+        f"'{OWNER_COOKIE}={owner}; path=/; max-age={OWNER_COOKIE_MAX_AGE}; SameSite=Strict'"
+        " + (window.parent.location.protocol === 'https:' ? '; Secure' : '');</script>"
+    )
+    try:
+        st.html(script, unsafe_allow_javascript=True)
+    except TypeError:
+        # Streamlit releases before st.html could run scripts
+        import streamlit.components.v1 as components
+        components.html(script, height=0)
 
 # Initialize conversation management session states
-if "conversations" not in st.session_state:
-    st.session_state.conversations = {}
+if "owner_id" not in st.session_state:
+    st.session_state.owner_id = get_owner_id()
 if "current_conversation_id" not in st.session_state:
-    new_id = str(uuid.uuid4())
-    st.session_state.conversations[new_id] = {
-        "chat_history": [],
-        "created_at": datetime.now().strftime("%b %d, %I:%M %p"),
-        "title": "New Conversation"
-    }
-    st.session_state.current_conversation_id = new_id
+    recent = store.list_conversations(st.session_state.owner_id, limit=1)
+    if recent:
+        st.session_state.current_conversation_id = recent[0]["id"]
+    else:
+        st.session_state.current_conversation_id = store.create_conversation(st.session_state.owner_id)["id"]
+
+if "sidebar_pages" not in st.session_state:
+    st.session_state.sidebar_pages = 1
 
 # Initialize patient data session states
-if "patient_records" not in st.session_state:
-    st.session_state.patient_records = []
+if "patient_record_ids" not in st.session_state:
+    st.session_state.patient_record_ids = []
 if "patient_analyses" not in st.session_state:
     st.session_state.patient_analyses = {}
 
 def create_new_conversation():
     """Create a new conversation and set it as current"""
-    new_id = str(uuid.uuid4())
-    st.session_state.conversations[new_id] = {
-        "chat_history": [],
-        "created_at": datetime.now().strftime("%b %d, %I:%M %p"),
-        "title": "New Conversation"
-    }
-    st.session_state.current_conversation_id = new_id
+    conversation = store.create_conversation(st.session_state.owner_id)
+    set_current_conversation(conversation["id"])
 
 def set_current_conversation(conversation_id):
     """Set the current conversation to the selected one"""
@@ -58,21 +121,98 @@ def set_current_conversation(conversation_id):
 
 def delete_conversation(conversation_id):
     """Delete a conversation"""
-    if conversation_id in st.session_state.conversations:
-        # If deleting current conversation, switch to another one first
-        if conversation_id == st.session_state.current_conversation_id:
-            # Find another conversation to switch to
-            remaining_ids = [cid for cid in st.session_state.conversations.keys() if cid != conversation_id]
-            if remaining_ids:
-                st.session_state.current_conversation_id = remaining_ids[0]
-            else:
-                # Create a new conversation if we're deleting the last one
-                create_new_conversation()
-        
-        # Delete the conversation
-        del st.session_state.conversations[conversation_id]
+    # If deleting current conversation, switch to another one first
+    if conversation_id == st.session_state.current_conversation_id:
+        remaining = [
+            c for c in store.list_conversations(st.session_state.owner_id, limit=2)
+            if c["id"] != conversation_id
+        ]
+        if remaining:
+            set_current_conversation(remaining[0]["id"])
+        else:
+            # Create a new conversation if we're deleting the last one
+            create_new_conversation()
+
+    # Delete the conversation
+    store.delete_conversation(conversation_id)
+
+def get_current_chat_history():
+    """
+    Chat history of the current conversation, loaded from the store only when
+    the conversation changes and kept in session state between reruns. Only the
+    most recent HISTORY_PAGE_MESSAGES are loaded for display;
+    load_older_messages() pages further back. The LLM context does not depend
+    on them (see sync_message_log).
+    """
+    conversation_id = st.session_state.current_conversation_id
+    # Completion metrics made during this run are attributed to this conversation
+    current_conversation.set(conversation_id)
+    if st.session_state.get("chat_history_conversation_id") != conversation_id:
+        # The conversation we are leaving no longer needs its prefetched follow-ups
+        special_prefetcher.cancel(st.session_state.get("chat_history_conversation_id"))
+        messages = store.load_messages(conversation_id, limit=HISTORY_PAGE_MESSAGES)
+        st.session_state.chat_history = to_chat_history(messages)
+        st.session_state.chat_history_conversation_id = conversation_id
+        st.session_state.chat_history_oldest_id = messages[0]["id"] if messages else None
+        st.session_state.chat_history_has_older = len(messages) == HISTORY_PAGE_MESSAGES
+        st.session_state.history_visible_turns = HISTORY_VISIBLE_TURNS
+        sync_message_log()
+    return st.session_state.chat_history
+
+def sync_message_log():
+    """
+    Rebuild the LLM message log and its token-budgeted context window from the
+    conversation's saved summary and every stored message after it, however
+    much of the history is on screen. A trailing question without an answer
+    is left out: it is the prompt the next response is for.
+    """
+    conversation_id = st.session_state.current_conversation_id
+    summary, summary_through = store.load_summary(conversation_id)
+    chat_history = to_chat_history(store.load_messages(conversation_id, after_id=summary_through))
+    if chat_history and "assistant" not in chat_history[-1]:
+        chat_history = chat_history[:-1]
+    st.session_state.message_log = MessageLog.from_chat_history(chat_history)
+    st.session_state.context_window = ContextWindow(
+        st.session_state.message_log,
+        summarize_conversation,
+        summary=summary,
+        summary_through=summary_through,
+        on_summary=lambda summary, through_id: store.save_summary(conversation_id, summary, through_id)
+    )
+    st.session_state.context_window.maybe_summarize()
+
+def load_older_messages():
+    """Prepend the page of stored messages before the oldest one loaded"""
+    messages = store.load_messages(
+        st.session_state.current_conversation_id,
+        limit=HISTORY_PAGE_MESSAGES,
+        before_id=st.session_state.chat_history_oldest_id
+    )
+    st.session_state.chat_history_has_older = len(messages) == HISTORY_PAGE_MESSAGES
+    if not messages:
+        return
+    st.session_state.chat_history_oldest_id = messages[0]["id"]
+    
+    chat_history = st.session_state.chat_history
+    older = to_chat_history(messages)
+    # A page boundary can split a turn; join the halves back together
+    if chat_history and "assistant" not in older[-1]:
+        newer = chat_history.pop(0)
+        if "user" in newer:
+            newer["user"] = join_questions(older[-1]["user"], newer["user"])
+        older[-1].update(newer)
+    chat_history[:0] = older
+
+def show_older_turns():
+    """Widen the history window by HISTORY_VISIBLE_TURNS, paging in stored messages as needed"""
+    st.session_state.history_visible_turns += HISTORY_VISIBLE_TURNS
+    while (st.session_state.chat_history_has_older
+           and len(st.session_state.chat_history) < st.session_state.history_visible_turns):
+        load_older_messages()
 
 def main():
+    run_started = time.process_time()
+    
     # Set page config
     st.set_page_config(
         page_title="ASA Medical Assistant",
@@ -80,6 +220,7 @@ def main():
         layout="centered",
         initial_sidebar_state="expanded"
     )
+    persist_owner_cookie()
     
     # Add custom CSS for styling
     st.markdown("""
@@ -200,23 +341,39 @@ def main():
         
         st.divider()
         
-        # Simple sorting by ID (most recent first)
-        sorted_conversations = sorted(
-            st.session_state.conversations.items(),
-            key=lambda x: x[1]["created_at"],
-            reverse=True
+        # Filter by title or ID (a leading '#' as shown in the list is ignored)
+        search = st.text_input(
+            "Search conversations",
+            key="conversation_search",
+            placeholder="Search by title or #ID",
+            label_visibility="collapsed"
+        ).strip().lstrip("#")
+        
+        # Only a window of conversation metadata is loaded, newest first
+        window_size = SIDEBAR_PAGE_SIZE * st.session_state.sidebar_pages
+        conversations = store.list_conversations(
+            st.session_state.owner_id, limit=window_size + 1, search=search or None
         )
+        has_more = len(conversations) > window_size
+        conversations = conversations[:window_size]
+        
+        # Keep the open conversation in the menu even when it's outside the window
+        if st.session_state.current_conversation_id not in [c["id"] for c in conversations]:
+            current = store.get_conversation(st.session_state.current_conversation_id)
+            if current is not None:
+                conversations.append(current)
         
         # Prepare lists for option menu
         conv_list = []
         conv_ids = []
         
-        for conv_id, conv_data in sorted_conversations:
+        for conv_data in conversations:
+            conv_id = conv_data["id"]
             # Get a short conversation ID (first 6 characters)
             short_id = conv_id[:6]
             
             # Format creation time
-            creation_time = conv_data["created_at"]
+            creation_time = datetime.fromtimestamp(conv_data["created_at"]).strftime("%b %d, %I:%M %p")
             
             # Create simple text-based title
             title = f"#{short_id} • {creation_time}"
@@ -264,11 +421,15 @@ def main():
                 set_current_conversation(selected_conv_id)
                 st.rerun()
         
+        if has_more and st.button("Load more", key="load_more_conversations"):
+            st.session_state.sidebar_pages += 1
+            st.rerun()
+        
         # Bottom section for delete button
         st.markdown("<div style='position: fixed; bottom: 20px; width: 85%;'>", unsafe_allow_html=True)
         
         # Delete conversation button
-        if st.session_state.conversations and len(st.session_state.conversations) > 1:
+        if store.count_conversations(st.session_state.owner_id) > 1:
             if st.button('Delete chat', type="secondary"):
                 delete_conversation(st.session_state.current_conversation_id)
                 st.rerun()
@@ -283,36 +444,77 @@ def main():
     """, unsafe_allow_html=True)
     
     # Get current conversation data
-    current_chat_history = st.session_state.conversations[st.session_state.current_conversation_id]["chat_history"]
+    current_chat_history = get_current_chat_history()
     
     # Create a container for chat messages
     chat_container = st.container()
     
-    # Display the chat history
+    # Display the most recent turns; older ones only on request
     with chat_container:
-        if current_chat_history:
-            for msg_pair in current_chat_history:
-                # User message
-                if "user" in msg_pair and msg_pair["user"]:
-                    with st.chat_message("user", avatar=":material/face:"):
-                        st.markdown(msg_pair["user"])
-                
-                # Assistant message
-                if "assistant" in msg_pair and msg_pair["assistant"]:
-                    with st.chat_message("assistant", avatar=":material/health_and_safety:"):
-                        # Use markdown rendering explicitly to handle the structured format
-                        st.markdown(msg_pair["assistant"])
-        else:
-            # Intro if chat_history is empty
-            with st.chat_message("assistant", avatar=":material/health_and_safety:"):
-                st.markdown("Welcome to ASA Medical Assistant! How can I help you today?")
+        hidden_turns = len(current_chat_history) - st.session_state.history_visible_turns
+        if hidden_turns > 0 or st.session_state.chat_history_has_older:
+            if st.button("Show older messages", key="show_older_messages", type="tertiary"):
+                show_older_turns()
+        
+        visible_from = max(0, len(current_chat_history) - st.session_state.history_visible_turns)
+        for msg_pair in current_chat_history[visible_from:]:
+            render_message(msg_pair)
+    
+    # Messages up to here are rendered by this full run; chat_area() renders the rest
+    st.session_state.full_run_history_len = len(current_chat_history)
+    
+    chat_area()
+    log_run_cost("full run", run_started)
+
+def render_message(msg_pair):
+    """Render one user/assistant message pair"""
+    # User message
+    if "user" in msg_pair and msg_pair["user"]:
+        with st.chat_message("user", avatar=":material/face:"):
+            st.markdown(msg_pair["user"])
+    
+    # Assistant message
+    if "assistant" in msg_pair and msg_pair["assistant"]:
+        with st.chat_message("assistant", avatar=":material/health_and_safety:"):
+            # Use markdown rendering explicitly to handle the structured format
+            st.markdown(msg_pair["assistant"])
+
+def log_run_cost(kind, started):
+    """Log the server CPU time spent in a script or fragment run"""
+    logger.info("%s: %.1f ms CPU", kind, (time.process_time() - started) * 1000)
+
+@st.fragment
+def chat_area():
+    """
+    The live tail of the conversation. Sending a message only re-executes this
+    fragment, so the CSS, sidebar and the history rendered by the last full
+    run are not re-sent; only messages added since then are rendered here.
+    """
+    run_started = time.process_time()
+    current_chat_history = get_current_chat_history()
+    
+    # Messages added by earlier runs of this fragment
+    for msg_pair in current_chat_history[st.session_state.full_run_history_len:]:
+        render_message(msg_pair)
     
     # Chat input at the bottom
     prompt = st.chat_input("Enter your medical query...")
     if prompt:
-        # Add user message to chat history and rerun to show it immediately
-        current_chat_history.append({"user": prompt})
-        st.rerun()
+        # Add user message to chat history and show it immediately
+        special_prefetcher.cancel(st.session_state.current_conversation_id)
+        user_id = store.append_message(st.session_state.current_conversation_id, "user", prompt)
+        last_message = current_chat_history[-1] if current_chat_history else {}
+        if "user" in last_message and "assistant" not in last_message:
+            # The previous question was never answered: answer both as one turn, as a reload would
+            last_message.update(user=join_questions(last_message["user"], prompt), user_id=user_id)
+        else:
+            current_chat_history.append({"user": prompt, "user_id": user_id})
+        render_message({"user": prompt})
+    
+    if not current_chat_history:
+        # Intro if chat_history is empty
+        with st.chat_message("assistant", avatar=":material/health_and_safety:"):
+            st.markdown("Welcome to ASA Medical Assistant! How can I help you today?")
 
     # Check if we need to generate a response
     if current_chat_history and "user" in current_chat_history[-1]:
@@ -320,24 +522,115 @@ def main():
         if "assistant" not in last_message:  # Only respond if we haven't already
             # Create a placeholder for the streaming response
             with st.chat_message("assistant", avatar=":material/health_and_safety:"):
+                alert_placeholder = st.empty()
+                provisional_placeholder = st.empty()
                 message_placeholder = st.empty()
                 
-                # Process streaming response
-                response_stream = get_medical_assistant_response(
-                    last_message["user"],
-                    current_chat_history
+                # Instant estimate from the local classifier (if one is trained) while the LLM answers
+                provisional = provisional_triage(
+                    pending_user_text(st.session_state.message_log.projection(), last_message["user"])
                 )
+                if provisional is not None:
+                    provisional_placeholder.caption(f"Provisional (local model): {describe_provisional(provisional)}")
                 
-                # Process the streaming response with format enforcement
-                formatted_response = process_stream_with_format_enforcement(
-                    response_stream, 
-                    message_placeholder
+                try:
+                    # Process streaming response
+                    started_at = time.perf_counter()
+                    response_stream = get_medical_assistant_response(
+                        last_message["user"],
+                        st.session_state.context_window
+                    )
+                    
+                    # Process the streaming response with format enforcement
+                    formatted_response = process_stream_with_format_enforcement(
+                        response_stream, 
+                        message_placeholder,
+                        started_at=started_at,
+                        alert_placeholder=alert_placeholder
+                    )
+                except Exception:
+                    # Keys/models failing or behind open circuit breakers: the question stays
+                    # unanswered (retried on the next run, or joined with the next message)
+                    # instead of crashing the page
+                    logger.exception("triage response failed")
+                    if provisional is not None:
+                        provisional_placeholder.empty()
+                        message_placeholder.warning(
+                            "The assistant is unreachable right now. Offline estimate from the local model: "
+                            f"{describe_provisional(provisional)}. Please try again for a full triage."
+                        )
+                    else:
+                        message_placeholder.error(
+                            "The assistant is temporarily unavailable. Please try again in a moment."
+                        )
+                else:
+                    provisional_placeholder.empty()
+                    # Add the formatted response to chat history
+                    assistant_id = store.append_message(
+                        st.session_state.current_conversation_id, "assistant", formatted_response
+                    )
+                    current_chat_history[-1].update(assistant=formatted_response, assistant_id=assistant_id)
+                    st.session_state.message_log.append_turn(
+                        last_message["user"], formatted_response, last_message.get("user_id"), assistant_id
+                    )
+                    # Start the follow-ups clinicians usually ask for next (if prefetching is enabled)
+                    special_prefetcher.schedule(
+                        st.session_state.current_conversation_id,
+                        len(st.session_state.message_log),
+                        st.session_state.context_window
+                    )
+                    st.session_state.context_window.maybe_summarize()
+    
+    if current_chat_history and "assistant" in current_chat_history[-1]:
+        follow_ups()
+    
+    log_run_cost("chat fragment run", run_started)
+
+def describe_provisional(provisional):
+    """'Cardiology (81%), URGENT (64%)' for a triage_classifier prediction"""
+    urgency = f"{provisional['urgency']} ({provisional['urgency_confidence']:.0%})"
+    if provisional["department"] is None:
+        return urgency
+    return f"{provisional['department']} ({provisional['department_confidence']:.0%}), {urgency}"
+
+def follow_ups():
+    """
+    Clinical reasoning / medical literature on the latest answer. The last one
+    requested is kept (not stored) until the conversation moves on.
+    """
+    conversation_id = st.session_state.current_conversation_id
+    turn = len(st.session_state.message_log)
+    shown = st.session_state.get("follow_up")
+    if shown is not None and (shown["conversation_id"], shown["turn"]) != (conversation_id, turn):
+        shown = st.session_state.follow_up = None
+    
+    columns = st.columns(len(FOLLOW_UPS))
+    for column, (prompt_type, label) in zip(columns, FOLLOW_UPS.items()):
+        if column.button(label, key=f"follow_up_{prompt_type}", type="secondary"):
+            with st.chat_message("assistant", avatar=":material/health_and_safety:"):
+                st.markdown(f"**{label}**")
+                message_placeholder = st.empty()
+                started_at = time.perf_counter()
+                response_stream = get_special_response(
+                    prompt_type,
+                    st.session_state.context_window,
+                    conversation_id=conversation_id,
+                    turn=turn
                 )
-                
-                # Add the formatted response to chat history
-                current_chat_history[-1]["assistant"] = formatted_response
-                
-                # No longer update conversation title based on first message
+                text = process_stream_with_format_enforcement(
+                    response_stream,
+                    message_placeholder,
+                    started_at=started_at
+                )
+            st.session_state.follow_up = {
+                "conversation_id": conversation_id, "turn": turn, "prompt_type": prompt_type, "text": text
+            }
+            return
+    
+    if shown is not None:
+        with st.chat_message("assistant", avatar=":material/health_and_safety:"):
+            st.markdown(f"**{FOLLOW_UPS[shown['prompt_type']]}**")
+            st.markdown(shown["text"])
 
 if __name__ == "__main__":
     main()
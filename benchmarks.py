@@ -0,0 +1,858 @@
+"""
+Micro-benchmarks for the medical assistant.
+
+Run a single benchmark with:
+    python benchmarks.py <name> [options]
+
+Benchmarks that talk to Groq use the keys in helpers.API_KEYS and cost a
+few tokens per iteration.
+"""
+import argparse
+import statistics
+import time
+from types import SimpleNamespace
+
+
+def _percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _report(label, samples_ms):
+    """Print median / p95 / max for a list of millisecond samples"""
+    print(
+        f"{label:<28} n={len(samples_ms):<4} "
+        f"median={statistics.median(samples_ms):8.1f} ms  "
+        f"p95={_percentile(samples_ms, 95):8.1f} ms  "
+        f"max={max(samples_ms):8.1f} ms"
+    )
+
+
+def _time_to_first_token(client, model):
+    """Stream a tiny completion and return the time until the first content chunk"""
+    start = time.perf_counter()
+    stream = client.chat.completions.create(
+        messages=[{"role": "user", "content": "Reply with the single word: ok"}],
+        model=model,
+        max_tokens=5,
+        temperature=0,
+        stream=True,
+    )
+    ttft = None
+    for chunk in stream:
+        if ttft is None and chunk.choices and chunk.choices[0].delta.content:
+            ttft = time.perf_counter() - start
+    return (ttft if ttft is not None else time.perf_counter() - start) * 1000
+
+
+def bench_client_pool(args):
+    """Time-to-first-token: a new Groq client per call vs the pooled clients"""
+    from groq import Groq
+    from groq_pool import get_pooled_client
+    from helpers import API_KEYS
+
+    per_call, pooled = [], []
+    for i in range(args.iterations):
+        api_key = API_KEYS[i % len(API_KEYS)]
+
+        client = Groq(api_key=api_key)
+        per_call.append(_time_to_first_token(client, args.model))
+        client.close()
+
+        pooled.append(_time_to_first_token(get_pooled_client(api_key), args.model))
+
+    # The first pooled call per key pays the handshake too; report both views
+    _report("per-call client", per_call)
+    _report("pooled client", pooled)
+    _report("pooled client (warm)", pooled[len(API_KEYS):] or pooled)
+
+
+class _CountingPlaceholder:
+    """Stands in for st.empty(): counts redraws and characters sent to the browser"""
+
+    def __init__(self):
+        self.renders = 0
+        self.chars_sent = 0
+
+    def markdown(self, text):
+        self.renders += 1
+        self.chars_sent += len(text)
+
+
+def _fake_chunks(count, delay):
+    for i in range(count):
+        if delay:
+            time.sleep(delay)
+        delta = SimpleNamespace(content=f"tok{i % 10} ")
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=None)], x_groq=None)
+
+
+def bench_stream_render(args):
+    """Per-token redraws (old loop) vs the throttled StreamRenderer on a 1024-token stream"""
+    from helpers import process_stream_with_format_enforcement
+
+    tokens, delay = 1024, args.token_delay_ms / 1000
+
+    placeholder = _CountingPlaceholder()
+    start = time.perf_counter()
+    full_response = ""
+    for chunk in _fake_chunks(tokens, delay):
+        if chunk.choices[0].delta.content is not None:
+            full_response += chunk.choices[0].delta.content
+            placeholder.markdown(full_response + "\u258c")
+    placeholder.markdown(full_response)
+    elapsed = time.perf_counter() - start
+    print(f"per-token redraw   renders={placeholder.renders:<5} chars_sent={placeholder.chars_sent:<9} {elapsed * 1000:8.1f} ms")
+
+    placeholder = _CountingPlaceholder()
+    start = time.perf_counter()
+    process_stream_with_format_enforcement(_fake_chunks(tokens, delay), placeholder)
+    elapsed = time.perf_counter() - start
+    print(f"StreamRenderer     renders={placeholder.renders:<5} chars_sent={placeholder.chars_sent:<9} {elapsed * 1000:8.1f} ms")
+
+
+def _synthetic_report(index):
+    analysis = (
+        "**Potential Diagnoses:**\n"
+        + "\n".join(f"* **Condition {i}** - supporting findings for patient {index}" for i in range(8))
+        + "\n\n**Recommended Department:** Internal Medicine\n"
+        + "Notable observations about the patient's condition. " * 30
+    )
+    patient_data = {
+        "name": f"Patient {index}",
+        "date": "2025-01-01",
+        "gender": "Female" if index % 2 else "Male",
+        "age": 20 + index % 60,
+        "height": 170.0,
+        "weight": 70.0,
+        "temperature": 37.2,
+        "blood_pressure": "120/80",
+        "heart_rate": 72,
+        "oxygen_saturation": 98,
+        "medical_conditions": ["Hypertension"],
+        "medications": "Lisinopril 10mg",
+        "allergies": "",
+        "symptoms": "Persistent cough and mild fever for three days.",
+    }
+    return patient_data, analysis
+
+
+def _peak_rss_mb():
+    import resource
+
+    # ru_maxrss is reported in kilobytes on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, children
+
+
+def bench_pdf_reports(args):
+    """Render N synthetic reports: serially, on a process pool, and as one merged PDF"""
+    import os
+    import re
+    import tempfile
+
+    from reports import generate_pdf_report, render_reports, write_merged_report
+
+    count = args.reports
+    page_marker = re.compile(rb"/Type /Page\b(?!s)")
+
+    start = time.perf_counter()
+    pages = sum(len(page_marker.findall(generate_pdf_report(*_synthetic_report(i)))) for i in range(count))
+    elapsed = time.perf_counter() - start
+    print(f"serial        {count} reports  {pages} pages  {pages / elapsed:8.1f} pages/s")
+
+    start = time.perf_counter()
+    pages = sum(
+        len(page_marker.findall(pdf))
+        for pdf in render_reports((_synthetic_report(i) for i in range(count)), workers=args.workers)
+    )
+    elapsed = time.perf_counter() - start
+    print(f"process pool  {count} reports  {pages} pages  {pages / elapsed:8.1f} pages/s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "merged.pdf")
+        start = time.perf_counter()
+        pages = write_merged_report((_synthetic_report(i) for i in range(count)), path)
+        elapsed = time.perf_counter() - start
+    print(f"merged PDF    {count} reports  {pages} pages  {pages / elapsed:8.1f} pages/s")
+
+    own, children = _peak_rss_mb()
+    print(f"peak RSS: main process {own:.0f} MB, largest worker {children:.0f} MB")
+
+
+def _legacy_check_medical_alerts(text):
+    """check_medical_alerts as it was before the compiled detector"""
+    emergency_keywords = [
+        "stroke", "heart attack", "myocardial infarction", "sepsis",
+        "anaphylaxis", "pulmonary embolism", "meningitis", "acute",
+        "immediate", "emergency", "urgent", "critical"
+    ]
+    return any(keyword in text.lower() for keyword in emergency_keywords)
+
+
+# (text, terms the detector must report); a negation only covers its own noun phrase
+ALERT_CASES = (
+    ("Do not delay, seek emergency care now.", ["emergency"]),
+    ("No fever, but acute chest pain", ["acute"]),
+    ("No signs of stroke.", []),
+    ("This is not an emergency.", []),
+)
+
+
+def bench_alerts(args):
+    """
+    Emergency detection on long histories: one-shot scans and per-chunk
+    streaming. Exits non-zero if a sentence in ALERT_CASES is misread.
+    """
+    import sys
+    from alerts import default_detector
+
+    failed = [(text, expected) for text, expected in ALERT_CASES if default_detector.find(text) != expected]
+    for text, expected in failed:
+        print(f"FAIL  {text!r}: expected {expected}, got {default_detector.find(text)}")
+    if failed:
+        sys.exit(1)
+    print(f"{len(ALERT_CASES)} alert cases ok")
+
+    turn = (
+        "### Reported Symptoms\n* Mild headache - 2 days - moderate\n* Fatigue - 1 week - mild\n\n"
+        "### Red Flags\n* None identified\n\n### Recommendation\nFamily medicine at ASA bolnica\n\n"
+    )
+    history = turn * args.turns
+    print(f"history: {args.turns} turns, {len(history)} characters, no emergency terms")
+
+    iterations = 20
+    start = time.perf_counter()
+    for _ in range(iterations):
+        _legacy_check_medical_alerts(history)
+    legacy_ms = (time.perf_counter() - start) / iterations * 1000
+    start = time.perf_counter()
+    for _ in range(iterations):
+        default_detector.contains(history)
+    compiled_ms = (time.perf_counter() - start) / iterations * 1000
+    print(f"one-shot scan     substring any(): {legacy_ms:8.3f} ms   Aho-Corasick: {compiled_ms:8.3f} ms")
+
+    # Streaming: to raise a banner mid-stream the old check has to rescan the whole text per chunk
+    chunks = [history[i:i + 4] for i in range(0, min(len(history), 4096), 4)]
+    start = time.perf_counter()
+    text = ""
+    for chunk in chunks:
+        text += chunk
+        _legacy_check_medical_alerts(text)
+    legacy_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    matcher = default_detector.matcher()
+    for chunk in chunks:
+        matcher.feed(chunk)
+    matcher.finish()
+    compiled_ms = (time.perf_counter() - start) * 1000
+    print(f"1024-token stream rescan per chunk: {legacy_ms:8.3f} ms   incremental: {compiled_ms:8.3f} ms")
+
+
+# (prompt, expected tier) for a short answer to the assistant's questions
+ROUTING_CASES = (
+    ("no, since Tuesday", "fast"),
+    ("yes, mostly at night", "fast"),
+    ("I cannot breathe and have chest pain", "large"),
+    ("I can't breathe", "large"),
+    ("shortness of breath when I walk", "large"),
+    ("my husband is unconscious", "large"),
+    ("severe bleeding from the cut", "large"),
+    ("her face is drooping", "large"),
+    ("I feel suicidal", "large"),
+)
+
+
+def bench_routing(args):
+    """
+    Triage routing decisions per turn. Exits non-zero if a prompt in
+    ROUTING_CASES is routed to the wrong tier.
+    """
+    import sys
+    from routing import route_triage_turn
+
+    history = [
+        {"role": "user", "content": "I have had a cough for a few days"},
+        {"role": "assistant", "content": "### Additional Information Needed\n1. Since when?\n2. Any fever?"},
+    ]
+    failed = 0
+    for prompt, expected in ROUTING_CASES:
+        route = route_triage_turn(prompt, history)
+        if route.tier != expected:
+            failed += 1
+            print(f"FAIL  {prompt!r}: expected {expected}, got {route.tier} ({route.reason})")
+    if failed:
+        sys.exit(1)
+    print(f"{len(ROUTING_CASES)} routing cases ok")
+
+    samples = []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        for prompt, _ in ROUTING_CASES:
+            route_triage_turn(prompt, history)
+        samples.append((time.perf_counter() - start) / len(ROUTING_CASES) * 1000)
+    _report("route_triage_turn", samples)
+
+
+def bench_markdown_pdf(args):
+    """Old strip+regex+single Paragraph analysis pipeline vs markdown_to_flowables on large analyses"""
+    from io import BytesIO
+
+    from reportlab.platypus import Paragraph
+
+    from reports import (
+        ANALYSIS_MARKER,
+        _new_document,
+        convert_md_to_html,
+        get_report_styles,
+        markdown_to_flowables,
+        strip_before_marker,
+    )
+
+    sections = []
+    for i in range(args.sections):
+        sections.append(
+            f"## Finding {i}\n"
+            "* **Observation** - elevated heart rate & low-grade fever\n"
+            "* Differential includes *viral* and *bacterial* causes\n"
+            "1. Order CBC\n2. Reassess in 24h\n\n"
+            "The patient reports symptoms consistent with an upper respiratory infection. " * 3 + "\n"
+        )
+    analysis = "Preamble from the model.\n" + ANALYSIS_MARKER + "\n" + "\n".join(sections)
+    styles = get_report_styles()
+    print(f"analysis: {args.sections} sections, {len(analysis)} characters")
+
+    for label, build in (
+        ("strip + regex + Paragraph", lambda: [Paragraph(
+            convert_md_to_html(strip_before_marker(analysis, ANALYSIS_MARKER)), styles["BodyText"]
+        )]),
+        ("markdown_to_flowables", lambda: markdown_to_flowables(analysis, ANALYSIS_MARKER)),
+    ):
+        start = time.perf_counter()
+        flowables = build()
+        converted = time.perf_counter()
+        count = len(flowables)
+        _new_document(BytesIO()).build(flowables)
+        built = time.perf_counter()
+        print(
+            f"{label:<26} convert {1000 * (converted - start):8.1f} ms  "
+            f"layout {1000 * (built - converted):8.1f} ms  flowables={count}"
+        )
+
+
+def _fake_triage_stream(prompt, chat_history, patient_data=None):
+    return _fake_chunks(200, 0)
+
+
+def _chat_fragment_script():
+    import app
+
+    app.st.session_state.full_run_history_len = len(app.get_current_chat_history())
+    app.chat_area()
+
+
+def _full_history_script():
+    import sys
+
+    import app
+
+    # The app before history windowing: every stored message is rendered on every run
+    app.HISTORY_PAGE_MESSAGES = None
+    app.HISTORY_VISIBLE_TURNS = 10 ** 9
+    try:
+        app.main()
+    finally:
+        # A full rerun executes the whole script, module level included, as the next import will
+        del sys.modules["app"]
+
+
+def bench_chat_rerun(args):
+    """
+    Server CPU per message on a long conversation. The baseline renders the
+    whole history on every full run, twice per message (one run to show the
+    prompt, one to stream the answer); the app now reruns only the chat
+    fragment. The windowed full run (a page load) is shown for reference.
+    """
+    import os
+    import tempfile
+    import uuid
+
+    from streamlit.testing.v1 import AppTest
+
+    tmp = tempfile.mkdtemp()
+    os.environ["CONVERSATION_DB_PATH"] = os.path.join(tmp, "bench.db")
+    import conversation_store
+    import helpers
+
+    helpers.get_medical_assistant_response = _fake_triage_stream
+    # The app folds older turns into a rolling summary; keep that offline too
+    helpers.summarize_conversation = lambda previous_summary, messages: f"{len(messages)} earlier messages"
+    store = conversation_store.ConversationStore(os.environ["CONVERSATION_DB_PATH"])
+    conversation_store._store = store
+    owner = uuid.uuid4().hex
+    conversation = store.create_conversation(owner)
+    for i in range(args.turns):
+        store.append_message(conversation["id"], "user", f"Question {i}: I have had a cough for {i} days.")
+        store.append_message(conversation["id"], "assistant", _synthetic_report(i)[1][:600])
+    print(f"conversation: {args.turns} turns")
+
+    def cpu_per_message(apptest):
+        # AppTest has no cookies; the app adopts an owner id passed as ?user=
+        apptest.query_params["user"] = owner
+        apptest.run()
+        samples = []
+        for i in range(args.iterations):
+            start = time.process_time()
+            apptest.chat_input[0].set_value(f"follow-up {i}").run()
+            samples.append((time.process_time() - start) * 1000)
+        return samples, len(apptest.markdown)
+
+    baseline_run, baseline_elements = cpu_per_message(
+        AppTest.from_function(_full_history_script, default_timeout=60)
+    )
+    _report("baseline: full history (x2)", [2 * sample for sample in baseline_run])
+    print(f"    markdown elements re-sent per run: {baseline_elements}")
+
+    full_run, full_elements = cpu_per_message(AppTest.from_file("app.py", default_timeout=60))
+    _report("windowed full run (x1)", full_run)
+    print(f"    markdown elements re-sent per run: {full_elements}")
+
+    fragment_run, fragment_elements = cpu_per_message(
+        AppTest.from_function(_chat_fragment_script, default_timeout=60)
+    )
+    _report("chat fragment (x1 per message)", fragment_run)
+    print(f"    markdown elements re-sent per run: {fragment_elements}")
+
+
+def bench_patient_query(args):
+    """'SpO2 below 92 this week': a loop over intake dicts vs the columnar store's vectorized filter"""
+    import random
+    from datetime import date, timedelta
+
+    from patient_store import PatientStore, start_of_week
+
+    rng = random.Random(0)
+    records = [
+        {
+            "name": f"Patient {i}",
+            "age": rng.randint(1, 99),
+            "date": date.today() - timedelta(days=rng.randint(0, 60)),
+            "temperature": round(rng.uniform(35.5, 40.0), 1),
+            "heart_rate": rng.randint(50, 140),
+            "blood_pressure": f"{rng.randint(90, 180)}/{rng.randint(55, 110)}",
+            "oxygen_saturation": rng.randint(85, 100),
+        }
+        for i in range(args.records)
+    ]
+    store = PatientStore(path=None)
+    store.extend(records)
+    store.frame()
+    week = start_of_week()
+    print(f"records: {args.records}")
+
+    loop, vectorized = [], []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        expected = [r for r in records if r["date"] >= week and r["oxygen_saturation"] < 92]
+        loop.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        matched = store.query(spo2_below=92, since=week)
+        vectorized.append((time.perf_counter() - start) * 1000)
+    assert len(matched) == len(expected)
+    _report("loop over dicts", loop)
+    _report("vectorized store query", vectorized)
+
+
+def bench_early_warning(args):
+    """Early-warning score throughput: one record at a time vs one vectorized batch"""
+    import numpy as np
+
+    from early_warning import score_patient, score_vitals
+
+    rng = np.random.default_rng(0)
+    n = args.rows
+    temperature = rng.normal(37.2, 1.0, n).round(1)
+    heart_rate = rng.integers(35, 170, n)
+    bp_systolic = rng.integers(70, 230, n)
+    oxygen_saturation = rng.integers(82, 101, n)
+    print(f"rows: {n}")
+
+    batch = []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        total, risk, _ = score_vitals(temperature, heart_rate, bp_systolic, oxygen_saturation)
+        batch.append((time.perf_counter() - start) * 1000)
+    _report("vectorized batch", batch)
+    print(f"    {n / (statistics.median(batch) / 1000) / 1e6:.1f} M rows/s, "
+          f"{int((risk == 3).sum())} high-risk rows")
+
+    sample = min(n, 100000)
+    records = [
+        {"temperature": t, "heart_rate": h, "bp_systolic": b, "oxygen_saturation": o}
+        for t, h, b, o in zip(temperature[:sample].tolist(), heart_rate[:sample].tolist(),
+                              bp_systolic[:sample].tolist(), oxygen_saturation[:sample].tolist())
+    ]
+    start = time.perf_counter()
+    scores = [score_patient(record)["score"] for record in records]
+    per_record = (time.perf_counter() - start) / sample * 1e6
+    assert scores == total[:sample].tolist()
+    print(f"single record (score_patient)  {per_record:.2f} us/record over {sample} records")
+
+
+def bench_message_log(args):
+    """Preparing one turn's messages: rebuilding from chat history pairs vs the incremental message log"""
+    from message_log import MessageLog
+
+    chat_history = [{"user": f"Question {i}", "assistant": f"Answer {i}"} for i in range(args.turns)]
+    log = MessageLog.from_chat_history(chat_history)
+    print(f"conversation: {args.turns} turns")
+
+    rebuild, incremental = [], []
+    for i in range(args.iterations):
+        start = time.perf_counter()
+        messages = [{"role": "system", "content": "system"}]
+        for message in chat_history:
+            if "user" in message:
+                messages.append({"role": "user", "content": message["user"]})
+            if "assistant" in message:
+                messages.append({"role": "assistant", "content": message["assistant"]})
+        messages.append({"role": "user", "content": f"follow-up {i}"})
+        rebuild.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        projected = log.messages(["system"], f"follow-up {i}")
+        incremental.append((time.perf_counter() - start) * 1000)
+        assert projected == messages
+    _report("rebuild from pairs", rebuild)
+    _report("message log", incremental)
+
+
+def bench_context_window(args):
+    """Prompt tokens and preparation time per turn: the full history vs the token-budgeted context window"""
+    from context_window import CONTEXT_PROMPT_TOKENS, ContextWindow, count_tokens
+    from message_log import MessageLog
+
+    def fake_summarize(previous_summary, messages):
+        return (previous_summary or "") + f"\n* {len(messages)} earlier messages about a persistent cough"
+
+    log = MessageLog()
+    window = ContextWindow(log, fake_summarize)
+    full_tokens, window_tokens, prepare = [], [], []
+    for i in range(args.turns):
+        prompt = f"Question {i}: the cough has lasted {i} days and gets worse at night."
+        full = log.messages(["system prompt"], prompt)
+        start = time.perf_counter()
+        windowed = window.messages(["system prompt"], prompt)
+        prepare.append((time.perf_counter() - start) * 1000)
+        full_tokens.append(sum(count_tokens(m["content"]) for m in full))
+        window_tokens.append(sum(count_tokens(m["content"]) for m in windowed))
+        log.append_turn(prompt, _synthetic_report(i)[1][:1500])
+        window.maybe_summarize()
+        window.wait()
+    print(f"conversation: {args.turns} turns, budget {CONTEXT_PROMPT_TOKENS} prompt tokens")
+    print(f"full history    last turn {full_tokens[-1]:>7} tokens  max {max(full_tokens):>7}")
+    print(f"context window  last turn {window_tokens[-1]:>7} tokens  max {max(window_tokens):>7}")
+    _report("context window prepare", prepare)
+
+
+# (department, typical complaints) for the synthetic triage corpus
+_TRIAGE_DEPARTMENTS = (
+    ("Cardiology", ("chest tightness", "palpitations", "my heart races", "swollen ankles", "short of breath on stairs")),
+    ("Neurology", ("numbness in my hand", "severe headache", "dizziness", "blurred vision", "trouble speaking")),
+    ("Gastroenterology", ("stomach pain", "heartburn", "diarrhea", "blood in stool", "nausea after meals")),
+    ("Dermatology", ("itchy rash", "a mole that changed", "red patches on skin", "hives", "dry flaky skin")),
+    ("Orthopedics", ("knee pain", "back pain after lifting", "swollen wrist", "hip pain when walking", "stiff shoulder")),
+    ("Pulmonology", ("persistent cough", "wheezing", "coughing up phlegm", "shortness of breath at night", "chest congestion")),
+    ("Emergency Department", ("crushing chest pain", "face drooping", "severe bleeding", "fainted and fell", "cannot breathe")),
+)
+
+# (urgency, phrasing that shifts it)
+_TRIAGE_URGENCY = (
+    ("EMERGENCY", ("it started suddenly an hour ago", "it is getting much worse fast", "I can barely stand")),
+    ("URGENT", ("since yesterday and worse today", "with a high fever", "the pain is severe")),
+    ("STANDARD", ("for about two weeks", "it comes and goes", "medication helps a little")),
+    ("ROUTINE", ("for months, mild", "just want a check-up", "it is not bothering me much")),
+)
+
+
+def _synthetic_triage_examples(n, seed=0):
+    """Labelled examples shaped like harvest_examples output, with 10% label noise"""
+    import random
+    rng = random.Random(seed)
+    filler = ("hello", "doctor", "I think", "also", "please help", "my name is Amra", "I am 54", "yes", "no allergies")
+    examples = []
+    for i in range(n):
+        department, complaints = rng.choice(_TRIAGE_DEPARTMENTS)
+        urgency, phrasings = rng.choice(_TRIAGE_URGENCY[1:] if department != "Emergency Department" else _TRIAGE_URGENCY[:1])
+        words = [rng.choice(complaints), rng.choice(phrasings), *rng.sample(filler, 3)]
+        if rng.random() < 0.5:
+            words.append(rng.choice(complaints))
+        rng.shuffle(words)
+        if rng.random() < 0.1:
+            urgency = rng.choice(_TRIAGE_URGENCY)[0]
+        examples.append({
+            "conversation_id": f"c{i}",
+            "text": ". ".join(words),
+            "department": department,
+            "urgency": urgency,
+        })
+    return examples
+
+
+def bench_triage_classifier(args):
+    """Training time, per-prediction latency and held-out accuracy of the local triage classifier"""
+    from triage_classifier import TriageClassifier, evaluate, format_report, split_holdout
+
+    train, test = split_holdout(_synthetic_triage_examples(args.examples))
+    start = time.perf_counter()
+    model = TriageClassifier.fit(
+        [e["text"] for e in train], [e["urgency"] for e in train], [e["department"] for e in train]
+    )
+    print(f"trained on {len(train)} examples in {time.perf_counter() - start:.2f}s "
+          f"({len(model.vocabulary)} features)")
+
+    texts = [e["text"] for e in test[:1000]]
+    model.predict(texts[0])
+    samples = []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        for text in texts:
+            model.predict(text)
+        samples.append((time.perf_counter() - start) / len(texts) * 1e6)
+    print(f"predict: median {statistics.median(samples):.1f} us/text over {len(texts)} texts x {args.iterations}")
+    print(format_report(evaluate(model, test)))
+
+
+class _SmtpStub:
+    """
+    Just enough of an SMTP server for the outbox check, in-process and without
+    dependencies: every message is recorded with the client address it came
+    from. stop() also drops open connections, like a server going down.
+    """
+
+    def __init__(self, port):
+        import socketserver
+        import threading
+
+        stub = self
+        self.messages = []  # (client address, raw message)
+        self._connections = set()
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                stub._connections.add(self.connection)
+                try:
+                    self.session()
+                finally:
+                    stub._connections.discard(self.connection)
+
+            def reply(self, line):
+                self.wfile.write(line.encode() + b"\r\n")
+
+            def session(self):
+                self.reply("220 localhost SMTP stub")
+                for raw in self.rfile:
+                    command = raw.decode("utf-8", "replace").strip().upper()
+                    if command.startswith(("EHLO", "HELO", "MAIL", "RCPT", "RSET", "NOOP")):
+                        self.reply("250 OK")
+                    elif command == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        lines = []
+                        for line in self.rfile:
+                            if line.rstrip(b"\r\n") == b".":
+                                break
+                            lines.append(line[1:] if line.startswith(b"..") else line)
+                        stub.messages.append((self.client_address, b"".join(lines)))
+                        self.reply("250 OK")
+                    elif command == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("502 Command not implemented")
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self._server = Server(("127.0.0.1", port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="smtp-stub", daemon=True).start()
+
+    def stop(self):
+        import socket
+
+        self._server.shutdown()
+        self._server.server_close()
+        for connection in list(self._connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
+
+
+def bench_feedback_outbox(args):
+    """
+    The feedback outbox against an in-process SMTP stub: enqueue latency,
+    --iterations quick submissions arriving as one digest, the next batch
+    reusing that SMTP connection, and a send made while the server is down
+    being retried. Exits non-zero if a check fails.
+    """
+    import os
+    import socket
+    import sys
+    import tempfile
+
+    from feedback_outbox import FeedbackOutbox, retry_delay
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    failures = []
+
+    def check(ok, label):
+        print(f"{label}: {'ok' if ok else 'FAILED'}")
+        if not ok:
+            failures.append(label)
+
+    def wait_for(condition, timeout):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return condition()
+
+    server = _SmtpStub(port)
+    outbox = FeedbackOutbox(
+        os.path.join(tempfile.mkdtemp(), "outbox.db"), sender="feedback@localhost",
+        host="127.0.0.1", port=port, starttls=False, batch_window=0.5, batch_size=args.iterations
+    )
+    outbox.start()
+    chat_history = [{"user": "I have a cough", "assistant": "How long have you had it?"}]
+    samples = []
+    for i in range(args.iterations):
+        start = time.perf_counter()
+        outbox.enqueue(chat_history, f"feedback {i}")
+        samples.append((time.perf_counter() - start) * 1000)
+    _report("enqueue", samples)
+
+    outbox.flush()
+    check(
+        len(server.messages) == 1 and f"Digest ({args.iterations} items)".encode() in server.messages[0][1],
+        f"{args.iterations} submissions arrive as one digest"
+    )
+    outbox.enqueue(chat_history, "one more")
+    outbox.flush()
+    check(
+        len(server.messages) == 2 and server.messages[0][0] == server.messages[1][0],
+        "next batch reuses the SMTP connection"
+    )
+
+    # Server down: the send fails and stays queued, then goes out once it is back
+    outbox.stop()
+    server.stop()
+    outbox.start()
+    outbox.enqueue(chat_history, "sent while the server is down")
+    outbox.flush()
+    stats = outbox.stats()
+    check(stats["pending"] == 1 and stats["sent"] == args.iterations + 1, "failed send stays queued")
+    server = _SmtpStub(port)
+    check(
+        wait_for(lambda: outbox.stats()["sent"] == args.iterations + 2, retry_delay(1) + 10),
+        "failed send is retried"
+    )
+    outbox.stop()
+    server.stop()
+    if failures:
+        sys.exit(1)
+
+
+# Modules the app must not import at startup; they load on first use
+LAZY_MODULES = ("groq", "httpx", "pandas", "numpy", "reportlab", "smtplib", "tokenizers")
+
+
+def _import_times(statement):
+    """(cumulative microseconds per top-level module, names of all imported modules) from python -X importtime"""
+    import subprocess
+    import sys
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True, text=True, check=True
+    )
+    cumulative, imported = {}, set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, self_us, cumulative_us, name = (part for part in line.replace("import time:", "|", 1).split("|"))
+        imported.add(name.strip())
+        if not name.startswith("  "):
+            cumulative[name.strip()] = int(cumulative_us)
+    return cumulative, imported
+
+
+def bench_import_time(args):
+    """
+    Cold import of app.py with Streamlit already loaded (as under 'streamlit run').
+    Exits non-zero if the median exceeds --budget-ms or a LAZY_MODULES entry is imported.
+    """
+    import sys
+
+    samples, imported = [], set()
+    for _ in range(args.iterations):
+        cumulative, imported = _import_times("import streamlit; import app")
+        samples.append(cumulative["app"] / 1000)
+    _report("import app", samples)
+
+    eager = sorted(module for module in LAZY_MODULES if module in imported)
+    over_budget = statistics.median(samples) > args.budget_ms
+    print(f"budget: {args.budget_ms:.0f} ms ({'over' if over_budget else 'ok'})")
+    if eager:
+        print(f"imported at startup but should load lazily: {', '.join(eager)}")
+    if over_budget or eager:
+        sys.exit(1)
+
+
+BENCHMARKS = {
+    "client-pool": bench_client_pool,
+    "stream-render": bench_stream_render,
+    "pdf-reports": bench_pdf_reports,
+    "alerts": bench_alerts,
+    "routing": bench_routing,
+    "markdown-pdf": bench_markdown_pdf,
+    "chat-rerun": bench_chat_rerun,
+    "patient-query": bench_patient_query,
+    "early-warning": bench_early_warning,
+    "message-log": bench_message_log,
+    "context-window": bench_context_window,
+    "import-time": bench_import_time,
+    "triage-classifier": bench_triage_classifier,
+    "feedback-outbox": bench_feedback_outbox,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--model", default="llama3-70b-8192")
+    parser.add_argument("--reports", type=int, default=1000, help="number of synthetic PDF reports")
+    parser.add_argument("--workers", type=int, help="process pool size (default: CPU count)")
+    parser.add_argument("--sections", type=int, default=200, help="sections in the synthetic analysis")
+    parser.add_argument("--records", type=int, default=200000, help="synthetic patient records for store benchmarks")
+    parser.add_argument("--rows", type=int, default=1000000, help="synthetic vitals rows for scoring benchmarks")
+    parser.add_argument("--budget-ms", type=float, default=150.0, help="import-time budget for app.py")
+    parser.add_argument("--examples", type=int, default=20000, help="synthetic labelled triage examples")
+    parser.add_argument("--turns", type=int, default=200, help="conversation length for history benchmarks")
+    parser.add_argument("--token-delay-ms", type=float, default=4.0, help="simulated gap between streamed tokens")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Headless bulk diagnostic analysis of patient intakes.
+
+Reads a CSV or JSONL file of patient records, runs get_diagnostic_analysis
+on them with bounded concurrency (the key scheduler spreads the calls over
+all API keys) and appends one JSON line per record to the output file. The
+output doubles as a checkpoint: re-running the same command skips every
+record that already has a result, so a crash never re-bills finished rows.
+Every result carries the record's early-warning score; records whose vitals
+alone are an emergency get a templated assessment without an LLM call.
+
+    python bulk_analysis.py intakes.csv --output results.jsonl --pdf-dir reports/
+
+CSV columns follow the intake form: name, age, gender, height, weight, date,
+medical_conditions (';'-separated), medications, allergies, symptoms,
+temperature, heart_rate, blood_pressure ('120/80') or bp_systolic and
+bp_diastolic, oxygen_saturation, and an optional record_id.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from early_warning import score_patient, should_skip_analysis
+from helpers import API_KEYS, generate_pdf_report, get_diagnostic_analysis
+from metrics import percentile
+from patient_store import to_patient_data, to_row
+
+
+def read_records(path):
+    """Yield raw records from a .csv or .jsonl file"""
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def record_id(record):
+    """The record's own id if it has one, otherwise a hash of its contents"""
+    explicit = record.get("record_id") or record.get("id")
+    if explicit:
+        return str(explicit)
+    canonical = json.dumps(record, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def load_finished_ids(output_path):
+    """Record ids that already have a successful result in the output file"""
+    finished = set()
+    if os.path.exists(output_path):
+        with open(output_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave a torn last line; that record is simply redone
+                    continue
+                if "analysis" in result:
+                    finished.add(result["record_id"])
+    return finished
+
+
+def analyze_record(rid, record, pdf_dir):
+    """
+    Run the diagnostic analysis (and optional PDF) for one raw record. A record
+    that can't be converted (e.g. age="abc") gets an error line like any other failure.
+    """
+    start = time.perf_counter()
+    result = {"record_id": rid}
+    try:
+        # The same conversion as records read back from the patient store
+        patient_data = to_patient_data(to_row(dict(record, record_id=rid)))
+        result["early_warning"] = score_patient(patient_data)
+        analysis = get_diagnostic_analysis(patient_data)
+        result["analysis"] = analysis
+        if pdf_dir:
+            pdf_path = os.path.join(pdf_dir, f"{rid}.pdf")
+            with open(pdf_path, "wb") as f:
+                f.write(generate_pdf_report(patient_data, analysis))
+            result["pdf"] = pdf_path
+    except Exception as e:
+        result["error"] = str(e)
+    result["latency_s"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def run(input_path, output_path, pdf_dir=None, concurrency=None):
+    """Analyze every unfinished record and return a summary dict"""
+    concurrency = concurrency or len(API_KEYS)
+    if pdf_dir:
+        os.makedirs(pdf_dir, exist_ok=True)
+
+    finished = load_finished_ids(output_path)
+    latencies = []
+    counts = {"done": 0, "failed": 0, "skipped": 0, "prescreened": 0}
+    write_lock = threading.Lock()
+    start = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+
+        def collect(future):
+            result = future.result()
+            with write_lock:
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                os.fsync(out.fileno())
+            if "error" in result:
+                counts["failed"] += 1
+            elif should_skip_analysis(result["early_warning"]):
+                counts["prescreened"] += 1
+            else:
+                counts["done"] += 1
+                latencies.append(result["latency_s"])
+
+        pending = set()
+        for record in read_records(input_path):
+            rid = record_id(record)
+            if rid in finished:
+                counts["skipped"] += 1
+                continue
+            # Keep only a bounded number of records in flight so huge files stream through
+            if len(pending) >= concurrency * 2:
+                completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    collect(future)
+            pending.add(pool.submit(analyze_record, rid, record, pdf_dir))
+            finished.add(rid)
+
+        for future in wait(pending).done:
+            collect(future)
+
+    elapsed = time.perf_counter() - start
+    return {
+        **counts,
+        "elapsed_s": elapsed,
+        "records_per_minute": counts["done"] / elapsed * 60 if elapsed > 0 else 0.0,
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p90_s": percentile(latencies, 90),
+        "latency_p99_s": percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="CSV or JSONL file of patient records")
+    parser.add_argument("--output", required=True, help="JSONL file for results (also the resume checkpoint)")
+    parser.add_argument("--pdf-dir", help="write a PDF report per record into this directory")
+    parser.add_argument("--concurrency", type=int, help="parallel requests (default: number of API keys)")
+    args = parser.parse_args()
+
+    summary = run(args.input, args.output, pdf_dir=args.pdf_dir, concurrency=args.concurrency)
+    print(
+        f"done={summary['done']} failed={summary['failed']} skipped={summary['skipped']} "
+        f"prescreened={summary['prescreened']} "
+        f"in {summary['elapsed_s']:.1f}s ({summary['records_per_minute']:.1f} records/min)"
+    )
+    print(
+        f"latency p50={summary['latency_p50_s']:.2f}s "
+        f"p90={summary['latency_p90_s']:.2f}s p99={summary['latency_p99_s']:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Circuit breakers for Groq API keys and models.
+
+A breaker opens after BREAKER_FAILURES consecutive failures (a model that is
+decommissioned or not found opens its breaker at once) and is skipped while
+open, so calls fail over to another key or to the model's fallback instead of
+waiting on timeouts. After the cooldown one call is let through as a
+half-open probe: success closes the breaker, failure re-opens it with the
+cooldown doubled, up to BREAKER_MAX_COOLDOWN. Auth failures count against
+a key; server errors, connection failures and unavailable models count
+against the model. A 429 counts against neither (the key scheduler handles
+it) and only frees a probe slot.
+
+key_breakers and model_breakers are shared by every session in the process;
+their state is shown on the Metrics page.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Consecutive failures that open a breaker
+BREAKER_FAILURES = int(os.getenv("GROQ_BREAKER_FAILURES", "3"))
+
+# Seconds a breaker stays open before the first half-open probe, and the cap after repeated failed probes
+BREAKER_COOLDOWN = float(os.getenv("GROQ_BREAKER_COOLDOWN", "30"))
+BREAKER_MAX_COOLDOWN = float(os.getenv("GROQ_BREAKER_MAX_COOLDOWN", "600"))
+
+
+class CircuitOpenError(Exception):
+    """Every API key or model that could serve the call is behind an open circuit breaker"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a half-open probe after the cooldown"""
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN,
+                 max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.cooldown = cooldown
+        self.retry_at = 0.0
+        self.probe_started = None
+        self.last_error = None
+        self.times_opened = 0
+
+    def available(self):
+        """True if a call may go through: closed, or open with the cooldown over and no probe running"""
+        with self._lock:
+            return self._available(time.monotonic())
+
+    def _available(self, now):
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return now >= self.retry_at
+        # Half-open: one probe at a time; a probe that never reported back is replaced after the cooldown
+        return now - self.probe_started >= self.base_cooldown
+
+    def begin(self):
+        """Mark a call as started; past the cooldown it becomes the half-open probe"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state != "closed" and self._available(now):
+                self.state = "half_open"
+                self.probe_started = now
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info("circuit breaker %s: closed", self.name)
+            self.state = "closed"
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+            self.probe_started = None
+
+    def release(self):
+        """End a call that says nothing about health (e.g. a 429); a half-open probe slot is freed"""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self.retry_at = time.monotonic()
+                self.probe_started = None
+
+    def record_failure(self, error, force_open=False):
+        """Count a failure ('error' is a short description); 'force_open' opens the breaker at once"""
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            if self.state == "half_open":
+                # The probe failed: back off further before the next one
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            elif not force_open and self.failures < self.failure_threshold:
+                return
+            if self.state != "open":
+                self.times_opened += 1
+            self.state = "open"
+            self.probe_started = None
+            self.retry_at = time.monotonic() + self.cooldown
+            logger.warning(
+                "circuit breaker %s: open for %.0fs after %d failures (%s)",
+                self.name, self.cooldown, self.failures, error
+            )
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "name": self.name,
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "retry_in_s": max(0.0, self.retry_at - now) if self.state == "open" else 0.0,
+                "times_opened": self.times_opened,
+                "last_error": self.last_error,
+            }
+
+
+class BreakerRegistry:
+    """One breaker per key or model, created on first use"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def get(self, name):
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(name, CircuitBreaker(f"{self.kind} {name}"))
+        return breaker
+
+    def snapshot(self):
+        """State of every breaker, for the Metrics page"""
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return [breaker.snapshot() for breaker in breakers]
+
+
+key_breakers = BreakerRegistry("key")
+model_breakers = BreakerRegistry("model")
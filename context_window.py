@@ -0,0 +1,185 @@
+"""
+Token-budgeted context for the triage chat.
+
+A ContextWindow wraps a conversation's MessageLog and sends at most
+CONTEXT_PROMPT_TOKENS per turn: the system prompts, a rolling summary of the
+older conversation, and as many of the newest messages as fit. After each
+reply, messages that have fallen out of the newest CONTEXT_RECENT_TOKENS are
+folded into the summary by a background thread, so the next turn never waits
+on summarization. If the summary falls behind, the oldest unsummarized
+messages are dropped rather than exceeding the budget. The summary is handed
+to an on_summary callback (the app saves it with the conversation) and a new
+window can start from it, so reopening a conversation does not summarize it
+again.
+
+Tokens are counted locally with the `tokenizers` package from the
+tokenizer.json at CONTEXT_TOKENIZER. The file is not in the repository; the
+Llama 3 tokenizer the Groq models use comes from the gated
+meta-llama/Llama-3.3-70B-Instruct repository on Hugging Face (accept its
+license first):
+
+    huggingface-cli download meta-llama/Llama-3.3-70B-Instruct tokenizer.json --local-dir .
+
+Without it, tokens are estimated at ~4 characters each and a warning is
+logged once, so leave some margin in CONTEXT_PROMPT_TOKENS.
+"""
+import contextvars
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "tokenizer.json")
+
+# Prompt tokens per turn: the 8192-token context, less a 1024-token reply and a margin
+CONTEXT_PROMPT_TOKENS = int(os.getenv("CONTEXT_PROMPT_TOKENS", "6144"))
+
+# Newest messages kept verbatim; anything older is folded into the summary
+CONTEXT_RECENT_TOKENS = int(os.getenv("CONTEXT_RECENT_TOKENS", "3072"))
+
+# Chat template tokens around each message (role header and end-of-turn)
+MESSAGE_OVERHEAD = 4
+
+SUMMARY_HEADER = "Summary of the earlier conversation:\n"
+
+_summarizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="context-summary")
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer():
+    """The local tokenizer, loaded once per process; None if unavailable"""
+    if not os.path.exists(CONTEXT_TOKENIZER):
+        logger.warning("no tokenizer at %s; estimating tokens from characters", CONTEXT_TOKENIZER)
+        return None
+    try:
+        from tokenizers import Tokenizer
+        return Tokenizer.from_file(CONTEXT_TOKENIZER)
+    except Exception:
+        logger.exception("could not load tokenizer %s; estimating tokens from characters", CONTEXT_TOKENIZER)
+        return None
+
+
+@lru_cache(maxsize=1024)
+def count_tokens(text):
+    """Tokens in 'text' plus the per-message overhead"""
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return len(text) // 4 + MESSAGE_OVERHEAD
+    return len(tokenizer.encode(text, add_special_tokens=False).ids) + MESSAGE_OVERHEAD
+
+
+class ContextWindow:
+    """A MessageLog plus a rolling summary, projected into a bounded message list"""
+
+    def __init__(self, log, summarize, prompt_budget=CONTEXT_PROMPT_TOKENS, recent_budget=CONTEXT_RECENT_TOKENS,
+                 summary=None, summary_through=None, on_summary=None):
+        """
+        'summarize(previous_summary, messages)' returns the new summary text;
+        it runs on a background thread. 'summary' restores a saved summary
+        covering the log's messages up to store id 'summary_through', and
+        on_summary(summary, through_id) is called with every new one.
+        """
+        self.log = log
+        self.summarize = summarize
+        self.prompt_budget = prompt_budget
+        self.recent_budget = recent_budget
+        self.on_summary = on_summary
+        self._lock = threading.Lock()
+        self._summary = summary
+        self._summarized = 0  # leading log messages covered by the summary
+        if summary and summary_through is not None:
+            while self._summarized < len(log):
+                message_id = log.message_id(self._summarized)
+                if message_id is None or message_id > summary_through:
+                    break
+                self._summarized += 1
+        self._pending = None
+        self._tokens = []  # token count per log message, extended as the log grows
+
+    def _token_counts(self):
+        projection = self.log.projection()
+        for message in projection[len(self._tokens):]:
+            self._tokens.append(count_tokens(message["content"]))
+        return projection, self._tokens
+
+    def _tail_start(self, projection, tokens, stop, budget):
+        """Index of the oldest message (not before 'stop') such that the tail fits 'budget', starting on a user turn"""
+        first = len(projection)
+        while first > stop and tokens[first - 1] <= budget:
+            budget -= tokens[first - 1]
+            first -= 1
+        while first < len(projection) and projection[first]["role"] != "user":
+            first += 1
+        return first
+
+    def projection(self):
+        """The whole (unbudgeted) log as API messages"""
+        return self.log.projection()
+
+    def messages(self, system=(), prompt=None):
+        """Messages for one completion, like MessageLog.messages but within the token budget"""
+        projection, tokens = self._token_counts()
+        with self._lock:
+            summary, summarized = self._summary, self._summarized
+
+        system = list(system)
+        if summary:
+            system.append(SUMMARY_HEADER + summary)
+        budget = self.prompt_budget - sum(count_tokens(content) for content in system)
+        if prompt is not None:
+            budget -= count_tokens(prompt)
+
+        first = self._tail_start(projection, tokens, summarized, budget)
+        if first > summarized:
+            logger.info("context: %d messages not yet summarized were left out", first - summarized)
+
+        messages = [{"role": "system", "content": content} for content in system]
+        messages += projection[first:]
+        if prompt is not None:
+            messages.append({"role": "user", "content": prompt})
+        return messages
+
+    def maybe_summarize(self):
+        """
+        Fold messages older than the newest recent_budget tokens into the
+        summary on a background thread. Call after each reply.
+        """
+        projection, tokens = self._token_counts()
+        with self._lock:
+            if self._pending is not None:
+                return
+            summarized = self._summarized
+            keep = self._tail_start(projection, tokens, summarized, self.recent_budget)
+            if keep <= summarized:
+                return
+            # Run in a copy of the caller's context so metrics keep the conversation
+            self._pending = _summarizer.submit(
+                contextvars.copy_context().run, self._fold, self._summary, projection[summarized:keep], keep
+            )
+
+    def _fold(self, previous_summary, messages, covered):
+        try:
+            summary = self.summarize(previous_summary, messages)
+        except Exception:
+            logger.exception("context: summarizing %d messages failed", len(messages))
+            summary = None
+        through_id = self.log.message_id(covered - 1)
+        if summary and self.on_summary is not None and through_id is not None:
+            try:
+                self.on_summary(summary, through_id)
+            except Exception:
+                logger.exception("context: saving the summary failed")
+        with self._lock:
+            if summary:
+                self._summary = summary
+                self._summarized = covered
+            self._pending = None
+
+    def wait(self, timeout=None):
+        """Block until a running summarization finishes (for tests and benchmarks)"""
+        pending = self._pending
+        if pending is not None:
+            pending.exception(timeout=timeout)
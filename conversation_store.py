@@ -0,0 +1,207 @@
+"""
+Persistent conversation store backed by SQLite.
+
+Conversations survive reloads and are shared by every Streamlit worker
+process. The database runs in WAL mode so readers never block the writer,
+and messages are only ever appended. The sidebar reads conversation metadata
+only; a conversation's messages are loaded (a page at a time) when it is
+opened. Each conversation also keeps the rolling summary of its older
+messages, so reopening it does not summarize them again.
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+DEFAULT_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "conversations.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    title TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    summary TEXT,
+    summary_through INTEGER
+);
+CREATE INDEX IF NOT EXISTS conversations_by_owner ON conversations (owner, created_at);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (conversation_id, id);
+"""
+
+# Columns added after the first release, created on databases that predate them
+_ADDED_COLUMNS = {
+    "conversations": (("summary", "TEXT"), ("summary_through", "INTEGER")),
+}
+
+
+def join_questions(first, second):
+    """One question from a question that went unanswered and the one sent after it"""
+    return f"{first}\n\n{second}"
+
+
+def to_chat_history(messages):
+    """
+    Group stored messages into the {"user": ..., "assistant": ...} pairs the
+    app renders; "user_id" and "assistant_id" hold the messages' store ids.
+    Questions sent while the one before went unanswered are joined into one
+    turn, whose "user_id" is the newest of them.
+    """
+    chat_history = []
+    for message in messages:
+        last = chat_history[-1] if chat_history else None
+        if message["role"] == "user" and last is not None and "user" in last and "assistant" not in last:
+            last["user"] = join_questions(last["user"], message["content"])
+            last["user_id"] = message["id"]
+            continue
+        if message["role"] == "user" or last is None or "assistant" in last:
+            chat_history.append({})
+        chat_history[-1][message["role"]] = message["content"]
+        chat_history[-1][f"{message['role']}_id"] = message["id"]
+    return chat_history
+
+
+class ConversationStore:
+    """Conversations and their append-only message log in one SQLite file"""
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            for table, columns in _ADDED_COLUMNS.items():
+                existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+                for name, kind in columns:
+                    if name not in existing:
+                        conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {kind}")
+
+    def _connect(self):
+        """One connection per thread (sqlite3 connections can't be shared across threads)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def create_conversation(self, owner, title="New Conversation"):
+        """Create an empty conversation and return its metadata"""
+        conversation = {"id": str(uuid.uuid4()), "title": title, "created_at": time.time()}
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO conversations (id, owner, title, created_at) VALUES (?, ?, ?, ?)",
+                (conversation["id"], owner, title, conversation["created_at"]),
+            )
+        return conversation
+
+    def list_conversations(self, owner, limit=None, offset=0, search=None):
+        """
+        Metadata (id, title, created_at) of an owner's conversations, newest first.
+        'search' keeps conversations whose title contains it or whose id starts with it.
+        """
+        query = "SELECT id, title, created_at FROM conversations WHERE owner = ?"
+        params = [owner]
+        if search:
+            pattern = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            query += " AND (title LIKE ? ESCAPE '\\' OR id LIKE ? ESCAPE '\\')"
+            params += [f"%{pattern}%", f"{pattern}%"]
+        query += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
+        params += [-1 if limit is None else limit, offset]
+        return [dict(row) for row in self._connect().execute(query, params).fetchall()]
+
+    def get_conversation(self, conversation_id):
+        """Metadata of one conversation, or None if it doesn't exist"""
+        row = self._connect().execute(
+            "SELECT id, title, created_at FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def count_conversations(self, owner):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM conversations WHERE owner = ?", (owner,)
+        ).fetchone()[0]
+
+    def delete_conversation(self, conversation_id):
+        """Remove a conversation and all of its messages"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+
+    def append_message(self, conversation_id, role, content):
+        """Append one message ('user' or 'assistant') and return its id"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO messages (conversation_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                (conversation_id, role, content, time.time()),
+            )
+        return cursor.lastrowid
+
+    def load_messages(self, conversation_id, limit=None, before_id=None, after_id=None):
+        """
+        The most recent messages of a conversation in chronological order.
+        'limit' bounds the page size; pass the oldest loaded id as 'before_id'
+        to fetch the page before it. 'after_id' leaves out that message and
+        everything before it.
+        """
+        rows = self._connect().execute(
+            "SELECT id, role, content, created_at FROM messages "
+            "WHERE conversation_id = ? AND id < ? AND id > ? ORDER BY id DESC LIMIT ?",
+            (
+                conversation_id,
+                before_id if before_id is not None else 2**63 - 1,
+                after_id if after_id is not None else 0,
+                -1 if limit is None else limit,
+            ),
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def load_summary(self, conversation_id):
+        """(summary, id of the last message it covers) of a conversation; (None, None) before the first"""
+        row = self._connect().execute(
+            "SELECT summary, summary_through FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        return (row["summary"], row["summary_through"]) if row is not None else (None, None)
+
+    def save_summary(self, conversation_id, summary, through_id):
+        """Replace a conversation's rolling summary, covering its messages up to 'through_id'"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE conversations SET summary = ?, summary_through = ? WHERE id = ?",
+                (summary, through_id, conversation_id),
+            )
+
+    def iter_messages(self, batch_size=1000):
+        """Every stored message, grouped by conversation and in order within each, fetched in batches"""
+        cursor = self._connect().execute(
+            "SELECT conversation_id, id, role, content FROM messages ORDER BY conversation_id, id"
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """The process-wide store at CONVERSATION_DB_PATH"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ConversationStore()
+    return _store
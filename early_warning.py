@@ -0,0 +1,128 @@
+"""
+NEWS2-style early-warning score from the intake vitals.
+
+The form captures four of the seven NEWS2 parameters (temperature, heart
+rate, systolic blood pressure, SpO2 on scale 1), so the aggregate is a
+partial score: it can only under-call, never over-call, a patient. Batches
+are scored with np.digitize against the NEWS2 band edges; a single intake
+uses bisect on the same tables, which avoids NumPy's per-call overhead.
+
+Scores at or above EARLY_WARNING_SKIP_SCORE are clear emergencies: the
+diagnostic analysis skips the LLM call for them and returns an urgent
+templated assessment instead.
+"""
+import os
+from bisect import bisect_left
+from functools import lru_cache
+
+# Aggregate score at which the LLM analysis is skipped; 0 disables skipping
+EARLY_WARNING_SKIP_SCORE = int(os.getenv("EARLY_WARNING_SKIP_SCORE", "7"))
+
+# NEWS2 clinical risk bands, in order of the codes returned by score_vitals
+RISK_LEVELS = ("low", "low-medium", "medium", "high")
+
+# (field, label, unit, band upper bounds (inclusive), points per band)
+_PARAMETERS = (
+    ("temperature", "Temperature", "°C", (35.0, 36.0, 38.0, 39.0), (3, 1, 0, 1, 2)),
+    ("heart_rate", "Heart rate", "bpm", (40, 50, 90, 110, 130), (3, 1, 0, 1, 2, 3)),
+    ("bp_systolic", "Systolic BP", "mmHg", (90, 100, 110, 219), (3, 2, 1, 0, 3)),
+    ("oxygen_saturation", "SpO2", "%", (91, 93, 95), (3, 2, 1, 0)),
+)
+
+
+@lru_cache(maxsize=None)
+def _tables():
+    """NumPy bins and points per parameter; NumPy is only imported once a batch is scored"""
+    import numpy as np
+    bins = tuple(np.asarray(bins, dtype=np.float64) for _, _, _, bins, _ in _PARAMETERS)
+    points = tuple(np.asarray(points, dtype=np.int8) for _, _, _, _, points in _PARAMETERS)
+    return bins, points
+
+
+def _points(values, bins, points):
+    """Points per value; missing readings (NaN, or the form's default 0) score nothing"""
+    import numpy as np
+    values = np.asarray(values, dtype=np.float64)
+    scored = points[np.digitize(values, bins, right=True)]
+    return np.where(values > 0, scored, 0).astype(np.int8)
+
+
+def score_vitals(temperature, heart_rate, bp_systolic, oxygen_saturation):
+    """
+    Score scalars or equal-length arrays of vitals.
+    Returns (aggregate score, risk code into RISK_LEVELS, per-parameter points
+    as a (4, n) array in _PARAMETERS order).
+    """
+    import numpy as np
+    all_bins, all_points = _tables()
+    parameters = np.stack([
+        _points(values, bins, points)
+        for values, bins, points in zip(
+            np.broadcast_arrays(temperature, heart_rate, bp_systolic, oxygen_saturation), all_bins, all_points
+        )
+    ])
+    total = parameters.sum(axis=0, dtype=np.int8)
+    risk = np.select(
+        [total >= 7, total >= 5, parameters.max(axis=0) >= 3],
+        [3, 2, 1],
+        default=0,
+    ).astype(np.int8)
+    return total, risk, parameters
+
+
+def score_frame(frame):
+    """score_vitals over a patient store DataFrame; returns a copy with early_warning and risk columns"""
+    import numpy as np
+    columns = [
+        frame[field].to_numpy(dtype=np.float64, na_value=np.nan)
+        for field, _, _, _, _ in _PARAMETERS
+    ]
+    total, risk, _ = score_vitals(*columns)
+    return frame.assign(early_warning=total, risk=np.asarray(RISK_LEVELS)[risk])
+
+
+def score_patient(patient_data):
+    """
+    Early warning for one intake patient_data dict:
+    {"score": int, "risk": str, "triggers": ["SpO2 88 %", ...]}, where the
+    triggers are the readings that scored 3 on their own.
+    """
+    vitals = dict(patient_data)
+    if vitals.get("bp_systolic") is None:
+        # Older records only carry the 's/d' string
+        try:
+            vitals["bp_systolic"] = float(str(vitals.get("blood_pressure")).partition("/")[0])
+        except ValueError:
+            vitals["bp_systolic"] = 0
+    total, highest, triggers = 0, 0, []
+    for field, label, unit, bins, points in _PARAMETERS:
+        value = float(vitals.get(field) or 0)
+        if not value > 0:
+            continue
+        scored = points[bisect_left(bins, value)]
+        total += scored
+        highest = max(highest, scored)
+        if scored >= 3:
+            triggers.append(f"{label} {value:g} {unit}")
+    risk = 3 if total >= 7 else 2 if total >= 5 else 1 if highest >= 3 else 0
+    return {"score": total, "risk": RISK_LEVELS[risk], "triggers": triggers}
+
+
+def should_skip_analysis(warning):
+    """True when the score alone already calls for an emergency response"""
+    return EARLY_WARNING_SKIP_SCORE > 0 and warning["score"] >= EARLY_WARNING_SKIP_SCORE
+
+
+def emergency_analysis(warning):
+    """Templated assessment used in place of the LLM analysis for a clear emergency"""
+    triggers = "".join(f"\n- {trigger}" for trigger in warning["triggers"])
+    return (
+        "**Early Warning Assessment:**\n"
+        f"Early warning score {warning['score']} ({warning['risk']} clinical risk) "
+        f"from the recorded vital signs.{triggers}\n\n"
+        "**Recommendations:**\n"
+        "- Emergency assessment by a clinician with critical care competencies now.\n"
+        "- Continuous monitoring of vital signs.\n\n"
+        "Automated diagnostic analysis was skipped because the vital signs alone "
+        "meet the emergency threshold."
+    )
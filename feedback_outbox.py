@@ -0,0 +1,322 @@
+"""
+Asynchronous outbox for feedback emails.
+
+Feedback is written to a local SQLite queue and the caller returns at once; a
+background worker sends it over one authenticated SMTP connection that is
+kept open between batches. Items that arrive close together go out as a
+single digest email, and failed sends are retried with exponential backoff.
+Because the queue is on disk, feedback enqueued before a crash or restart is
+sent by the next process.
+
+The SMTP server is configurable, so a local stand-in works for testing:
+
+    python -m aiosmtpd -n -l localhost:8025
+    FEEDBACK_SMTP_HOST=localhost FEEDBACK_SMTP_PORT=8025 FEEDBACK_SMTP_STARTTLS=0
+
+'python benchmarks.py feedback-outbox' checks digests, connection reuse and
+retries against an in-process SMTP stub; it needs no extra packages.
+"""
+import logging
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from email.message import EmailMessage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTBOX_PATH = os.getenv("FEEDBACK_OUTBOX_PATH", "feedback_outbox.db")
+SMTP_HOST = os.getenv("FEEDBACK_SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("FEEDBACK_SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("FEEDBACK_SMTP_STARTTLS", "1") != "0"
+
+# Items enqueued within BATCH_WINDOW seconds of each other share one email
+BATCH_WINDOW = float(os.getenv("FEEDBACK_BATCH_WINDOW", "5"))
+BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", "20"))
+
+MAX_ATTEMPTS = int(os.getenv("FEEDBACK_MAX_ATTEMPTS", "8"))
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 600.0
+
+# An idle SMTP connection is closed after this many seconds
+IDLE_TIMEOUT = 60.0
+
+# A claimed batch whose send never finished (e.g. the process died) is retried after this
+CLAIM_TIMEOUT = 300.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    feedback TEXT NOT NULL,
+    chat_summary TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    sent_at REAL,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (sent_at, failed, next_attempt_at);
+"""
+
+
+def format_chat_summary(chat_history):
+    """Plain-text transcript of {"user": ..., "assistant": ...} pairs"""
+    return "\n".join(
+        f"User: {msg.get('user', '')}\nAssistant: {msg.get('assistant', '')}"
+        for msg in chat_history
+    )
+
+
+def retry_delay(attempts):
+    """Backoff before the next try after 'attempts' failed sends"""
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+
+
+def build_message(items, sender, recipient):
+    """One email for a batch of outbox rows; several rows become a digest"""
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = recipient
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if len(items) == 1:
+        msg["Subject"] = f"Medical Assistant Feedback - {now}"
+    else:
+        msg["Subject"] = f"Medical Assistant Feedback Digest ({len(items)} items) - {now}"
+
+    sections = []
+    for index, item in enumerate(items, 1):
+        received = datetime.fromtimestamp(item["created_at"]).strftime('%Y-%m-%d %H:%M:%S')
+        header = f"Feedback {index} of {len(items)} (received {received})" if len(items) > 1 else "New Feedback Received:"
+        sections.append(f"""{header}
+
+Feedback:
+{item['feedback']}
+
+Chat History:
+{item['chat_summary']}
+""")
+    msg.set_content(("\n" + "-" * 40 + "\n\n").join(sections))
+    return msg
+
+
+class FeedbackOutbox:
+    """Durable feedback queue drained by a background sender thread"""
+
+    def __init__(self, path=DEFAULT_OUTBOX_PATH, sender=None, password=None, recipient=None,
+                 host=SMTP_HOST, port=SMTP_PORT, starttls=SMTP_STARTTLS,
+                 batch_window=BATCH_WINDOW, batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.sender = sender
+        self.password = password
+        self.recipient = recipient or sender
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._stopping = False
+        self._worker = None
+        self._smtp = None
+        self._smtp_used_at = 0.0
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, chat_history, feedback_text):
+        """Queue one piece of feedback and return its outbox id; never blocks on SMTP"""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO outbox (created_at, feedback, chat_summary, next_attempt_at) VALUES (?, ?, ?, ?)",
+                (now, feedback_text, format_chat_summary(chat_history), now),
+            )
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+        return cursor.lastrowid
+
+    def start(self):
+        """Start the sender thread (also sends anything left over from a previous run)"""
+        with self._wakeup:
+            if self._worker is None or not self._worker.is_alive():
+                self._stopping = False
+                self._worker = threading.Thread(target=self._run, name="feedback-outbox", daemon=True)
+                self._worker.start()
+
+    def stop(self, timeout=None):
+        """Stop the sender thread and close the SMTP connection; queued items stay on disk"""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify()
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+    def flush(self, timeout=30.0):
+        """Wait until every queued item has been sent or tried once; returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self._connect().execute(
+                "SELECT 1 FROM outbox WHERE sent_at IS NULL AND failed = 0 AND attempts = 0 LIMIT 1"
+            ).fetchone():
+                return True
+            with self._wakeup:
+                self._wakeup.notify()
+            time.sleep(0.05)
+        return False
+
+    def stats(self):
+        row = self._connect().execute(
+            "SELECT SUM(sent_at IS NOT NULL), SUM(sent_at IS NULL AND failed = 0), SUM(failed) FROM outbox"
+        ).fetchone()
+        return {"sent": row[0] or 0, "pending": row[1] or 0, "failed": row[2] or 0}
+
+    def _next_due_at(self):
+        row = self._connect().execute(
+            "SELECT MIN(next_attempt_at) FROM outbox WHERE sent_at IS NULL AND failed = 0"
+        ).fetchone()
+        return row[0]
+
+    def _claim_batch(self):
+        """Lease up to batch_size due rows so no other process sends them too"""
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT * FROM outbox WHERE sent_at IS NULL AND failed = 0 AND next_attempt_at <= ? "
+                "ORDER BY id LIMIT ?",
+                (now, self.batch_size),
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE outbox SET next_attempt_at = ? WHERE id = ?",
+                    [(now + CLAIM_TIMEOUT, row["id"]) for row in rows],
+                )
+        return [dict(row) for row in rows]
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                if self._stopping:
+                    break
+            due_at = self._next_due_at()
+            now = time.time()
+            if due_at is None or due_at > now:
+                if self._smtp is not None and time.monotonic() - self._smtp_used_at > IDLE_TIMEOUT:
+                    self._close_smtp()
+                wait = IDLE_TIMEOUT if due_at is None else min(IDLE_TIMEOUT, due_at - now)
+                with self._wakeup:
+                    if not self._stopping:
+                        self._wakeup.wait(wait)
+                continue
+
+            # Give feedback arriving right behind this item a chance to join the digest
+            window_ends = time.monotonic() + self.batch_window
+            with self._wakeup:
+                # New arrivals notify too, so keep waiting until the window is over
+                while not self._stopping and time.monotonic() < window_ends:
+                    self._wakeup.wait(window_ends - time.monotonic())
+            batch = self._claim_batch()
+            if batch:
+                self._send_batch(batch)
+        self._close_smtp()
+
+    def _send_batch(self, batch):
+        ids = [item["id"] for item in batch]
+        try:
+            self._send(build_message(batch, self.sender, self.recipient))
+        except Exception as e:
+            # The connection may be in an unknown state; start fresh next time
+            self._close_smtp()
+            self._record_failure(batch, e)
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE outbox SET sent_at = ?, last_error = NULL WHERE id = ?",
+                [(time.time(), item_id) for item_id in ids],
+            )
+        logger.info("feedback outbox: sent %d item(s) in one email", len(ids))
+
+    def _record_failure(self, batch, error):
+        now = time.time()
+        updates = []
+        for item in batch:
+            attempts = item["attempts"] + 1
+            failed = int(attempts >= self.max_attempts)
+            updates.append((attempts, now + retry_delay(attempts), str(error), failed, item["id"]))
+            if failed:
+                logger.error("feedback outbox: giving up on item %s after %d attempts: %s", item["id"], attempts, error)
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ?, failed = ? WHERE id = ?",
+                updates,
+            )
+        logger.warning("feedback outbox: sending %d item(s) failed, will retry: %s", len(batch), error)
+
+    def _send(self, msg):
+        smtp = self._smtp
+        if smtp is not None:
+            try:
+                smtp.send_message(msg)
+                self._smtp_used_at = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                # The server dropped the idle connection; reconnect once
+                self._close_smtp()
+        smtp = self._open_smtp()
+        smtp.send_message(msg)
+        self._smtp_used_at = time.monotonic()
+
+    def _open_smtp(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.starttls:
+            smtp.starttls()
+        smtp.ehlo_or_helo_if_needed()
+        # Local stand-ins (e.g. aiosmtpd) don't offer AUTH
+        if self.password and smtp.has_extn("auth"):
+            smtp.login(self.sender, self.password)
+        self._smtp = smtp
+        return smtp
+
+    def _close_smtp(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except Exception:
+                smtp.close()
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    """The process-wide outbox at FEEDBACK_OUTBOX_PATH, sending as FEEDBACK_EMAIL"""
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                _outbox = FeedbackOutbox(
+                    sender=os.getenv('FEEDBACK_EMAIL'),
+                    password=os.getenv('FEEDBACK_EMAIL_PASSWORD'),
+                )
+                # Send whatever a previous process left in the queue
+                if _outbox.stats()["pending"]:
+                    _outbox.start()
+    return _outbox
@@ -0,0 +1,62 @@
+"""
+Process-wide pool of long-lived Groq clients.
+
+Each API key gets exactly one Groq client backed by a persistent httpx
+connection pool, shared by every Streamlit session and worker thread, so a
+chat turn reuses a warm (keep-alive, HTTP/2 where available) connection
+instead of paying a fresh TLS handshake. The groq and httpx packages are
+imported when the first client is built, not when the app starts.
+"""
+import os
+import threading
+
+# HTTP/2 needs the optional 'h2' package; fall back to HTTP/1.1 keep-alive without it
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Connection pool sizing per API key
+MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GROQ_MAX_KEEPALIVE_CONNECTIONS", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "120"))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _build_http_client():
+    """Create the httpx client that keeps connections to Groq alive between calls"""
+    import httpx
+    return httpx.Client(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+
+
+def get_pooled_client(api_key):
+    """Return the shared Groq client for an API key, creating it on first use"""
+    client = _clients.get(api_key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(api_key)
+            if client is None:
+                from groq import Groq
+                # Retries are left to the key scheduler so a throttled key isn't retried blindly
+                client = Groq(api_key=api_key, http_client=_build_http_client(), max_retries=0)
+                _clients[api_key] = client
+    return client
+
+
+def close_all_clients():
+    """Close every pooled client and its connections (e.g. on shutdown)"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
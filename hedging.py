@@ -0,0 +1,134 @@
+"""
+Hedged streaming requests across API keys.
+
+With GROQ_HEDGE_REQUESTS=1, a streaming call whose first chunk has not
+arrived within HEDGE_PERCENTILE of the model's recent time to first token
+fires a duplicate request on a different API key (if one has headroom right
+now). Whichever attempt produces a chunk first is streamed; the other is
+closed as soon as it answers, so one slow or throttled key no longer decides
+the user's wait. Each hedging-mode request is counted in completion_metrics
+(hedge fired, which attempt won, tokens spent on the loser), to weigh the
+extra token cost against the tail latency it saves.
+"""
+import contextvars
+import os
+import threading
+import time
+
+HEDGE_REQUESTS = os.getenv("GROQ_HEDGE_REQUESTS", "0") == "1"
+
+# Recent TTFT percentile after which the duplicate request is fired
+HEDGE_PERCENTILE = float(os.getenv("GROQ_HEDGE_PERCENTILE", "90"))
+
+# Hedge delay until a model has HEDGE_MIN_SAMPLES calls, and the floor after that
+HEDGE_DEFAULT_DELAY = float(os.getenv("GROQ_HEDGE_DEFAULT_DELAY", "1.5"))
+HEDGE_MIN_DELAY = float(os.getenv("GROQ_HEDGE_MIN_DELAY", "0.1"))
+HEDGE_MIN_SAMPLES = 20
+
+# Seconds between recomputations of a model's hedge delay
+HEDGE_DELAY_REFRESH = 5.0
+
+
+class HedgeDelay:
+    """Per-model hedge delay from the recent TTFT percentile, recomputed every few seconds"""
+
+    def __init__(self, metrics, pct=HEDGE_PERCENTILE, default=HEDGE_DEFAULT_DELAY, floor=HEDGE_MIN_DELAY,
+                 min_samples=HEDGE_MIN_SAMPLES, refresh=HEDGE_DELAY_REFRESH):
+        self.metrics = metrics
+        self.pct = pct
+        self.default = default
+        self.floor = floor
+        self.min_samples = min_samples
+        self.refresh = refresh
+        self._delays = {}  # model -> (computed at, delay)
+
+    def __call__(self, model):
+        now = time.monotonic()
+        cached = self._delays.get(model)
+        if cached is not None and now - cached[0] < self.refresh:
+            return cached[1]
+        ttft = self.metrics.ttft_percentile(model, self.pct, self.min_samples)
+        delay = self.default if ttft is None else max(self.floor, ttft)
+        self._delays[model] = (now, delay)
+        return delay
+
+
+class _Race:
+    """Attempts racing for the first chunk; the first one to produce it wins"""
+
+    def __init__(self, on_loser):
+        self.on_loser = on_loser
+        self._cond = threading.Condition()
+        self._winner = None
+        self._errors = []
+        self._running = 0
+
+    def start(self, label, attempt):
+        with self._cond:
+            self._running += 1
+        # Attempts inherit the caller's context (e.g. the conversation for metrics)
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._run, label, attempt), name="hedge", daemon=True).start()
+
+    def _run(self, label, attempt):
+        try:
+            stream = iter(attempt())
+            first = next(stream, None)
+        except Exception as e:
+            with self._cond:
+                self._running -= 1
+                self._errors.append(e)
+                self._cond.notify_all()
+            return
+        with self._cond:
+            self._running -= 1
+            won = self._winner is None
+            if won:
+                self._winner = (label, stream, first)
+            self._cond.notify_all()
+        if not won:
+            if hasattr(stream, "close"):
+                stream.close()
+            self.on_loser(label)
+
+    def wait(self, timeout=None):
+        """(label, stream, first chunk) of the winner; None on timeout; the first error if every attempt failed"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._winner is None and self._running > 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            if self._winner is not None:
+                return self._winner
+            raise self._errors[0]
+
+
+def hedged_stream(primary, hedge, delay, can_hedge, on_done, on_loser):
+    """
+    Stream from primary(), firing hedge() if no chunk arrived within 'delay'
+    seconds and can_hedge() allows it. on_done(fired, winner label, ttft_s)
+    is called once the stream is finished or closed; on_loser(label) when the
+    losing attempt has been closed.
+    """
+    started = time.perf_counter()
+    race = _Race(on_loser)
+    race.start("primary", primary)
+    result = race.wait(delay)
+    fired = False
+    if result is None and can_hedge():
+        fired = True
+        race.start("hedge", hedge)
+    if result is None:
+        result = race.wait()
+    label, stream, first = result
+    ttft = time.perf_counter() - started
+    try:
+        if first is not None:
+            yield first
+            yield from stream
+    finally:
+        if hasattr(stream, "close"):
+            stream.close()
+        on_done(fired, label, ttft)
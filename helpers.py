@@ -1,14 +1,23 @@
 import streamlit as st
-from groq import Groq
 import os
-import pandas as pd
+import importlib
 from datetime import datetime
-from io import BytesIO
 import time
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import re
+import logging
+
+from groq_pool import get_pooled_client
+from key_scheduler import KeyScheduler, estimate_tokens
+from metrics import completion_metrics, start_metrics_server
+from response_cache import ResponseCache, make_cache_key, replay_completion, replay_stream
+from single_flight import SingleFlight
+from streaming import StreamRenderer
+from alerts import default_detector
+from message_log import as_message_log
+from early_warning import emergency_analysis, score_patient, should_skip_analysis
+from prefetch import SpecialResponsePrefetcher
+from routing import fallback_chain, model_for, route_triage_turn, routed_stream
+from circuit_breaker import CircuitOpenError, key_breakers, model_breakers
+from hedging import HEDGE_REQUESTS, HedgeDelay, hedged_stream
 
 # Import prompts
 from prompts import (
@@ -18,21 +27,29 @@ from prompts import (
     SPECIAL_RESPONSE_PROMPT,
     SPECIAL_PROMPTS,
     DIAGNOSTIC_ANALYSIS_TEMPLATE,
-    PATIENT_CONTEXT_TEMPLATE
+    PATIENT_CONTEXT_TEMPLATE,
+    CONVERSATION_SUMMARY_PROMPT
 )
 
-# ReportLab imports for PDF generation
-from reportlab.lib.pagesizes import LETTER, inch
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import (
-    Paragraph, 
-    SimpleDocTemplate, 
-    Spacer, 
-    Table, 
-    TableStyle
-)
+# Heavy modules load on first use, not when the app starts: groq (first
+# completion), ReportLab (reports), pandas (patient_store) and smtplib/email
+# (feedback_outbox). The PDF helpers
+# are re-exported here for existing callers and imported when first accessed.
+_LAZY_EXPORTS = {
+    "convert_md_to_html": "reports",
+    "generate_pdf_report": "reports",
+    "strip_before_marker": "reports",
+}
+
+def __getattr__(name):
+    module = _LAZY_EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+logger = logging.getLogger(__name__)
 
 # Initialize list of API keys
 API_KEYS = [
@@ -41,37 +58,317 @@ API_KEYS = [
     "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"
 ]
 
-def get_next_api_key():
-    """Rotate through API keys"""
-    current_key = API_KEYS[st.session_state.api_key_index]
-    st.session_state.api_key_index = (st.session_state.api_key_index + 1) % len(API_KEYS)
-    return current_key
+# Process-global scheduler shared by every session, so calls spread across keys by headroom
+key_scheduler = KeyScheduler(len(API_KEYS))
 
-def get_groq_client():
-    """Get Groq client with next API key"""
-    return Groq(api_key=get_next_api_key())
+# Prometheus endpoint for the completion metrics (only when METRICS_PORT is set)
+start_metrics_server()
 
-def get_assistant_response(prompt, chat_history):
-    client = get_groq_client()  # Get client with next API key
-    # Prepare messages including chat history
-    messages = [
-        {"role": "system", "content": BASIC_ASSISTANT_PROMPT}
-    ]
-    
-    # Add chat history to messages
-    for message in chat_history:
-        if "user" in message:
-            messages.append({"role": "user", "content": message["user"]})
-        if "assistant" in message:
-            messages.append({"role": "assistant", "content": message["assistant"]})
+# How long a call may wait for a key when all of them are rate limited
+KEY_QUEUE_TIMEOUT = float(os.getenv("GROQ_KEY_QUEUE_TIMEOUT", "120"))
+
+# When a hedged streaming call (GROQ_HEDGE_REQUESTS=1) fires its duplicate on another key
+hedge_delay = HedgeDelay(completion_metrics)
+
+# Identical requests in flight at the same time, across sessions, share one call
+in_flight = SingleFlight()
+
+# Completed responses, keyed on the normalized request; set RESPONSE_CACHE_PATH for a disk tier
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+    disk_path=os.getenv("RESPONSE_CACHE_PATH"),
+    disk_max_bytes=int(os.getenv("RESPONSE_CACHE_DISK_BYTES", str(64 * 1024 * 1024))),
+)
+
+def _track_stream_usage(response_stream, reservation, call):
+    """Pass a stream through, settle its reservation with the real token usage and record its metrics"""
+    key_index = reservation.key_index
+    reserved_tokens = reservation.event[1]
+    usage = None
+    error = None
+    cancelled = False
+    try:
+        for chunk in response_stream:
+            if call["ttft_s"] is None and chunk.choices and chunk.choices[0].delta.content:
+                call["ttft_s"] = time.perf_counter() - call["started"]
+            x_groq = getattr(chunk, "x_groq", None)
+            if x_groq is not None and x_groq.usage is not None:
+                usage = x_groq.usage
+            yield chunk
+    except GeneratorExit:
+        cancelled = True
+        raise
+    except Exception as e:
+        error = type(e).__name__
+        # A stream broken off mid-way is a server or connection failure, not the key's
+        model_breakers.get(call["model"]).record_failure(error)
+        raise
+    finally:
+        # Release the HTTP response when the stream is stopped early (a cancelled prefetch)
+        if hasattr(response_stream, "close"):
+            response_stream.close()
+        key_scheduler.record_usage(reservation, reserved_tokens if usage is None else usage.total_tokens)
+        completion_metrics.record(
+            call["model"],
+            key_index=key_index,
+            queue_wait_s=call["queue_wait_s"],
+            ttft_s=call["ttft_s"],
+            total_s=time.perf_counter() - call["started"],
+            prompt_tokens=usage.prompt_tokens if usage is not None else None,
+            completion_tokens=usage.completion_tokens if usage is not None else None,
+            error=error,
+            cancelled=cancelled
+        )
+
+def _cache_stream(response_stream, cache_key):
+    """Pass a stream through and cache the full text once it finishes"""
+    parts = []
+    finished = False
+    for chunk in response_stream:
+        if chunk.choices:
+            if chunk.choices[0].delta.content is not None:
+                parts.append(chunk.choices[0].delta.content)
+            if chunk.choices[0].finish_reason is not None:
+                finished = True
+        yield chunk
+    # Streams abandoned half-way are never cached
+    if finished:
+        response_cache.put(cache_key, "".join(parts))
+
+def _create_completion(cache=True, cancel=None, **params):
+    """
+    Return a chat completion (or chunk stream when stream=True), answering from
+    the response cache when an identical request has been completed before.
+    Identical requests already in flight share one upstream call. Setting the
+    'cancel' event stops a stream this call started, unless others joined it.
+    """
+    request_key = make_cache_key(params)
+    if cache:
+        cached_text = response_cache.get(request_key)
+        if cached_text is not None:
+            completion_metrics.record(params["model"], cached=True)
+            return replay_stream(cached_text) if params.get("stream") else replay_completion(cached_text)
+
+    if params.get("stream"):
+        def start():
+            response = _request_completion(**params)
+            return _cache_stream(response, request_key) if cache else response
+
+        # Keyed apart from non-streaming calls, which share the cache entry but not the flight
+        chunks, leader = in_flight.stream(("stream", request_key), start, cancel=cancel)
+    else:
+        def start():
+            response = _request_completion(**params)
+            if cache:
+                response_cache.put(request_key, response.choices[0].message.content)
+            return response
+
+        chunks, leader = in_flight.call(("call", request_key), start)
+    if not leader:
+        completion_metrics.record(params["model"], coalesced=True)
+    return chunks
+
+def _request_completion(**params):
+    """
+    Run a chat completion on the key with the most headroom, failing over to
+    another key or fallback model as described in _attempt_completion.
+    In hedging mode a streaming call whose first chunk is late is raced against
+    a duplicate on another key. Every attempt is recorded in completion_metrics.
+    """
+    if params.get("stream") and HEDGE_REQUESTS and len(API_KEYS) > 1:
+        return _hedged_request(params)
+    return _attempt_completion(params)
+
+def _hedged_request(params):
+    """Stream a completion, racing a duplicate on a different key if the first chunk is late"""
+    model = params["model"]
+    prompt_tokens = estimate_tokens(params["messages"])
+    # Keys the primary attempt has used so far; the hedge never goes to one of them
+    used_keys = set()
+    return hedged_stream(
+        primary=lambda: _attempt_completion(params, used_keys=used_keys),
+        hedge=lambda: _attempt_completion(params, exclude=set(used_keys), key_timeout=0.0, used_keys=used_keys),
+        delay=hedge_delay(model),
+        can_hedge=lambda: key_scheduler.best_headroom(
+            prompt_tokens + params.get("max_tokens", 0), exclude=used_keys
+        ) is not None,
+        on_done=lambda fired, winner, ttft: completion_metrics.record_hedge(model, fired, winner, ttft),
+        # The loser is closed at its first chunk, so its cost is about the prompt
+        on_loser=lambda label: completion_metrics.record_hedge_waste(model, prompt_tokens),
+    )
+
+# Groq error codes meaning the model itself can't serve requests
+MODEL_UNAVAILABLE_CODES = ("model_decommissioned", "model_not_found")
+
+def _is_model_unavailable(error):
+    """True for a 404 or a 400 whose error code says the model is gone"""
+    if type(error).__name__ == "NotFoundError":
+        return True
+    body = getattr(error, "body", None)
+    if isinstance(body, dict):
+        body = body.get("error", body)
+    return isinstance(body, dict) and body.get("code") in MODEL_UNAVAILABLE_CODES
+
+def _available_model(model, failed=()):
+    """The first model in the fallback chain of 'model' whose circuit breaker lets calls through"""
+    for candidate in fallback_chain(model):
+        if candidate not in failed and model_breakers.get(candidate).available():
+            if candidate != model:
+                logger.info("model %s is unavailable; failing over to %s", model, candidate)
+            return candidate
+    completion_metrics.record(model, error="CircuitOpen")
+    raise CircuitOpenError(f"No available model for {model}")
+
+def _attempt_completion(params, exclude=(), key_timeout=KEY_QUEUE_TIMEOUT, used_keys=None):
+    """
+    One completion call on the key with the most headroom (never one in
+    'exclude'). 429s are left to the key scheduler, which queues the call
+    when every key is saturated. Auth failures are the key's fault: they
+    count against its circuit breaker and the call moves to another key.
+    Server and connection failures count against the model's breaker; the
+    call retries on the other keys and then fails over along the model's
+    fallback chain, as it does at once for a decommissioned model. Keys and
+    models behind an open breaker are skipped without waiting. Keys it is
+    sent on are added to 'used_keys'.
+    """
+    from groq import (
+        APIConnectionError, AuthenticationError, BadRequestError, InternalServerError,
+        NotFoundError, PermissionDeniedError, RateLimitError
+    )
     
-    # Add current user prompt
-    messages.append({"role": "user", "content": prompt})
+    requested = params["model"]
+    params = dict(params, model=_available_model(requested))
+    reserved_tokens = estimate_tokens(params["messages"]) + params.get("max_tokens", 0)
+    failed_keys = set(exclude)  # keys this call can't use, whatever the model
+    tried_keys = set()  # keys that failed on the current model
+    failed_models = set()
+    last_error = None
+    started = time.perf_counter()
+    deadline = time.monotonic() + key_timeout
+
+    def fail_over():
+        """Parameters for the next model in the fallback chain; raises when none is left"""
+        failed_models.add(params["model"])
+        tried_keys.clear()
+        try:
+            return dict(params, model=_available_model(requested, failed_models))
+        except CircuitOpenError:
+            if last_error is not None:
+                raise last_error from None
+            raise
+
+    while True:
+        if not model_breakers.get(params["model"]).available():
+            params = fail_over()
+            continue
+        skipped_keys = failed_keys | tried_keys | {
+            index for index in range(len(API_KEYS)) if not key_breakers.get(index).available()
+        }
+        if len(skipped_keys) >= len(API_KEYS):
+            if tried_keys:
+                # Every usable key failed on this model
+                params = fail_over()
+                continue
+            if last_error is not None:
+                raise last_error
+            completion_metrics.record(params["model"], error="CircuitOpen")
+            raise CircuitOpenError("Every API key is failed or behind an open circuit breaker")
+        try:
+            reservation = key_scheduler.acquire(
+                reserved_tokens, timeout=max(0.0, deadline - time.monotonic()), exclude=skipped_keys
+            )
+        except TimeoutError:
+            completion_metrics.record(
+                params["model"], queue_wait_s=time.perf_counter() - started, error="KeyQueueTimeout"
+            )
+            raise
+        queue_wait = time.perf_counter() - started
+        key_index = reservation.key_index
+        if used_keys is not None:
+            used_keys.add(key_index)
+        key_breaker = key_breakers.get(key_index)
+        model_breaker = model_breakers.get(params["model"])
+        key_breaker.begin()
+        model_breaker.begin()
+        client = get_pooled_client(API_KEYS[key_index])
+        try:
+            raw_response = client.chat.completions.with_raw_response.create(**params)
+        except RateLimitError as e:
+            completion_metrics.record(params["model"], key_index=key_index, error=type(e).__name__)
+            key_scheduler.record_usage(reservation, 0)
+            key_scheduler.record_rate_limit(key_index, e.response.headers)
+            # Throttling says nothing about health; the scheduler now knows the key is blocked
+            key_breaker.release()
+            model_breaker.release()
+            continue
+        except (AuthenticationError, PermissionDeniedError) as e:
+            completion_metrics.record(params["model"], key_index=key_index, error=type(e).__name__)
+            key_scheduler.record_usage(reservation, 0)
+            key_breaker.record_failure(type(e).__name__)
+            model_breaker.release()
+            failed_keys.add(key_index)
+            last_error = e
+            continue
+        except (APIConnectionError, InternalServerError) as e:
+            completion_metrics.record(params["model"], key_index=key_index, error=type(e).__name__)
+            key_scheduler.record_usage(reservation, 0)
+            model_breaker.record_failure(type(e).__name__)
+            key_breaker.release()
+            tried_keys.add(key_index)
+            last_error = e
+            continue
+        except (NotFoundError, BadRequestError) as e:
+            completion_metrics.record(params["model"], key_index=key_index, error=type(e).__name__)
+            key_scheduler.record_usage(reservation, 0)
+            # The key was accepted either way
+            key_breaker.record_success()
+            if not _is_model_unavailable(e):
+                # The request itself is invalid; the model answered
+                model_breaker.record_success()
+                raise
+            # A decommissioned or unknown model won't come back by retrying: open its breaker now
+            model_breaker.record_failure(type(e).__name__, force_open=True)
+            last_error = e
+            params = fail_over()
+            continue
+        except Exception as e:
+            completion_metrics.record(params["model"], key_index=key_index, error=type(e).__name__)
+            key_scheduler.record_usage(reservation, 0)
+            key_breaker.release()
+            model_breaker.release()
+            raise
+
+        key_breaker.record_success()
+        model_breaker.record_success()
+        key_scheduler.record_headers(key_index, raw_response.headers)
+        response = raw_response.parse()
+        if params.get("stream"):
+            call = {"model": params["model"], "started": started, "queue_wait_s": queue_wait, "ttft_s": None}
+            return _track_stream_usage(response, reservation, call)
+
+        used_tokens = response.usage.total_tokens if response.usage else reserved_tokens
+        key_scheduler.record_usage(reservation, used_tokens)
+        total = time.perf_counter() - started
+        completion_metrics.record(
+            params["model"],
+            key_index=key_index,
+            queue_wait_s=queue_wait,
+            ttft_s=total,
+            total_s=total,
+            prompt_tokens=response.usage.prompt_tokens if response.usage else None,
+            completion_tokens=response.usage.completion_tokens if response.usage else None
+        )
+        return response
+
+def get_assistant_response(prompt, chat_history):
+    # chat_history is a MessageLog or ContextWindow (or a list of user/assistant pairs)
+    messages = as_message_log(chat_history).messages([BASIC_ASSISTANT_PROMPT], prompt)
     
     # Get response from Groq
-    chat_completion = client.chat.completions.create(
+    chat_completion = _create_completion(
         messages=messages,
-        model="llama3-70b-8192",  # adjust if needed
+        model=model_for("assistant"),
         temperature=0.5,
         max_tokens=500,
         top_p=1,
@@ -149,22 +446,38 @@ def create_patient_intake_form():
             "temperature": temperature,
             "heart_rate": heart_rate,
             "blood_pressure": f"{bp_systolic}/{bp_diastolic}",
+            "bp_systolic": bp_systolic,
+            "bp_diastolic": bp_diastolic,
             "oxygen_saturation": oxygen_saturation
         }
         
-        # Store in session state
-        if "patient_records" not in st.session_state:
-            st.session_state.patient_records = []
-        
-        st.session_state.patient_records.append(patient_data)
+        # Persist in the columnar store; the session only keeps the record ids
+        from patient_store import get_patient_store
+        patient_data["record_id"] = get_patient_store().append(patient_data)
+        if "patient_record_ids" not in st.session_state:
+            st.session_state.patient_record_ids = []
+        st.session_state.patient_record_ids.append(patient_data["record_id"])
         st.success("Patient data submitted successfully!")
+        show_early_warning(score_patient(patient_data))
         
         return patient_data
     
     return None
 
+def show_early_warning(warning):
+    """Flag a patient whose vitals alone score as an emergency (or close to one)"""
+    triggers = f" ({', '.join(warning['triggers'])})" if warning["triggers"] else ""
+    message = f"Early warning score {warning['score']}: {warning['risk']} clinical risk{triggers}"
+    if warning["risk"] == "high":
+        st.error(f"🚨 {message}. Arrange an emergency assessment now.")
+    elif warning["risk"] != "low":
+        st.warning(message)
+
 def get_diagnostic_analysis(patient_data):
-    client = get_groq_client()  # Get client with next API key
+    # Clear emergencies by vitals alone don't wait on the 70B model
+    warning = score_patient(patient_data)
+    if should_skip_analysis(warning):
+        return emergency_analysis(warning)
     
     # Format the prompt using the template
     prompt = DIAGNOSTIC_ANALYSIS_TEMPLATE.format(
@@ -188,9 +501,9 @@ def get_diagnostic_analysis(patient_data):
         {"role": "user", "content": prompt}
     ]
     
-    chat_completion = client.chat.completions.create(
+    chat_completion = _create_completion(
         messages=messages,
-        model="llama3-70b-8192",
+        model=model_for("diagnostic"),
         temperature=0.3,
         max_tokens=500,
         top_p=1,
@@ -258,31 +571,48 @@ def enforce_structured_output(text):
     """
     return text
 
-def process_stream_with_format_enforcement(response_stream, message_placeholder):
+def process_stream_with_format_enforcement(response_stream, message_placeholder, started_at=None,
+                                           alert_placeholder=None):
     """
-    Process streaming response without format enforcement since we're now
-    relying on markdown formatting.
+    Render a streaming response into the placeholder and return the full text.
+    Redraws are throttled by StreamRenderer rather than issued per token; pass
+    'started_at' (a time.perf_counter() value) to measure TTFT from the request.
+    With an 'alert_placeholder', an emergency banner is shown as soon as a
+    red-flag term is generated.
     """
-    full_response = ""
+    renderer = StreamRenderer(message_placeholder, started_at=started_at)
+    alert_matcher = default_detector.matcher() if alert_placeholder is not None else None
     for chunk in response_stream:
-        if chunk.choices[0].delta.content is not None:
-            full_response += chunk.choices[0].delta.content
-            # Display the markdown as is without enforcement
-            message_placeholder.markdown(full_response + "▌")
-    
+        if chunk.choices and chunk.choices[0].delta.content is not None:
+            renderer.feed(chunk.choices[0].delta.content)
+            if alert_matcher is not None and alert_matcher.feed(chunk.choices[0].delta.content):
+                show_emergency_banner(alert_placeholder, alert_matcher.matches)
+        x_groq = getattr(chunk, "x_groq", None)
+        if x_groq is not None and x_groq.usage is not None:
+            renderer.completion_tokens = x_groq.usage.completion_tokens
+
     # Final update with the complete response
-    message_placeholder.markdown(full_response)
-    
+    full_response = renderer.finish()
+    if alert_matcher is not None and alert_matcher.finish():
+        show_emergency_banner(alert_placeholder, alert_matcher.matches)
+
+    stats = renderer.stats()
+    logger.info(
+        "stream finished: ttft=%s total=%.3fs tokens=%s tokens/s=%s renders=%d",
+        f"{stats['ttft_s']:.3f}s" if stats["ttft_s"] is not None else "n/a",
+        stats["total_s"],
+        stats["completion_tokens"],
+        f"{stats['tokens_per_s']:.1f}" if stats["tokens_per_s"] is not None else "n/a",
+        stats["renders"],
+    )
     return full_response
 
 def get_medical_assistant_response(prompt, chat_history, patient_data=None):
-    client = get_groq_client()  # Get client with next API key
-    
-    messages = [{"role": "system", "content": MEDICAL_TRIAGE_PROMPT}]
+    system = [MEDICAL_TRIAGE_PROMPT]
     
     # Add patient context if available
     if patient_data:
-        patient_context = PATIENT_CONTEXT_TEMPLATE.format(
+        system.append(PATIENT_CONTEXT_TEMPLATE.format(
             name=patient_data['name'],
             age=patient_data['age'],
             gender=patient_data['gender'],
@@ -290,256 +620,114 @@ def get_medical_assistant_response(prompt, chat_history, patient_data=None):
             heart_rate=patient_data['heart_rate'],
             temperature=patient_data['temperature'],
             symptoms=patient_data['symptoms']
-        )
-        messages.append({"role": "system", "content": patient_context})
+        ))
     
-    # Add chat history to the conversation
-    for message in chat_history:
-        if "user" in message:
-            messages.append({"role": "user", "content": message["user"]})
-        if "assistant" in message:
-            messages.append({"role": "assistant", "content": message["assistant"]})
+    # The answered conversation so far, then the current prompt
+    chat_history = as_message_log(chat_history)
+    messages = chat_history.messages(system, prompt)
     
-    # Add current prompt
-    messages.append({"role": "user", "content": prompt})
+    # Short follow-ups go to the fast model, everything else to the large one
+    route = route_triage_turn(prompt, chat_history.projection(), patient_data)
     
     # Parameters optimized for markdown generation
-    return client.chat.completions.create(
+    return routed_stream(route, lambda model: _create_completion(
         messages=messages,
-        model="Llama-3.3-70B-Versatile",
+        model=model,
         temperature=0.4,     # Lower temperature for more consistent outputs
         max_tokens=1024,
         top_p=0.95,          # Higher top_p for more deterministic output
         frequency_penalty=0.0,
         presence_penalty=0.0,
         stream=True          # Enable streaming
+    ))
+
+def summarize_conversation(previous_summary, messages):
+    """Fold older conversation messages into the rolling summary (runs on a background thread)"""
+    transcript = "\n\n".join(f"{m['role'].capitalize()}: {m['content']}" for m in messages)
+    if previous_summary:
+        transcript = f"Summary so far:\n{previous_summary}\n\nNew messages:\n{transcript}"
+    
+    chat_completion = _create_completion(
+        messages=[
+            {"role": "system", "content": CONVERSATION_SUMMARY_PROMPT},
+            {"role": "user", "content": transcript}
+        ],
+        model=model_for("summary"),
+        temperature=0.2,
+        max_tokens=400,
+        top_p=1,
+        stream=False
     )
+    return chat_completion.choices[0].message.content
 
 def check_medical_alerts(text):
     """Check for emergency medical conditions in the text"""
-    emergency_keywords = [
-        "stroke", "heart attack", "myocardial infarction", "sepsis", 
-        "anaphylaxis", "pulmonary embolism", "meningitis", "acute",
-        "immediate", "emergency", "urgent", "critical"
-    ]
-    
-    has_emergency = any(keyword in text.lower() for keyword in emergency_keywords)
-    return has_emergency
-
-def convert_md_to_html(md_text: str) -> str:
-    """
-    Naive conversion of Markdown-like text:
-      - Replace **bold** markers with <b>...</b>
-      - Replace line breaks with <br/>
-    """
-    # Convert **bold** to <b>...</b>
-    html_text = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', md_text)
-    # Replace line breaks with <br/>
-    html_text = html_text.replace('\n', '<br/>')
-    return html_text
-
-def strip_before_marker(text: str, marker: str = "**Analysis**") -> str:
-    """
-    Return only the substring starting at the given 'marker'.
-    Case-insensitive. If marker not found, returns the original text.
-    """
-    text_lower = text.lower()
-    marker_lower = marker.lower()
-    
-    idx = text_lower.find(marker_lower)
-    if idx != -1:
-        # Keep everything from the marker onward
-        return text[idx:]
-    else:
-        return text
-
-def generate_pdf_report(patient_data, analysis):
-    """
-    Generate a styled PDF medical report using ReportLab and return it as a BytesIO object.
-    This version only includes everything under the '**Analysis**' marker.
-    """
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=LETTER,
-        rightMargin=72,
-        leftMargin=72,
-        topMargin=72,
-        bottomMargin=72
+    return default_detector.contains(text)
+
+def show_emergency_banner(alert_placeholder, terms):
+    """Show the red-flag banner for the emergency terms detected so far"""
+    alert_placeholder.error(
+        f"**Possible emergency detected** ({', '.join(dict.fromkeys(terms))}). "
+        "If the patient is in danger, call 124 or go to the nearest emergency department.",
+        icon="🚨"
     )
 
-    elements = []
-    
-    # Grab some built-in styles (feel free to customize)
-    styles = getSampleStyleSheet()
-    title_style = styles["Title"]
-    heading_style = styles["Heading2"]
-    normal_style = styles["BodyText"]
-    
-    # ---- Title ----
-    elements.append(Paragraph("MEDICAL REPORT", title_style))
-    elements.append(Spacer(1, 0.2 * inch))
-    
-    # ---- Date of Report ----
-    report_date = datetime.now().strftime("%d/%m/%Y")
-    elements.append(Paragraph(f"<b>Date of Report:</b> {report_date}", normal_style))
-    elements.append(Spacer(1, 0.2 * inch))
-    
-    # ---- Patient Information ----
-    elements.append(Paragraph("PATIENT INFORMATION (Status Praesens)", heading_style))
-    patient_info_table_data = [
-        ["Name:", patient_data['name']],
-        ["Date of Visit:", str(patient_data['date'])],
-        ["Gender:", patient_data['gender']],
-        ["Age:", str(patient_data['age'])],
-        ["Height:", f"{patient_data['height']} cm"],
-        ["Weight:", f"{patient_data['weight']} kg"],
-    ]
-    patient_info_table = Table(patient_info_table_data)
-    patient_info_table.hAlign = 'LEFT'
-    patient_info_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('BACKGROUND', (0,0), (1,0), colors.grey),
-        ('TEXTCOLOR', (0,0), (1,0), colors.whitesmoke),
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-        ('BOTTOMPADDING', (0,0), (-1,0), 6),
-        ('GRID', (0,0), (-1,-1), 0.5, colors.grey),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-    ]))
-    elements.append(patient_info_table)
-    elements.append(Spacer(1, 0.3 * inch))
-    
-    # ---- Vital Signs ----
-    elements.append(Paragraph("VITAL SIGNS (Signa Vitalia)", heading_style))
-    vitals_table_data = [
-        ["Temperature:", f"{patient_data['temperature']} °C"],
-        ["Blood Pressure:", patient_data['blood_pressure']],
-        ["Heart Rate:", f"{patient_data['heart_rate']} bpm"],
-        ["O2 Saturation:", f"{patient_data['oxygen_saturation']} %"],
-    ]
-    vitals_table = Table(vitals_table_data)
-    vitals_table.hAlign = 'LEFT'
-    vitals_table.setStyle(TableStyle([
-        ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-        ('BACKGROUND', (0,0), (1,0), colors.grey),
-        ('TEXTCOLOR', (0,0), (1,0), colors.whitesmoke),
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-        ('BOTTOMPADDING', (0,0), (-1,0), 6),
-        ('GRID', (0,0), (-1,-1), 0.5, colors.grey),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-    ]))
-    elements.append(vitals_table)
-    elements.append(Spacer(1, 0.3 * inch))
-    
-    # ---- Medical History ----
-    elements.append(Paragraph("MEDICAL HISTORY (Anamnesis)", heading_style))
-    known_conditions = ', '.join(patient_data['medical_conditions'])
-    med_history_text = f"""
-    <b>Known Conditions (Status Morbi):</b> {known_conditions}<br/>
-    <b>Current Medications (Medicatio Actualis):</b> {patient_data['medications'] or 'None reported'}<br/>
-    <b>Allergies (Allergiae):</b> {patient_data['allergies'] or 'None reported'}
-    """
-    elements.append(Paragraph(med_history_text, normal_style))
-    elements.append(Spacer(1, 0.2 * inch))
-    
-    # ---- Current Symptoms ----
-    elements.append(Paragraph("CURRENT SYMPTOMS (Symptomata)", heading_style))
-    elements.append(Paragraph(patient_data['symptoms'], normal_style))
-    elements.append(Spacer(1, 0.3 * inch))
-    
-    # ---- Analysis and Assessment ----
-    # 1) Strip out everything before "**Analysis**" in your raw text from the LLM
-    cleaned_analysis = strip_before_marker(analysis, "**Potential Diagnoses:**")
-    # 2) Convert from MD-like text to HTML
-    parsed_analysis = convert_md_to_html(cleaned_analysis)
-    
-    elements.append(Paragraph("ANALYSIS AND ASSESSMENT", heading_style))
-    elements.append(Paragraph(parsed_analysis, normal_style))
-    elements.append(Spacer(1, 0.3 * inch))
-    
-    # ---- Disclaimer ----
-    disclaimer = (
-        "NOTICE: This report includes AI-assisted analysis and should be "
-        "reviewed by a licensed medical professional."
-    )
-    elements.append(Paragraph(disclaimer, styles["Italic"]))
-    
-    # Build the PDF
-    doc.build(elements)
-    
-    # Retrieve the PDF from buffer
-    pdf_data = buffer.getvalue()
-    buffer.close()
-    return pdf_data
-
-def get_special_response(prompt_type, chat_history):
-    client = get_groq_client()  # Get client with next API key
-    """Handle special response types like clinical reasoning and medical literature"""
+def special_response_params(prompt_type, chat_history):
+    """Completion parameters of a special response (clinical reasoning, medical literature)"""
     
     # Format the system prompt with the prompt type
     formatted_system_prompt = SPECIAL_RESPONSE_PROMPT.format(prompt_type=prompt_type)
     
-    messages = [
-        {"role": "system", "content": formatted_system_prompt},
-        # Add the conversation history
-        *[msg for msg in chat_history if msg.get("assistant") and "Summary" not in msg.get("assistant")],
-        # Add the special prompt
-        {"role": "user", "content": SPECIAL_PROMPTS[prompt_type]}
-    ]
+    # The conversation history, then the special prompt
+    messages = as_message_log(chat_history).messages(
+        [formatted_system_prompt], SPECIAL_PROMPTS[prompt_type]
+    )
     
-    return client.chat.completions.create(
+    return dict(
         messages=messages,
-        model="llama3-70b-8192",
+        model=model_for("special"),
         temperature=0.5,
         max_tokens=1024,
         top_p=1,
         stream=True
     )
 
+# Special responses requested in the background after each triage answer (PREFETCH_SPECIAL_RESPONSES=1)
+special_prefetcher = SpecialResponsePrefetcher(
+    special_response_params, _create_completion, key_scheduler, SPECIAL_PROMPTS
+)
+
+def get_special_response(prompt_type, chat_history, conversation_id=None, turn=None):
+    """
+    Handle special response types like clinical reasoning and medical literature.
+    With the conversation id and turn (answered log messages), a prefetched
+    response for that turn is served from the cache or the request in flight.
+    """
+    params = None
+    if conversation_id is not None:
+        params = special_prefetcher.take(conversation_id, prompt_type, turn)
+    if params is None:
+        params = special_response_params(prompt_type, chat_history)
+    
+    return _create_completion(**params)
+
 def send_feedback_email(chat_history, feedback_text):
-    """Send feedback via email"""
+    """
+    Queue feedback for email. It is sent in the background by the feedback
+    outbox (batched, with retries), so this returns immediately.
+    """
     # Email configuration
     sender_email = os.getenv('FEEDBACK_EMAIL')
     sender_password = os.getenv('FEEDBACK_EMAIL_PASSWORD')
-    receiver_email = os.getenv('FEEDBACK_EMAIL')  # Same as sender in this case
     
-    if not all([sender_email, sender_password, receiver_email]):
+    if not all([sender_email, sender_password]):
         st.error("Email configuration is missing. Please check environment variables.")
         return False
         
     try:
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = receiver_email
-        msg['Subject'] = f"Medical Assistant Feedback - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        
-        # Format the chat history
-        chat_summary = "\n".join([
-            f"User: {msg.get('user', '')}\nAssistant: {msg.get('assistant', '')}"
-            for msg in chat_history
-        ])
-        
-        # Create email body
-        body = f"""
-New Feedback Received:
-
-Feedback:
-{feedback_text}
-
-Chat History:
-{chat_summary}
-        """
-        
-        msg.attach(MIMEText(body, 'plain'))
-        
-        # Create SMTP session
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(sender_email, sender_password)
-            server.send_message(msg)
-            
+        from feedback_outbox import get_outbox
+        get_outbox().enqueue(chat_history, feedback_text)
         return True
     except Exception as e:
         st.error(f"Error sending feedback: {str(e)}")
-        return False 
\ No newline at end of file
+        return False
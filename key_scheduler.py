@@ -0,0 +1,253 @@
+"""
+Quota-aware scheduling of Groq API keys.
+
+A single process-global scheduler tracks, for every API key, the requests and
+tokens spent in the last minute plus the limits Groq reports back in its
+rate-limit headers. Each call is routed to the key with the most remaining
+headroom; when every key is saturated the caller waits in a queue until one
+frees up instead of failing. A call's estimated tokens are reserved when it
+is scheduled and replaced by its real usage when it settles, at the time of
+the reservation, so usage leaves the window once however long the call ran.
+"""
+import os
+import re
+import threading
+import time
+from collections import deque
+
+# Per-key limits used until Groq reports the real ones in response headers
+DEFAULT_RPM_LIMIT = int(os.getenv("GROQ_RPM_LIMIT", "30"))
+DEFAULT_TPM_LIMIT = int(os.getenv("GROQ_TPM_LIMIT", "6000"))
+
+# Requests/tokens per minute are tracked over a sliding window
+WINDOW_SECONDS = 60.0
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_FACTORS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+
+def parse_duration(value):
+    """
+    Parse a Groq duration header such as '2m59.56s', '7.66s', '120ms' or a
+    plain number of seconds. Returns seconds, or None if it can't be parsed.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_FACTORS[unit] for number, unit in parts)
+
+
+def estimate_tokens(messages):
+    """Rough token count of a message list (about 4 characters per token)"""
+    return sum(len(message["content"]) // 4 + 4 for message in messages)
+
+
+class Reservation:
+    """Tokens reserved on one key by KeyScheduler.acquire(); settled by record_usage()"""
+
+    __slots__ = ("key_index", "event")
+
+    def __init__(self, key_index, event):
+        self.key_index = key_index
+        self.event = event  # [timestamp, tokens] entry in the key's token_events
+
+
+class _KeyState:
+    """Sliding-window usage and header-reported limits of one API key"""
+
+    def __init__(self, rpm_limit, tpm_limit):
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.requests = deque()  # timestamps of requests in the window
+        self.token_events = deque()  # [timestamp, tokens]; a reservation's tokens are corrected in place
+        self.tokens_in_window = 0
+        self.blocked_until = 0.0
+        # Last remaining-token count reported by Groq and when it resets
+        self.reported_tokens_left = None
+        self.reported_at = 0.0
+        self.reported_reset_at = 0.0
+
+    def prune(self, now):
+        cutoff = now - WINDOW_SECONDS
+        while self.requests and self.requests[0] <= cutoff:
+            self.requests.popleft()
+        while self.token_events and self.token_events[0][0] <= cutoff:
+            _, tokens = self.token_events.popleft()
+            self.tokens_in_window -= tokens
+
+    def tokens_left(self, now):
+        tokens_left = self.tpm_limit - self.tokens_in_window
+        if self.reported_tokens_left is not None and now < self.reported_reset_at:
+            # Groq's count is authoritative but doesn't include what we sent since
+            spent_since = sum(tokens for ts, tokens in self.token_events if ts > self.reported_at)
+            tokens_left = min(tokens_left, self.reported_tokens_left - spent_since)
+        return tokens_left
+
+    def headroom(self, now, tokens):
+        """Fraction of the tighter budget left after this request, or None if it doesn't fit"""
+        if now < self.blocked_until:
+            return None
+        requests_left = self.rpm_limit - len(self.requests)
+        tokens_left = self.tokens_left(now) - tokens
+        if requests_left <= 0 or tokens_left < 0:
+            return None
+        return min(requests_left / self.rpm_limit, tokens_left / self.tpm_limit)
+
+    def available_at(self, now, tokens):
+        """Earliest time at which a request of this size could fit"""
+        ready = max(now, self.blocked_until)
+        if len(self.requests) >= self.rpm_limit:
+            ready = max(ready, self.requests[len(self.requests) - self.rpm_limit] + WINDOW_SECONDS)
+        missing = tokens - self.tokens_left(now)
+        if missing > 0:
+            # Wait until enough old usage has dropped out of the window
+            freed = 0
+            for ts, spent in self.token_events:
+                freed += spent
+                if freed >= missing:
+                    ready = max(ready, ts + WINDOW_SECONDS)
+                    break
+            else:
+                ready = max(ready, self.reported_reset_at, now + 1.0)
+        return ready
+
+    def spend(self, now, tokens):
+        event = [now, tokens]
+        self.token_events.append(event)
+        self.tokens_in_window += tokens
+        return event
+
+
+class KeyScheduler:
+    """Routes each request to the API key with the most rate-limit headroom"""
+
+    def __init__(self, num_keys, rpm_limit=DEFAULT_RPM_LIMIT, tpm_limit=DEFAULT_TPM_LIMIT):
+        self._keys = [_KeyState(rpm_limit, tpm_limit) for _ in range(num_keys)]
+        self._cond = threading.Condition()
+
+    def acquire(self, estimated_tokens=0, timeout=None, exclude=()):
+        """
+        Reserve capacity for one request and return the Reservation; its
+        key_index is the key to use. Blocks while every key is saturated;
+        raises TimeoutError after 'timeout' seconds.
+        """
+        candidates = [i for i in range(len(self._keys)) if i not in exclude]
+        if not candidates:
+            raise ValueError("No API keys left to schedule on")
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                best_index, best_headroom = None, -1.0
+                soonest = float("inf")
+                for index in candidates:
+                    state = self._keys[index]
+                    state.prune(now)
+                    # A single request can never need more than a full minute's budget
+                    tokens = min(estimated_tokens, state.tpm_limit)
+                    headroom = state.headroom(now, tokens)
+                    if headroom is None:
+                        soonest = min(soonest, state.available_at(now, tokens))
+                    elif headroom > best_headroom:
+                        best_index, best_headroom = index, headroom
+
+                if best_index is not None:
+                    state = self._keys[best_index]
+                    state.requests.append(now)
+                    return Reservation(best_index, state.spend(now, min(estimated_tokens, state.tpm_limit)))
+
+                wait = max(soonest - now, 0.01)
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise TimeoutError("All API keys are rate limited")
+                    wait = min(wait, remaining)
+                self._cond.wait(wait)
+
+    def record_usage(self, reservation, actual_tokens):
+        """Replace a reservation's token estimate with what the request actually used"""
+        with self._cond:
+            state = self._keys[reservation.key_index]
+            event, reservation.event = reservation.event, None
+            state.prune(time.monotonic())
+            # A reservation that has already left the window no longer counts either way
+            if event is None or not state.token_events or event[0] < state.token_events[0][0]:
+                return
+            state.tokens_in_window += actual_tokens - event[1]
+            event[1] = actual_tokens
+            # Correcting an over-estimate frees capacity for queued callers
+            self._cond.notify_all()
+
+    def record_headers(self, key_index, headers):
+        """Update a key's limits from Groq's x-ratelimit-* response headers"""
+        limit_tokens = headers.get("x-ratelimit-limit-tokens")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        reset_tokens = parse_duration(headers.get("x-ratelimit-reset-tokens"))
+        # Groq reports *daily* request counts; an exhausted day blocks the key until reset
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        reset_requests = parse_duration(headers.get("x-ratelimit-reset-requests"))
+
+        with self._cond:
+            state = self._keys[key_index]
+            now = time.monotonic()
+            if limit_tokens and limit_tokens.isdigit():
+                state.tpm_limit = max(int(limit_tokens), 1)
+            if remaining_tokens and remaining_tokens.isdigit():
+                state.reported_tokens_left = int(remaining_tokens)
+                state.reported_at = now
+                state.reported_reset_at = now + (reset_tokens or WINDOW_SECONDS)
+            if remaining_requests == "0" and reset_requests:
+                state.blocked_until = max(state.blocked_until, now + reset_requests)
+
+    def record_rate_limit(self, key_index, headers):
+        """Take a key out of rotation after a 429 until its retry-after has passed"""
+        retry_after = parse_duration(headers.get("retry-after"))
+        if retry_after is None:
+            retry_after = parse_duration(headers.get("x-ratelimit-reset-tokens")) or 1.0
+        with self._cond:
+            state = self._keys[key_index]
+            state.blocked_until = max(state.blocked_until, time.monotonic() + retry_after)
+        self.record_headers(key_index, headers)
+
+    def best_headroom(self, estimated_tokens=0, exclude=()):
+        """
+        Headroom (0-1) the best key (not in 'exclude') would have left after a
+        request of this size, without reserving anything; None if no key could
+        take it now.
+        """
+        with self._cond:
+            now = time.monotonic()
+            best = None
+            for index, state in enumerate(self._keys):
+                if index in exclude:
+                    continue
+                state.prune(now)
+                headroom = state.headroom(now, min(estimated_tokens, state.tpm_limit))
+                if headroom is not None and (best is None or headroom > best):
+                    best = headroom
+            return best
+
+    def snapshot(self):
+        """Current per-key usage, for display and diagnostics"""
+        with self._cond:
+            now = time.monotonic()
+            rows = []
+            for index, state in enumerate(self._keys):
+                state.prune(now)
+                rows.append({
+                    "key_index": index,
+                    "requests_in_window": len(state.requests),
+                    "rpm_limit": state.rpm_limit,
+                    "tokens_left": state.tokens_left(now),
+                    "tpm_limit": state.tpm_limit,
+                    "blocked_for": max(0.0, state.blocked_until - now),
+                })
+            return rows
@@ -0,0 +1,83 @@
+"""
+Append-only message log of one conversation.
+
+The chat UI keeps {"user": ..., "assistant": ...} pairs for rendering; the
+LLM calls need a flat list of {"role", "content"} messages. A MessageLog
+holds each message once as a slotted record together with its API dict (and
+its conversation store id, when known), and keeps the flat projection up to
+date as messages are appended, so a turn never walks the history to rebuild
+it.
+"""
+
+
+class _Message:
+    __slots__ = ("role", "content", "api", "id")
+
+    def __init__(self, role, content, message_id=None):
+        self.role = role
+        self.content = content
+        self.api = {"role": role, "content": content}
+        self.id = message_id
+
+
+class MessageLog:
+    """Answered messages of a conversation plus their API-ready projection"""
+
+    __slots__ = ("_records", "_projection")
+
+    def __init__(self):
+        self._records = []
+        self._projection = []
+
+    @classmethod
+    def from_chat_history(cls, chat_history):
+        """Build a log from the app's user/assistant pairs (with their "<role>_id" store ids), oldest first"""
+        log = cls()
+        for pair in chat_history:
+            for role in ("user", "assistant"):
+                if pair.get(role):
+                    log.append(role, pair[role], pair.get(f"{role}_id"))
+        return log
+
+    def append(self, role, content, message_id=None):
+        """Add one message ('user' or 'assistant') to the end of the log"""
+        record = _Message(role, content, message_id)
+        self._records.append(record)
+        self._projection.append(record.api)
+
+    def append_turn(self, user, assistant, user_id=None, assistant_id=None):
+        """Add an answered user/assistant exchange"""
+        self.append("user", user, user_id)
+        self.append("assistant", assistant, assistant_id)
+
+    def __len__(self):
+        return len(self._records)
+
+    def message_id(self, index):
+        """Store id of the index-th message, or None if it was never stored"""
+        return self._records[index].id
+
+    def projection(self):
+        """The log as API messages. Shared, not copied: callers must not modify it"""
+        return self._projection
+
+    def messages(self, system=(), prompt=None):
+        """
+        Messages for one completion: the 'system' contents, the log, then
+        'prompt' as the new user message (if given).
+        """
+        messages = [{"role": "system", "content": content} for content in system]
+        messages += self._projection
+        if prompt is not None:
+            messages.append({"role": "user", "content": prompt})
+        return messages
+
+
+def as_message_log(chat_history):
+    """
+    Accept a list of chat history pairs, or anything with messages(system, prompt)
+    and projection() methods (a MessageLog or a ContextWindow) as is
+    """
+    if chat_history is None or isinstance(chat_history, list):
+        return MessageLog.from_chat_history(chat_history or [])
+    return chat_history
@@ -0,0 +1,266 @@
+"""
+Latency and token metrics for Groq completion calls.
+
+helpers._request_completion records one sample per call: queue wait for an
+API key, time to first token, total latency, prompt/completion tokens, model,
+key index, conversation and error. Recent samples are kept in a bounded
+window for percentiles; request and token counters are cumulative for the
+life of the process. Hedged streaming calls also record whether the hedge
+fired, which attempt won and the tokens spent on the losing attempt.
+
+The numbers are shown on the app's Metrics page and, when METRICS_PORT is
+set, served in Prometheus text format at http://127.0.0.1:METRICS_PORT/metrics.
+Set METRICS_BIND (e.g. 0.0.0.0) to let a scraper on another host reach it.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Address the endpoint listens on; loopback only unless set explicitly
+METRICS_BIND = os.getenv("METRICS_BIND", "127.0.0.1")
+
+# Calls kept for percentiles
+SAMPLE_WINDOW = int(os.getenv("METRICS_SAMPLE_WINDOW", "10000"))
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+# Conversation the current completion is for; set by the app around each call
+current_conversation = contextvars.ContextVar("current_conversation", default=None)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class CompletionMetrics:
+    """Recent completion samples plus cumulative counters, safe to share between threads"""
+
+    def __init__(self, window=SAMPLE_WINDOW):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+        self._requests = Counter()  # (model, outcome)
+        self._tokens = Counter()  # (model, "prompt" | "completion")
+        self._key_requests = Counter()  # (key index, outcome)
+        self._conversation_tokens = Counter()
+        self._hedges = Counter()  # (model, "requests" | "fired" | "hedge_won" | "wasted_tokens")
+        self._hedge_samples = deque(maxlen=window)  # (model, fired, ttft_s) per hedging-mode request
+        self.started_at = time.time()
+
+    def record(self, model, key_index=None, queue_wait_s=None, ttft_s=None, total_s=None,
+               prompt_tokens=None, completion_tokens=None, error=None, cached=False, coalesced=False,
+               cancelled=False):
+        """
+        Record one completion call (or one failed attempt, with 'error' set).
+        'cached' and 'coalesced' calls were answered without a request of their own;
+        'cancelled' streams were closed before the end (e.g. a losing hedge).
+        """
+        outcome = (
+            "cached" if cached else "coalesced" if coalesced else "error" if error
+            else "cancelled" if cancelled else "ok"
+        )
+        sample = {
+            "at": time.time(),
+            "model": model,
+            "key_index": key_index,
+            "conversation": current_conversation.get(),
+            "queue_wait_s": queue_wait_s,
+            "ttft_s": ttft_s,
+            "total_s": total_s,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "error": error,
+            "outcome": outcome,
+        }
+        with self._lock:
+            self._samples.append(sample)
+            self._requests[model, outcome] += 1
+            if key_index is not None:
+                self._key_requests[key_index, outcome] += 1
+            if outcome in ("ok", "error", "cancelled"):
+                self._tokens[model, "prompt"] += prompt_tokens or 0
+                self._tokens[model, "completion"] += completion_tokens or 0
+                if sample["conversation"] is not None:
+                    self._conversation_tokens[sample["conversation"]] += (prompt_tokens or 0) + (completion_tokens or 0)
+
+    def record_hedge(self, model, fired, winner, ttft_s):
+        """Record one streaming request made in hedging mode: did the hedge fire, which attempt won"""
+        with self._lock:
+            self._hedges[model, "requests"] += 1
+            if fired:
+                self._hedges[model, "fired"] += 1
+            if winner == "hedge":
+                self._hedges[model, "hedge_won"] += 1
+            self._hedge_samples.append((model, fired, ttft_s))
+
+    def record_hedge_waste(self, model, tokens):
+        """Tokens spent on a losing hedge attempt"""
+        with self._lock:
+            self._hedges[model, "wasted_tokens"] += tokens
+
+    def samples(self):
+        with self._lock:
+            return list(self._samples)
+
+    def ttft_percentile(self, model, pct, min_samples=1):
+        """Percentile of recent successful calls' time to first token; None with fewer than min_samples"""
+        values = [s["ttft_s"] for s in self.samples() if s["model"] == model and s["outcome"] == "ok" and s["ttft_s"] is not None]
+        if len(values) < min_samples:
+            return None
+        return percentile(values, pct)
+
+    def summary(self):
+        """Per-model percentiles and counters, for the metrics page"""
+        samples = self.samples()
+        with self._lock:
+            requests = dict(self._requests)
+            tokens = dict(self._tokens)
+            key_requests = dict(self._key_requests)
+            conversations = self._conversation_tokens.most_common(20)
+            hedges = dict(self._hedges)
+            hedge_samples = list(self._hedge_samples)
+
+        models = {}
+        for model in sorted({model for model, _ in requests}):
+            served = [s for s in samples if s["model"] == model and s["outcome"] == "ok"]
+            row = {
+                "requests": requests.get((model, "ok"), 0),
+                "cached": requests.get((model, "cached"), 0),
+                "coalesced": requests.get((model, "coalesced"), 0),
+                "errors": requests.get((model, "error"), 0),
+                "cancelled": requests.get((model, "cancelled"), 0),
+                "prompt_tokens": tokens.get((model, "prompt"), 0),
+                "completion_tokens": tokens.get((model, "completion"), 0),
+            }
+            for field in ("queue_wait_s", "ttft_s", "total_s"):
+                values = [s[field] for s in served if s[field] is not None]
+                for q in QUANTILES:
+                    row[f"{field[:-2]}_p{int(q * 100)}_s"] = percentile(values, q * 100)
+            models[model] = row
+
+        keys = {}
+        for (key_index, outcome), count in sorted(key_requests.items()):
+            keys.setdefault(key_index, Counter())[outcome] += count
+        errors = Counter(s["error"] for s in samples if s["error"])
+
+        hedging = {}
+        for model in sorted({model for model, _ in hedges}):
+            row = {event: hedges.get((model, event), 0) for event in ("requests", "fired", "hedge_won", "wasted_tokens")}
+            values = [ttft for m, _, ttft in hedge_samples if m == model and ttft is not None]
+            row["ttft_p50_s"] = percentile(values, 50)
+            row["ttft_p99_s"] = percentile(values, 99)
+            hedging[model] = row
+        return {
+            "uptime_s": time.time() - self.started_at,
+            "window": len(samples),
+            "models": models,
+            "keys": {key_index: dict(counts) for key_index, counts in keys.items()},
+            "errors": dict(errors),
+            "conversations": conversations,
+            "hedging": hedging,
+        }
+
+    def prometheus_text(self):
+        """All metrics in the Prometheus text exposition format"""
+        samples = self.samples()
+        with self._lock:
+            requests = dict(self._requests)
+            tokens = dict(self._tokens)
+            key_requests = dict(self._key_requests)
+            hedges = dict(self._hedges)
+
+        lines = [
+            "# HELP groq_requests_total Completion calls by model and outcome (ok, cached, coalesced, error, cancelled).",
+            "# TYPE groq_requests_total counter",
+        ]
+        for (model, outcome), count in sorted(requests.items()):
+            lines.append(f'groq_requests_total{{model="{model}",outcome="{outcome}"}} {count}')
+
+        lines += [
+            "# HELP groq_tokens_total Tokens sent and generated by model.",
+            "# TYPE groq_tokens_total counter",
+        ]
+        for (model, direction), count in sorted(tokens.items()):
+            lines.append(f'groq_tokens_total{{model="{model}",type="{direction}"}} {count}')
+
+        lines += [
+            "# HELP groq_key_requests_total Completion calls by API key index and outcome.",
+            "# TYPE groq_key_requests_total counter",
+        ]
+        for (key_index, outcome), count in sorted(key_requests.items()):
+            lines.append(f'groq_key_requests_total{{key="{key_index}",outcome="{outcome}"}} {count}')
+
+        lines += [
+            "# HELP groq_hedges_total Hedging-mode streaming requests, hedges fired and won, and tokens spent on losers.",
+            "# TYPE groq_hedges_total counter",
+        ]
+        for (model, event), count in sorted(hedges.items()):
+            lines.append(f'groq_hedges_total{{model="{model}",event="{event}"}} {count}')
+
+        for field, help_text in (
+            ("queue_wait_s", "Time spent waiting for an API key with headroom."),
+            ("ttft_s", "Time from the call to the first streamed token."),
+            ("total_s", "Time from the call to the end of the response."),
+        ):
+            name = f"groq_{field[:-2]}_seconds"
+            lines += [f"# HELP {name} {help_text} Over the last {len(samples)} calls.", f"# TYPE {name} summary"]
+            for model in sorted({s["model"] for s in samples}):
+                values = [s[field] for s in samples if s["model"] == model and s["outcome"] == "ok" and s[field] is not None]
+                for q in QUANTILES:
+                    lines.append(f'{name}{{model="{model}",quantile="{q}"}} {percentile(values, q * 100):.6f}')
+                lines.append(f'{name}_sum{{model="{model}"}} {sum(values):.6f}')
+                lines.append(f'{name}_count{{model="{model}"}} {len(values)}')
+        return "\n".join(lines) + "\n"
+
+
+completion_metrics = CompletionMetrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = completion_metrics.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT, bind=METRICS_BIND):
+    """Serve /metrics on 'bind':'port' from a daemon thread, once per process; port 0 disables it"""
+    global _server
+    if not port or _server is not None:
+        return _server
+    with _server_lock:
+        if _server is None:
+            try:
+                server = ThreadingHTTPServer((bind, port), _MetricsHandler)
+            except OSError:
+                # Another worker process on this host already serves the port
+                logger.warning("metrics endpoint: %s:%d is in use", bind, port)
+                return None
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            _server = server
+    return _server
@@ -0,0 +1,95 @@
+"""
+Admin page: Groq call latency and token usage of this app process.
+
+The page lists conversation ids and their token use, so it is closed until
+METRICS_ADMIN_TOKEN is set; then it requires ?token=<value> in the page URL.
+"""
+import hmac
+import os
+
+import pandas as pd
+import streamlit as st
+
+from metrics import completion_metrics
+from routing import routing_stats
+from circuit_breaker import key_breakers, model_breakers
+
+st.set_page_config(page_title="Metrics · ASA Medical Assistant", page_icon="📈", layout="wide")
+
+admin_token = os.getenv("METRICS_ADMIN_TOKEN")
+if not admin_token:
+    st.error("This page is for administrators. Set METRICS_ADMIN_TOKEN to enable it.")
+    st.stop()
+if not hmac.compare_digest(st.query_params.get("token", ""), admin_token):
+    st.error("This page is for administrators.")
+    st.stop()
+
+st.title("Completion metrics")
+if st.button("Refresh"):
+    st.rerun()
+
+summary = completion_metrics.summary()
+st.caption(
+    f"This process, last {summary['window']} calls for percentiles; "
+    f"counters since start ({summary['uptime_s'] / 3600:.1f} h ago)."
+)
+
+st.subheader("By model")
+if summary["models"]:
+    st.dataframe(pd.DataFrame.from_dict(summary["models"], orient="index"), use_container_width=True)
+else:
+    st.info("No completion calls yet.")
+
+col1, col2 = st.columns(2)
+with col1:
+    st.subheader("By API key")
+    if summary["keys"]:
+        keys = pd.DataFrame.from_dict(summary["keys"], orient="index").fillna(0).astype(int)
+        keys.index.name = "key index"
+        st.dataframe(keys, use_container_width=True)
+    st.subheader("Errors")
+    if summary["errors"]:
+        st.dataframe(pd.Series(summary["errors"], name="count"), use_container_width=True)
+    else:
+        st.write("None")
+with col2:
+    st.subheader("Tokens by conversation")
+    if summary["conversations"]:
+        st.dataframe(
+            pd.DataFrame(summary["conversations"], columns=["conversation", "tokens"]),
+            use_container_width=True,
+            hide_index=True
+        )
+
+st.subheader("Circuit breakers")
+breakers = key_breakers.snapshot() + model_breakers.snapshot()
+if breakers:
+    open_breakers = [b["name"] for b in breakers if b["state"] != "closed"]
+    if open_breakers:
+        st.warning(f"Not closed: {', '.join(open_breakers)}")
+    st.dataframe(pd.DataFrame(breakers), use_container_width=True, hide_index=True)
+else:
+    st.write("No calls yet.")
+
+if summary["hedging"]:
+    st.subheader("Hedged requests")
+    st.caption("Streaming calls in hedging mode: duplicates fired on a second key, how often they won, and the tokens spent on losers.")
+    st.dataframe(pd.DataFrame.from_dict(summary["hedging"], orient="index"), use_container_width=True)
+
+st.subheader("Model routing")
+routing = routing_stats.summary()
+if routing["tiers"]:
+    col3, col4 = st.columns(2)
+    with col3:
+        st.dataframe(pd.DataFrame.from_dict(routing["tiers"], orient="index"), use_container_width=True)
+    with col4:
+        st.dataframe(
+            pd.DataFrame(routing["decisions"], columns=["tier", "reason", "turns"]),
+            use_container_width=True,
+            hide_index=True
+        )
+else:
+    st.info("No routed turns yet.")
+
+with st.expander("Prometheus text"):
+    st.code(completion_metrics.prometheus_text(), language="text")
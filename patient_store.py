@@ -0,0 +1,290 @@
+"""
+Columnar patient record store.
+
+Intake records are kept in a pandas DataFrame with typed columns (nullable
+integers for vitals, float32 for measurements, real dates), so filters such
+as "SpO2 below 92 this week" are vectorized comparisons instead of loops
+over dicts. Appends are buffered and written in batches to a Parquet dataset
+partitioned by visit date, so date-bounded loads only read the matching
+partitions. A background timer writes a partial batch FLUSH_INTERVAL seconds
+after its first record, so a quiet clinic's intakes reach disk promptly too.
+"""
+import atexit
+import os
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+DEFAULT_PATIENT_STORE_PATH = os.getenv("PATIENT_STORE_PATH", "patient_records")
+
+# Buffered appends are written once this many have accumulated, or at the
+# latest FLUSH_INTERVAL seconds after the oldest was buffered
+FLUSH_ROWS = int(os.getenv("PATIENT_STORE_FLUSH_ROWS", "256"))
+FLUSH_INTERVAL = float(os.getenv("PATIENT_STORE_FLUSH_INTERVAL", "5"))
+
+# Column types; medical_conditions is stored '; '-joined
+PATIENT_COLUMNS = {
+    "record_id": "string",
+    "visit_date": "datetime64[ns]",
+    "name": "string",
+    "age": "Int16",
+    "gender": "string",
+    "height": "float32",
+    "weight": "float32",
+    "medical_conditions": "string",
+    "medications": "string",
+    "allergies": "string",
+    "symptoms": "string",
+    "temperature": "float32",
+    "heart_rate": "Int16",
+    "bp_systolic": "Int16",
+    "bp_diastolic": "Int16",
+    "oxygen_saturation": "Int16",
+    "created_at": "datetime64[ns]",
+}
+
+# Parquet partition key; a 'YYYY-MM-DD' string so the directories read naturally
+_PARTITION = "visit_day"
+
+
+def split_blood_pressure(blood_pressure):
+    """'120/80' -> (120, 80); missing or malformed parts become None"""
+    parts = str(blood_pressure or "").split("/")
+    values = []
+    for part in (parts + [""])[:2]:
+        try:
+            values.append(int(float(part)))
+        except ValueError:
+            values.append(None)
+    return tuple(values)
+
+
+def to_row(patient_data):
+    """
+    Flatten an intake-form patient_data dict, or a raw CSV/JSONL record shaped
+    like one (string values, ';'-separated conditions), into a store row
+    """
+    systolic = patient_data.get("bp_systolic")
+    diastolic = patient_data.get("bp_diastolic")
+    if systolic in (None, "") or diastolic in (None, ""):
+        systolic, diastolic = split_blood_pressure(patient_data.get("blood_pressure"))
+    conditions = patient_data.get("medical_conditions") or []
+    if not isinstance(conditions, str):
+        conditions = "; ".join(conditions)
+    return {
+        "record_id": patient_data.get("record_id") or uuid.uuid4().hex,
+        "visit_date": pd.Timestamp(patient_data.get("date") or date.today()),
+        "name": patient_data.get("name", ""),
+        "age": patient_data.get("age"),
+        "gender": patient_data.get("gender", ""),
+        "height": patient_data.get("height"),
+        "weight": patient_data.get("weight"),
+        "medical_conditions": conditions,
+        "medications": patient_data.get("medications", ""),
+        "allergies": patient_data.get("allergies", ""),
+        "symptoms": patient_data.get("symptoms", ""),
+        "temperature": patient_data.get("temperature"),
+        "heart_rate": patient_data.get("heart_rate"),
+        "bp_systolic": systolic,
+        "bp_diastolic": diastolic,
+        "oxygen_saturation": patient_data.get("oxygen_saturation"),
+        "created_at": pd.Timestamp(datetime.now()),
+    }
+
+
+def to_patient_data(row):
+    """
+    Turn a store row (a dict, a DataFrame row, or to_row() of a raw record)
+    back into the dict used by the analysis and reports
+    """
+    row = dict(row)
+
+    def value(column, default=0):
+        item = row.get(column)
+        return default if item is None or pd.isna(item) or item == "" else item
+
+    def integer(column):
+        # Raw records carry numbers as strings such as "80" or "80.0"
+        return int(float(value(column)))
+
+    systolic, diastolic = integer("bp_systolic"), integer("bp_diastolic")
+    conditions = value("medical_conditions", "")
+    return {
+        "record_id": row.get("record_id"),
+        "name": value("name", ""),
+        "age": integer("age"),
+        "gender": value("gender", ""),
+        "height": float(value("height")),
+        "weight": float(value("weight")),
+        "date": pd.Timestamp(row["visit_date"]).date(),
+        "medical_conditions": [c.strip() for c in conditions.split(";") if c.strip()] or ["None"],
+        "medications": value("medications", ""),
+        "allergies": value("allergies", ""),
+        "symptoms": value("symptoms", ""),
+        "temperature": float(value("temperature")),
+        "heart_rate": integer("heart_rate"),
+        "blood_pressure": f"{systolic}/{diastolic}",
+        "bp_systolic": systolic,
+        "bp_diastolic": diastolic,
+        "oxygen_saturation": integer("oxygen_saturation"),
+    }
+
+
+def to_frame(rows):
+    """Build a typed DataFrame from a list of store rows"""
+    frame = pd.DataFrame.from_records(rows, columns=list(PATIENT_COLUMNS))
+    return frame.astype(PATIENT_COLUMNS)
+
+
+def start_of_week(day=None):
+    """Monday of the week containing 'day' (default: today)"""
+    day = day or date.today()
+    return day - timedelta(days=day.weekday())
+
+
+def vitals_filter(frame, since=None, until=None, spo2_below=None, heart_rate_above=None,
+                  temperature_above=None, systolic_above=None, systolic_below=None):
+    """
+    Rows of 'frame' matching every given bound, as one vectorized mask.
+    'since' and 'until' are inclusive visit dates; missing vitals never match a bound.
+    """
+    mask = pd.Series(True, index=frame.index)
+    if since is not None:
+        mask &= frame["visit_date"] >= pd.Timestamp(since)
+    if until is not None:
+        mask &= frame["visit_date"] <= pd.Timestamp(until)
+    bounds = (
+        ("oxygen_saturation", "lt", spo2_below),
+        ("heart_rate", "gt", heart_rate_above),
+        ("temperature", "gt", temperature_above),
+        ("bp_systolic", "gt", systolic_above),
+        ("bp_systolic", "lt", systolic_below),
+    )
+    for column, op, bound in bounds:
+        if bound is not None:
+            mask &= getattr(frame[column], op)(bound).fillna(False)
+    return frame[mask]
+
+
+class PatientStore:
+    """Typed in-memory frame of patient records, persisted as date-partitioned Parquet"""
+
+    def __init__(self, path=DEFAULT_PATIENT_STORE_PATH, flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffer_started = None
+        self._flush_timer = None
+        self._batches = []  # typed frames not yet merged into _frame
+        self._frame = None
+
+    def append(self, patient_data):
+        """Buffer one intake record and return its record_id"""
+        row = to_row(patient_data)
+        with self._lock:
+            if not self._buffer:
+                self._buffer_started = time.monotonic()
+                # Write this batch even if nothing else arrives
+                self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+            self._buffer.append(row)
+            due = (len(self._buffer) >= self.flush_rows
+                   or time.monotonic() - self._buffer_started >= self.flush_interval)
+        if due:
+            self.flush()
+        return row["record_id"]
+
+    def extend(self, records):
+        """Append many patient_data dicts at once and write them as one batch"""
+        rows = [to_row(patient_data) for patient_data in records]
+        with self._lock:
+            self._buffer.extend(rows)
+        self.flush()
+        return [row["record_id"] for row in rows]
+
+    def flush(self):
+        """Write buffered records to the Parquet dataset"""
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not rows:
+                return
+            batch = to_frame(rows)
+            self._batches.append(batch)
+        if self.path:
+            self._write(batch)
+
+    def _write(self, batch):
+        out = batch.assign(**{_PARTITION: batch["visit_date"].dt.strftime("%Y-%m-%d")})
+        out.to_parquet(self.path, partition_cols=[_PARTITION], index=False)
+
+    def load(self, since=None, until=None):
+        """
+        Read persisted records into memory, replacing what is there. With
+        'since'/'until' only the matching visit-date partitions are read.
+        """
+        filters = []
+        if since is not None:
+            filters.append((_PARTITION, ">=", pd.Timestamp(since).strftime("%Y-%m-%d")))
+        if until is not None:
+            filters.append((_PARTITION, "<=", pd.Timestamp(until).strftime("%Y-%m-%d")))
+        if self.path and os.path.isdir(self.path):
+            frame = pd.read_parquet(self.path, filters=filters or None)
+            frame = frame.drop(columns=[_PARTITION]).astype(PATIENT_COLUMNS).reset_index(drop=True)
+        else:
+            frame = to_frame([])
+        with self._lock:
+            self._frame = frame
+            self._batches = []
+        return frame
+
+    def frame(self):
+        """All records, buffered ones included, as one typed DataFrame"""
+        with self._lock:
+            pending = to_frame(self._buffer) if self._buffer else None
+            if self._frame is None:
+                self._frame = to_frame([])
+            if self._batches:
+                self._frame = pd.concat([self._frame, *self._batches], ignore_index=True)
+                self._batches = []
+            frame = self._frame
+        if pending is not None:
+            frame = pd.concat([frame, pending], ignore_index=True)
+        return frame
+
+    def get(self, record_id):
+        """patient_data dict for one record, or None"""
+        frame = self.frame()
+        rows = frame[frame["record_id"] == record_id]
+        if rows.empty:
+            return None
+        return to_patient_data(rows.iloc[0])
+
+    def query(self, **bounds):
+        """Records matching vitals_filter bounds, e.g. query(spo2_below=92, since=start_of_week())"""
+        return vitals_filter(self.frame(), **bounds)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_patient_store():
+    """The process-wide store at PATIENT_STORE_PATH, loaded from disk on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = PatientStore()
+                store.load()
+                atexit.register(store.flush)
+                _store = store
+    return _store
@@ -0,0 +1,164 @@
+"""
+Background prefetch of the special responses (clinical reasoning, medical
+literature) after each triage answer.
+
+Clinicians nearly always ask for these right after a triage reply, so with
+PREFETCH_SPECIAL_RESPONSES=1 both are requested in the background as soon as
+the answer is done. The request parameters are kept in a per-conversation
+slot; when the clinician asks, the same request is made again and is answered
+from the response cache (or joins the prefetch still in flight), so the text
+shows up at once.
+
+Prefetches only run while the best API key keeps PREFETCH_MIN_HEADROOM of its
+rate-limit budget after the request; otherwise they back off and are skipped
+after the last retry, leaving the capacity to interactive calls. A new message
+or switching conversation cancels the slot, which stops its stream unless a
+clinician's request has already joined it.
+"""
+import contextvars
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from key_scheduler import estimate_tokens
+from single_flight import Cancelled
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_SPECIAL_RESPONSES", "0") == "1"
+
+# Fraction of the best key's request/token budget that must be left after a prefetch
+PREFETCH_MIN_HEADROOM = float(os.getenv("PREFETCH_MIN_HEADROOM", "0.5"))
+
+# Seconds to wait between headroom checks before a prefetch is skipped
+PREFETCH_RETRY_DELAYS = (1.0, 2.0, 4.0, 8.0)
+
+# Conversations with a slot; the least recently scheduled is dropped beyond this
+PREFETCH_MAX_CONVERSATIONS = int(os.getenv("PREFETCH_MAX_CONVERSATIONS", "256"))
+
+_prefetcher = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PREFETCH_WORKERS", "2")), thread_name_prefix="prefetch"
+)
+
+
+class _Slot:
+    """The prefetches for one answered turn of a conversation"""
+
+    def __init__(self, turn, params):
+        self.turn = turn
+        self.params = params  # prompt type -> completion parameters
+        self.state = dict.fromkeys(params, "queued")
+        self.cancel = threading.Event()
+        self.future = None
+
+
+class SpecialResponsePrefetcher:
+    """Per-conversation slots of prefetched special responses"""
+
+    def __init__(self, build_params, complete, scheduler, prompt_types, enabled=PREFETCH_ENABLED,
+                 min_headroom=PREFETCH_MIN_HEADROOM, retry_delays=PREFETCH_RETRY_DELAYS,
+                 max_conversations=PREFETCH_MAX_CONVERSATIONS):
+        """
+        'build_params(prompt_type, chat_history)' returns the completion
+        parameters of a special response; 'complete(cancel=event, **params)'
+        runs them and returns the chunk stream. 'scheduler' is the KeyScheduler.
+        """
+        self.build_params = build_params
+        self.complete = complete
+        self.scheduler = scheduler
+        self.prompt_types = tuple(prompt_types)
+        self.enabled = enabled
+        self.min_headroom = min_headroom
+        self.retry_delays = tuple(retry_delays)
+        self.max_conversations = max_conversations
+        self._lock = threading.Lock()
+        self._slots = OrderedDict()
+
+    def schedule(self, conversation_id, turn, chat_history):
+        """
+        Start prefetching every special response for the conversation as it
+        stands after 'turn' log messages. Replaces (and cancels) the previous slot.
+        """
+        if not self.enabled:
+            return
+        params = {prompt_type: self.build_params(prompt_type, chat_history) for prompt_type in self.prompt_types}
+        slot = _Slot(turn, params)
+        with self._lock:
+            previous = self._slots.pop(conversation_id, None)
+            self._slots[conversation_id] = slot
+            while len(self._slots) > self.max_conversations:
+                _, evicted = self._slots.popitem(last=False)
+                evicted.cancel.set()
+        if previous is not None:
+            previous.cancel.set()
+        # Run in a copy of the caller's context so metrics keep the conversation
+        slot.future = _prefetcher.submit(contextvars.copy_context().run, self._run, conversation_id, slot)
+
+    def take(self, conversation_id, prompt_type, turn):
+        """
+        Parameters of the prefetch for this conversation and turn, to be sent
+        again (and answered from the cache or the flight in progress); None if
+        there is none.
+        """
+        with self._lock:
+            slot = self._slots.get(conversation_id)
+        if slot is None or slot.turn != turn or slot.cancel.is_set():
+            return None
+        if slot.state.get(prompt_type) in (None, "skipped", "failed"):
+            return None
+        return slot.params[prompt_type]
+
+    def cancel(self, conversation_id):
+        """Drop the conversation's slot and stop its prefetches"""
+        with self._lock:
+            slot = self._slots.pop(conversation_id, None)
+        if slot is not None:
+            slot.cancel.set()
+
+    def status(self, conversation_id):
+        """{prompt type: queued | waiting | running | done | skipped | failed | cancelled} of the current slot"""
+        with self._lock:
+            slot = self._slots.get(conversation_id)
+        return {} if slot is None else dict(slot.state)
+
+    def wait(self, conversation_id, timeout=None):
+        """Block until the conversation's prefetches finish (for tests and benchmarks)"""
+        with self._lock:
+            slot = self._slots.get(conversation_id)
+        if slot is not None and slot.future is not None:
+            slot.future.exception(timeout=timeout)
+
+    def _has_headroom(self, slot, params):
+        """Wait (with back-off) until a key has headroom for the request; False if it never does or the slot is cancelled"""
+        tokens = estimate_tokens(params["messages"]) + params.get("max_tokens", 0)
+        for delay in self.retry_delays + (None,):
+            headroom = self.scheduler.best_headroom(tokens)
+            if headroom is not None and headroom >= self.min_headroom:
+                return True
+            if delay is None or slot.cancel.wait(delay):
+                return False
+        return False
+
+    def _run(self, conversation_id, slot):
+        # One prompt type at a time, so a conversation never holds more than one extra request
+        for prompt_type, params in slot.params.items():
+            if slot.cancel.is_set():
+                slot.state[prompt_type] = "cancelled"
+                continue
+            slot.state[prompt_type] = "waiting"
+            if not self._has_headroom(slot, params):
+                slot.state[prompt_type] = "cancelled" if slot.cancel.is_set() else "skipped"
+                logger.info("prefetch %s for %s: %s", prompt_type, conversation_id, slot.state[prompt_type])
+                continue
+            slot.state[prompt_type] = "running"
+            try:
+                for _ in self.complete(cancel=slot.cancel, **params):
+                    pass
+                slot.state[prompt_type] = "done"
+            except Cancelled:
+                slot.state[prompt_type] = "cancelled"
+            except Exception:
+                logger.exception("prefetch %s for %s failed", prompt_type, conversation_id)
+                slot.state[prompt_type] = "failed"
@@ -69,6 +69,15 @@ DIAGNOSTIC_ANALYSIS_PROMPT = (
     "bullet points (*), and clear sections."
 )
 
+# Rolling summary of older conversation turns (kept out of the verbatim context)
+CONVERSATION_SUMMARY_PROMPT = (
+    "You summarize a medical triage conversation for the assistant that continues it. "
+    "Update the summary with the new messages. Keep every reported symptom with its "
+    "duration and severity, answers to screening questions, red flags, medications, "
+    "allergies, and any department or urgency already recommended. Be concise and "
+    "factual, use bullet points, and do not add advice of your own."
+)
+
 # Special response prompts
 SPECIAL_RESPONSE_PROMPT = (
     "You are a medical AI assistant. Provide a detailed but concise response "
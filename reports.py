@@ -0,0 +1,341 @@
+"""
+PDF medical report engine.
+
+Paragraph and table styles are built once per process instead of on every
+report. Reports can be rendered one at a time, in bulk on a process pool, or
+written as a single merged multi-patient PDF (e.g. a ward's day) whose
+flowables are generated patient by patient instead of all up front.
+"""
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from io import BytesIO
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import LETTER, inch
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.platypus import (
+    PageBreak,
+    Paragraph,
+    SimpleDocTemplate,
+    Spacer,
+    Table,
+    TableStyle
+)
+
+from early_warning import score_patient
+
+# Shared by the patient information and vital signs tables
+INFO_TABLE_STYLE = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('BACKGROUND', (0,0), (1,0), colors.grey),
+    ('TEXTCOLOR', (0,0), (1,0), colors.whitesmoke),
+    ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+    ('BOTTOMPADDING', (0,0), (-1,0), 6),
+    ('GRID', (0,0), (-1,-1), 0.5, colors.grey),
+    ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+])
+
+DISCLAIMER = (
+    "NOTICE: This report includes AI-assisted analysis and should be "
+    "reviewed by a licensed medical professional."
+)
+
+PAGE_MARGIN = 72
+
+# Where the diagnostic analysis section of a report starts in the LLM output
+ANALYSIS_MARKER = "**Potential Diagnoses:**"
+
+_MD_HEADING = re.compile(r"(#{1,6})\s+(.*?)\s*#*$")
+_MD_BULLET = re.compile(r"[*+-]\s+(.*)")
+_MD_NUMBERED = re.compile(r"(\d+)[.)]\s+(.*)")
+_MD_RULE = re.compile(r"(?:-{3,}|\*{3,}|_{3,})$")
+_MD_INLINE = re.compile(r"\*\*(.+?)\*\*|__(.+?)__|\*(\S(?:.*?\S)?)\*|`([^`]+)`")
+_XML_ESCAPES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+
+
+@lru_cache(maxsize=None)
+def get_report_styles():
+    """The sample stylesheet plus the list styles used for analyses, built once per process"""
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle("AnalysisBullet", parent=styles["BodyText"], leftIndent=18, bulletIndent=6))
+    styles.add(ParagraphStyle("AnalysisNestedBullet", parent=styles["BodyText"], leftIndent=36, bulletIndent=24))
+    return styles
+
+
+def escape_text(text):
+    """Escape characters that ReportLab's paragraph markup would misread"""
+    return str(text).translate(_XML_ESCAPES)
+
+
+def _inline_markup(match):
+    bold, alt_bold, italic, code = match.groups()
+    if bold is not None or alt_bold is not None:
+        return f"<b>{bold if bold is not None else alt_bold}</b>"
+    if italic is not None:
+        return f"<i>{italic}</i>"
+    return f'<font face="Courier">{code}</font>'
+
+
+def markdown_to_flowables(md_text, marker=None):
+    """
+    Convert LLM markdown into ReportLab flowables in a single pass over the lines:
+    headings, bullet and numbered lists, and paragraphs, with **bold**, *italic*
+    and `code` inline and special characters escaped. If 'marker' is given (case
+    insensitive) only the text from its first occurrence onward is kept, like
+    strip_before_marker, but without a separate scan; no marker keeps everything.
+    """
+    styles = get_report_styles()
+    body_style = styles["BodyText"]
+    marker_lower = marker.lower() if marker else None
+    marker_at = None  # index of the first flowable at or after the marker
+
+    flowables = []
+    paragraph_lines = []
+
+    def flush_paragraph():
+        if paragraph_lines:
+            flowables.append(Paragraph("<br/>".join(paragraph_lines), body_style))
+            paragraph_lines.clear()
+
+    for line in md_text.splitlines():
+        if marker_lower is not None and marker_at is None:
+            idx = line.lower().find(marker_lower)
+            if idx != -1:
+                flush_paragraph()
+                marker_at = len(flowables)
+                line = line[idx:]
+
+        stripped = line.strip()
+        if not stripped or stripped.startswith("```") or _MD_RULE.match(stripped):
+            flush_paragraph()
+            continue
+
+        heading = _MD_HEADING.match(stripped)
+        if heading:
+            flush_paragraph()
+            level = len(heading.group(1))
+            style = styles["Heading3"] if level <= 2 else styles["Heading4"] if level == 3 else styles["Heading5"]
+            flowables.append(Paragraph(_MD_INLINE.sub(_inline_markup, escape_text(heading.group(2))), style))
+            continue
+
+        bullet = _MD_BULLET.match(stripped)
+        numbered = None if bullet else _MD_NUMBERED.match(stripped)
+        if bullet or numbered:
+            flush_paragraph()
+            nested = len(line) - len(line.lstrip()) >= 2
+            style = styles["AnalysisNestedBullet"] if nested else styles["AnalysisBullet"]
+            if bullet:
+                text, bullet_text = bullet.group(1), "•"
+            else:
+                text, bullet_text = numbered.group(2), f"{numbered.group(1)}."
+            flowables.append(
+                Paragraph(_MD_INLINE.sub(_inline_markup, escape_text(text)), style, bulletText=bullet_text)
+            )
+            continue
+
+        paragraph_lines.append(_MD_INLINE.sub(_inline_markup, escape_text(stripped)))
+
+    flush_paragraph()
+    if marker_at is not None:
+        return flowables[marker_at:]
+    return flowables
+
+
+def convert_md_to_html(md_text: str) -> str:
+    """
+    Naive conversion of Markdown-like text:
+      - Replace **bold** markers with <b>...</b>
+      - Replace line breaks with <br/>
+    """
+    # Convert **bold** to <b>...</b>
+    html_text = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', md_text)
+    # Replace line breaks with <br/>
+    html_text = html_text.replace('\n', '<br/>')
+    return html_text
+
+
+def strip_before_marker(text: str, marker: str = "**Analysis**") -> str:
+    """
+    Return only the substring starting at the given 'marker'.
+    Case-insensitive. If marker not found, returns the original text.
+    """
+    text_lower = text.lower()
+    marker_lower = marker.lower()
+
+    idx = text_lower.find(marker_lower)
+    if idx != -1:
+        # Keep everything from the marker onward
+        return text[idx:]
+    else:
+        return text
+
+
+def _info_table(rows):
+    table = Table(rows)
+    table.hAlign = 'LEFT'
+    table.setStyle(INFO_TABLE_STYLE)
+    return table
+
+
+def build_report_flowables(patient_data, analysis, report_date=None):
+    """Return the list of flowables making up one patient's report"""
+    styles = get_report_styles()
+    title_style = styles["Title"]
+    heading_style = styles["Heading2"]
+    normal_style = styles["BodyText"]
+    report_date = report_date or datetime.now().strftime("%d/%m/%Y")
+    warning = score_patient(patient_data)
+
+    elements = []
+
+    # ---- Title ----
+    elements.append(Paragraph("MEDICAL REPORT", title_style))
+    elements.append(Spacer(1, 0.2 * inch))
+
+    # ---- Date of Report ----
+    elements.append(Paragraph(f"<b>Date of Report:</b> {report_date}", normal_style))
+    elements.append(Spacer(1, 0.2 * inch))
+
+    # ---- Patient Information ----
+    elements.append(Paragraph("PATIENT INFORMATION (Status Praesens)", heading_style))
+    elements.append(_info_table([
+        ["Name:", patient_data['name']],
+        ["Date of Visit:", str(patient_data['date'])],
+        ["Gender:", patient_data['gender']],
+        ["Age:", str(patient_data['age'])],
+        ["Height:", f"{patient_data['height']} cm"],
+        ["Weight:", f"{patient_data['weight']} kg"],
+    ]))
+    elements.append(Spacer(1, 0.3 * inch))
+
+    # ---- Vital Signs ----
+    elements.append(Paragraph("VITAL SIGNS (Signa Vitalia)", heading_style))
+    elements.append(_info_table([
+        ["Temperature:", f"{patient_data['temperature']} °C"],
+        ["Blood Pressure:", patient_data['blood_pressure']],
+        ["Heart Rate:", f"{patient_data['heart_rate']} bpm"],
+        ["O2 Saturation:", f"{patient_data['oxygen_saturation']} %"],
+        ["Early Warning Score:", f"{warning['score']} ({warning['risk']} risk)"],
+    ]))
+    if warning["risk"] == "high":
+        triggers = escape_text(", ".join(warning["triggers"]))
+        elements.append(Spacer(1, 0.1 * inch))
+        elements.append(Paragraph(
+            f'<font color="red"><b>CRITICAL: vital signs meet the emergency threshold.</b> {triggers}</font>',
+            normal_style
+        ))
+    elements.append(Spacer(1, 0.3 * inch))
+
+    # ---- Medical History ----
+    elements.append(Paragraph("MEDICAL HISTORY (Anamnesis)", heading_style))
+    known_conditions = escape_text(', '.join(patient_data['medical_conditions']))
+    medications = escape_text(patient_data['medications'] or 'None reported')
+    allergies = escape_text(patient_data['allergies'] or 'None reported')
+    med_history_text = f"""
+    <b>Known Conditions (Status Morbi):</b> {known_conditions}<br/>
+    <b>Current Medications (Medicatio Actualis):</b> {medications}<br/>
+    <b>Allergies (Allergiae):</b> {allergies}
+    """
+    elements.append(Paragraph(med_history_text, normal_style))
+    elements.append(Spacer(1, 0.2 * inch))
+
+    # ---- Current Symptoms ----
+    elements.append(Paragraph("CURRENT SYMPTOMS (Symptomata)", heading_style))
+    elements.append(Paragraph(escape_text(patient_data['symptoms']), normal_style))
+    elements.append(Spacer(1, 0.3 * inch))
+
+    # ---- Analysis and Assessment ----
+    # Everything from the diagnoses marker onward, as headings/lists/paragraphs
+    elements.append(Paragraph("ANALYSIS AND ASSESSMENT", heading_style))
+    elements.extend(markdown_to_flowables(analysis, ANALYSIS_MARKER))
+    elements.append(Spacer(1, 0.3 * inch))
+
+    # ---- Disclaimer ----
+    elements.append(Paragraph(DISCLAIMER, styles["Italic"]))
+    return elements
+
+
+def _new_document(target):
+    return SimpleDocTemplate(
+        target,
+        pagesize=LETTER,
+        rightMargin=PAGE_MARGIN,
+        leftMargin=PAGE_MARGIN,
+        topMargin=PAGE_MARGIN,
+        bottomMargin=PAGE_MARGIN
+    )
+
+
+def generate_pdf_report(patient_data, analysis):
+    """
+    Generate a styled PDF medical report and return its bytes.
+    Only the analysis from the ANALYSIS_MARKER onward is included.
+    """
+    buffer = BytesIO()
+    _new_document(buffer).build(build_report_flowables(patient_data, analysis))
+    pdf_data = buffer.getvalue()
+    buffer.close()
+    return pdf_data
+
+
+def _render_item(item):
+    patient_data, analysis = item
+    return generate_pdf_report(patient_data, analysis)
+
+
+def render_reports(items, workers=None, chunksize=16):
+    """
+    Render many (patient_data, analysis) pairs on a process pool.
+    Yields the PDF bytes of each report in input order.
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=get_report_styles) as pool:
+        yield from pool.map(_render_item, items, chunksize=chunksize)
+
+
+class _StreamingFlowables(list):
+    """
+    A flowable list that ReportLab can consume while we keep refilling it,
+    one patient's report at a time, from a generator.
+    """
+
+    def __init__(self, batches):
+        super().__init__()
+        self._batches = iter(batches)
+
+    def _refill(self):
+        while not list.__len__(self):
+            batch = next(self._batches, None)
+            if batch is None:
+                return
+            self.extend(batch)
+
+    def __len__(self):
+        self._refill()
+        return list.__len__(self)
+
+    def __getitem__(self, index):
+        self._refill()
+        return list.__getitem__(self, index)
+
+
+def write_merged_report(items, target):
+    """
+    Write one PDF containing a report per (patient_data, analysis) pair, each
+    starting on a new page. 'items' may be a generator; each report's
+    flowables are only built when the previous one has been laid out.
+    Returns the number of pages written.
+    """
+    report_date = datetime.now().strftime("%d/%m/%Y")
+
+    def batches():
+        for index, (patient_data, analysis) in enumerate(items):
+            flowables = build_report_flowables(patient_data, analysis, report_date)
+            if index:
+                flowables.insert(0, PageBreak())
+            yield flowables
+
+    doc = _new_document(target)
+    doc.build(_StreamingFlowables(batches()))
+    return doc.page
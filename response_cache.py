@@ -0,0 +1,167 @@
+"""
+Cache of completed LLM responses.
+
+Responses are keyed on the normalized message list plus the model and
+sampling parameters, kept in an in-memory LRU tier and, optionally, in a
+size-bounded SQLite file on disk. Both tiers expire entries after a TTL.
+Cached answers can be replayed as a fake chunk stream so the streaming code
+path renders them exactly like a live completion.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+# Parameters that change the completion and therefore belong in the cache key
+KEY_PARAMS = ("model", "temperature", "top_p", "max_tokens", "frequency_penalty", "presence_penalty")
+
+_WHITESPACE = re.compile(r"\s+")
+_REPLAY_PIECE = re.compile(r"\S+\s*|\s+")
+
+
+def normalize_messages(messages):
+    """Collapse whitespace differences so re-submitted forms map to the same key"""
+    return [
+        {"role": message["role"], "content": _WHITESPACE.sub(" ", message["content"]).strip()}
+        for message in messages
+    ]
+
+
+def make_cache_key(params):
+    """Stable hash of the normalized messages, model and sampling parameters"""
+    payload = {name: params.get(name) for name in KEY_PARAMS}
+    payload["messages"] = normalize_messages(params["messages"])
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def replay_completion(text):
+    """Wrap cached text in the shape of a non-streaming chat completion"""
+    message = SimpleNamespace(role="assistant", content=text)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=None)
+
+
+def replay_stream(text, words_per_chunk=4):
+    """Yield cached text as chat completion chunks, a few words at a time"""
+    pieces = _REPLAY_PIECE.findall(text)
+    for start in range(0, len(pieces), words_per_chunk):
+        delta = SimpleNamespace(content="".join(pieces[start:start + words_per_chunk]))
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=None)], x_groq=None)
+    yield SimpleNamespace(
+        choices=[SimpleNamespace(delta=SimpleNamespace(content=None), finish_reason="stop")], x_groq=None
+    )
+
+
+class ResponseCache:
+    """Two-tier (memory LRU + optional SQLite on disk) cache of response texts"""
+
+    def __init__(self, max_entries=512, ttl=3600.0, disk_path=None, disk_max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()  # key -> (stored_at, text)
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        self._disk = None
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, content TEXT NOT NULL, stored_at REAL NOT NULL, size INTEGER NOT NULL)"
+            )
+            self._disk.execute("CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at)")
+            self._disk.commit()
+            self._disk_bytes = self._disk.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        """Return the cached text for a key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] < self.ttl:
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT content, stored_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] < self.ttl:
+                    self._counters["disk_hits"] += 1
+                    self._remember(key, row[1], row[0])
+                    return row[0]
+
+            self._counters["misses"] += 1
+            return None
+
+    def put(self, key, text):
+        """Store a completed response in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._counters["stores"] += 1
+            self._remember(key, now, text)
+            if self._disk is not None:
+                self._store_on_disk(key, now, text)
+
+    def stats(self):
+        """Hit/miss counters and current sizes, for sizing the cache"""
+        with self._lock:
+            stats = dict(self._counters)
+            lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+            stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_bytes"] = self._disk_bytes if self._disk is not None else 0
+            return stats
+
+    def clear(self):
+        """Drop every cached response from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM responses")
+                self._disk.commit()
+                self._disk_bytes = 0
+
+    def _remember(self, key, stored_at, text):
+        self._memory[key] = (stored_at, text)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def _store_on_disk(self, key, stored_at, text):
+        size = len(text.encode("utf-8"))
+        previous = self._disk.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if previous is not None:
+            self._disk_bytes -= previous[0]
+        self._disk.execute(
+            "INSERT OR REPLACE INTO responses (key, content, stored_at, size) VALUES (?, ?, ?, ?)",
+            (key, text, stored_at, size),
+        )
+        self._disk_bytes += size
+
+        # Expire old entries first, then evict the oldest until we're under the size bound
+        expired = self._disk.execute(
+            "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM responses WHERE stored_at < ?", (stored_at - self.ttl,)
+        ).fetchone()
+        if expired[1]:
+            self._disk.execute("DELETE FROM responses WHERE stored_at < ?", (stored_at - self.ttl,))
+            self._disk_bytes -= expired[0]
+        while self._disk_bytes > self.disk_max_bytes:
+            oldest = self._disk.execute(
+                "SELECT key, size FROM responses ORDER BY stored_at LIMIT 1"
+            ).fetchone()
+            if oldest is None:
+                break
+            self._disk.execute("DELETE FROM responses WHERE key = ?", (oldest[0],))
+            self._disk_bytes -= oldest[1]
+            self._counters["evictions"] += 1
+        self._disk.commit()
@@ -0,0 +1,213 @@
+"""
+Model selection per task and latency-tiered routing of triage turns.
+
+MODEL_TABLE names the Groq model for each task and tier; any entry can be
+overridden with GROQ_MODEL_<TASK>_<TIER> (e.g. GROQ_MODEL_TRIAGE_FAST).
+Diagnostic analyses, special responses and summaries always use their one
+model. Each triage turn is classified by alert status, conversation stage and
+length: short answers to the assistant's questions ("yes, since Tuesday")
+and brief acknowledgements go to the fast model, while first turns, turns
+with patient context, long or multi-question turns, new questions after a
+recommendation and turns with an emergency term or a red flag in the
+patient's own words ("I can't breathe", PATIENT_RED_FLAGS) in the prompt, or
+an emergency term in the last reply's Red Flags or Urgency Level, go to the
+large model.
+When the fast model fails before its first token, the turn is escalated to
+the large model. MODEL_FALLBACKS names the model any call fails over to when
+its model is unavailable.
+
+Every routed turn is logged with its tier, reason and latency, and counted in
+routing_stats for the Metrics page. MODEL_ROUTING=0 sends every turn to the
+large model.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, deque, namedtuple
+
+from alerts import EmergencyDetector, default_detector
+from metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "1") == "1"
+
+# Longest prompt (in words) still considered a simple answer to the assistant's questions
+ROUTING_FAST_MAX_WORDS = int(os.getenv("ROUTING_FAST_MAX_WORDS", "20"))
+
+# After a recommendation, only acknowledgements this short stay on the fast model
+ROUTING_ACK_MAX_WORDS = int(os.getenv("ROUTING_ACK_MAX_WORDS", "5"))
+
+# task -> tier -> model
+MODEL_TABLE = {
+    "triage": {"fast": "llama-3.1-8b-instant", "large": "Llama-3.3-70B-Versatile"},
+    "assistant": {"large": "llama3-70b-8192"},
+    "diagnostic": {"large": "llama3-70b-8192"},
+    "special": {"large": "llama3-70b-8192"},
+    "summary": {"large": "llama-3.1-8b-instant"},
+}
+
+# Model a call fails over to when a model is unavailable (its circuit breaker is open)
+MODEL_FALLBACKS = {
+    "Llama-3.3-70B-Versatile": "llama3-70b-8192",
+    "llama3-70b-8192": "Llama-3.3-70B-Versatile",
+    "llama-3.1-8b-instant": "Llama-3.3-70B-Versatile",
+}
+
+# How patients describe emergencies; the alerts vocabulary is diagnoses and the
+# assistant's wording, which a patient's short answer rarely uses
+PATIENT_RED_FLAGS = (
+    "chest pain", "chest pressure", "chest tightness",
+    "can't breathe", "can’t breathe", "cannot breathe", "can not breathe", "unable to breathe",
+    "shortness of breath", "short of breath", "difficulty breathing", "trouble breathing",
+    "unconscious", "unresponsive", "passed out", "fainted",
+    "severe bleeding", "bleeding heavily", "won't stop bleeding", "coughing up blood", "vomiting blood",
+    "face drooping", "face is drooping", "slurred speech", "seizure",
+    "worst headache", "suicidal", "kill myself", "overdose",
+    # Bosnian / Croatian / Serbian
+    "bol u prsima", "ne mogu disati", "ne mogu da dišem", "gušim se", "nesvjestica", "izgubio svijest",
+    "izgubila svijest", "jako krvarenje", "samoubistvo",
+)
+patient_red_flags = EmergencyDetector(PATIENT_RED_FLAGS)
+
+# Heading of the triage template that asks the patient for more information
+_QUESTIONS_HEADING = "### Additional Information Needed"
+
+# Sections of the last reply whose emergency terms keep the turn on the large
+# model; elsewhere (e.g. screening questions "for stroke or neurological
+# conditions") such terms are routine
+_ALERT_SECTIONS = re.compile(
+    r"^#{2,4}[ \t]*(?:Red Flags|Urgency Level)[ \t]*:?[ \t]*$(.*?)(?=^#{1,6}[ \t]|\Z)",
+    re.MULTILINE | re.DOTALL | re.IGNORECASE
+)
+
+# Routed turns kept for the latency percentiles
+ROUTING_SAMPLE_WINDOW = 1000
+
+Route = namedtuple("Route", "task tier model reason stage")
+
+
+def model_for(task, tier="large"):
+    """Model for a task and tier, from MODEL_TABLE or its GROQ_MODEL_<TASK>_<TIER> override"""
+    return os.getenv(f"GROQ_MODEL_{task.upper()}_{tier.upper()}") or MODEL_TABLE[task][tier]
+
+
+def fallback_chain(model):
+    """'model', then its fallbacks from MODEL_FALLBACKS (GROQ_FALLBACK_<MODEL> overrides), without repeats"""
+    chain = []
+    while model and model not in chain:
+        chain.append(model)
+        key = "GROQ_FALLBACK_" + "".join(c if c.isalnum() else "_" for c in model).upper()
+        model = os.getenv(key) or MODEL_FALLBACKS.get(model)
+    return chain
+
+
+def conversation_stage(history):
+    """
+    'opening' before the first answer, 'answering' while the last reply asks
+    the patient questions, 'follow-up' after a triage recommendation
+    """
+    last_reply = next((m["content"] for m in reversed(history) if m["role"] == "assistant"), None)
+    if last_reply is None:
+        return "opening", None
+    return ("answering" if _QUESTIONS_HEADING in last_reply else "follow-up"), last_reply
+
+
+def alert_sections(reply):
+    """The Red Flags and Urgency Level sections of a triage reply ('' if it has neither)"""
+    return "\n".join(_ALERT_SECTIONS.findall(reply))
+
+
+def route_triage_turn(prompt, history, patient_data=None):
+    """
+    Tier for one triage turn. 'history' is the conversation so far as API
+    messages (a MessageLog or ContextWindow projection).
+    """
+    stage, last_reply = conversation_stage(history)
+    words = len(prompt.split())
+    if not MODEL_ROUTING:
+        tier, reason = "large", "routing disabled"
+    elif default_detector.contains(prompt):
+        tier, reason = "large", "alert in prompt"
+    elif patient_red_flags.contains(prompt):
+        tier, reason = "large", "red flag in prompt"
+    elif last_reply is not None and default_detector.contains(alert_sections(last_reply)):
+        tier, reason = "large", "alert in last reply"
+    elif patient_data:
+        tier, reason = "large", "patient context"
+    elif stage == "opening":
+        tier, reason = "large", "first turn"
+    elif words > ROUTING_FAST_MAX_WORDS or prompt.count("?") > 1:
+        tier, reason = "large", "complex turn"
+    elif stage == "follow-up" and words > ROUTING_ACK_MAX_WORDS:
+        tier, reason = "large", "new question after triage"
+    else:
+        tier, reason = "fast", "short turn"
+    return Route("triage", tier, model_for("triage", tier), reason, stage)
+
+
+class RoutingStats:
+    """Routing decisions and per-tier latency of routed turns"""
+
+    def __init__(self, window=ROUTING_SAMPLE_WINDOW):
+        self._lock = threading.Lock()
+        self._decisions = Counter()  # (tier, reason)
+        self._samples = deque(maxlen=window)  # (tier, ttft_s, total_s)
+
+    def record(self, route, ttft_s, total_s):
+        with self._lock:
+            self._decisions[route.tier, route.reason] += 1
+            self._samples.append((route.tier, ttft_s, total_s))
+
+    def summary(self):
+        """{"tiers": {tier: {turns, ttft/total percentiles}}, "decisions": [(tier, reason, count)]}"""
+        with self._lock:
+            decisions = sorted(self._decisions.items())
+            samples = list(self._samples)
+        tiers = {}
+        for tier in sorted({tier for tier, _, _ in samples}):
+            rows = [s for s in samples if s[0] == tier]
+            tiers[tier] = {"turns": len(rows)}
+            for index, field in ((1, "ttft"), (2, "total")):
+                values = [row[index] for row in rows if row[index] is not None]
+                for pct in (50, 90):
+                    tiers[tier][f"{field}_p{pct}_s"] = percentile(values, pct)
+        return {"tiers": tiers, "decisions": [(tier, reason, count) for (tier, reason), count in decisions]}
+
+
+routing_stats = RoutingStats()
+
+
+def routed_stream(route, start):
+    """
+    Stream the turn from start(model) on the routed model. A fast-tier failure
+    before the first chunk escalates the turn to the large model; waiting for
+    a key (TimeoutError) does not, as both tiers share the keys.
+    """
+    started = time.perf_counter()
+    try:
+        stream = iter(start(route.model))
+        first = next(stream, None)
+    except TimeoutError:
+        raise
+    except Exception as e:
+        if route.tier == "large":
+            raise
+        logger.warning("routing: %s failed on %s (%s); escalating", route.task, route.model, type(e).__name__)
+        route = route._replace(tier="large", model=model_for(route.task, "large"), reason=f"escalated: {type(e).__name__}")
+        stream = iter(start(route.model))
+        first = next(stream, None)
+    ttft = time.perf_counter() - started
+    try:
+        if first is not None:
+            yield first
+            yield from stream
+    finally:
+        total = time.perf_counter() - started
+        routing_stats.record(route, ttft, total)
+        logger.info(
+            "routing: %s tier=%s model=%s stage=%s reason=%s first chunk=%.3fs total=%.3fs",
+            route.task, route.tier, route.model, route.stage, route.reason, ttft, total
+        )
@@ -0,0 +1,119 @@
+"""
+Single-flight coalescing of identical in-flight completions.
+
+When several sessions send the same normalized request at the same time (a
+double click, the same intake submitted twice, a common question), only the
+first one goes to Groq. Its response is pumped into a shared buffer by a
+background thread and every caller, the first included, reads the chunks
+from there, each into its own placeholder. Callers that join late get the
+chunks so far at once and then follow live. The pump runs to the end even if
+the first caller goes away, so the others are never left waiting, and once
+the response is complete the response cache answers later repeats. The one
+exception is a request started with a 'cancel' event (a background
+prefetch): once the event is set and nobody else has joined, the pump stops
+and closes the upstream stream.
+"""
+import contextvars
+import threading
+
+
+class Cancelled(Exception):
+    """The request was cancelled by its only caller before it finished"""
+
+
+class _Flight:
+    """Chunks of one upstream response, shared by every caller waiting on it"""
+
+    def __init__(self, cancel=None):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.callers = 1
+        self.cancel = cancel
+        self._cond = threading.Condition()
+
+    def pump(self, start):
+        """Run start() and buffer every chunk of the iterator it returns"""
+        stream = None
+        try:
+            stream = start()
+            for chunk in stream:
+                with self._cond:
+                    self.chunks.append(chunk)
+                    self._cond.notify_all()
+                if self.cancel is not None and self.cancel.is_set() and self.callers == 1:
+                    self.error = Cancelled()
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            if self.error is not None and hasattr(stream, "close"):
+                stream.close()
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+
+    def follow(self):
+        """Yield the buffered chunks, then new ones as they arrive; re-raise an upstream error"""
+        index = 0
+        while True:
+            with self._cond:
+                while index == len(self.chunks) and not self.done:
+                    self._cond.wait()
+                pending = self.chunks[index:]
+                index = len(self.chunks)
+                done = self.done
+            yield from pending
+            if done:
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    """Registry of in-flight requests by key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def stream(self, key, start, cancel=None):
+        """
+        Chunks of the response for 'key'. Only the first caller's start() is
+        run (on a pump thread); it must return an iterator of chunks. Setting
+        the 'cancel' event (honoured for the first caller only) stops the
+        request unless another caller has joined it.
+        Returns (chunk iterator, True if this call started the request).
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(cancel)
+            else:
+                flight.callers += 1
+        if leader:
+            # The pump inherits the caller's context (e.g. the conversation for metrics)
+            context = contextvars.copy_context()
+            threading.Thread(
+                target=context.run, args=(self._pump, key, flight, start), name="single-flight", daemon=True
+            ).start()
+        return flight.follow(), leader
+
+    def call(self, key, fn):
+        """Result of fn() for 'key', shared by concurrent callers. Returns (result, True if this call ran fn)"""
+        chunks, leader = self.stream(key, lambda: iter((fn(),)))
+        return next(iter(chunks)), leader
+
+    def in_flight(self):
+        """Keys currently being fetched and how many callers share each"""
+        with self._lock:
+            return {key: flight.callers for key, flight in self._flights.items()}
+
+    def _pump(self, key, flight, start):
+        try:
+            flight.pump(start)
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
@@ -0,0 +1,77 @@
+"""
+Throttled rendering of streamed completions into a Streamlit placeholder.
+
+Chunks are buffered in a list and the placeholder is redrawn on a time/size
+cadence instead of once per token, which keeps both the string building and
+the markdown re-renders sent to the browser bounded per response.
+"""
+import time
+
+CURSOR = "▌"
+
+# Redraw at most this often, unless this many characters are waiting
+FLUSH_INTERVAL = 0.05
+FLUSH_CHARS = 400
+
+
+class StreamRenderer:
+    """Accumulates streamed text and redraws a placeholder on a throttled cadence"""
+
+    def __init__(self, placeholder, flush_interval=FLUSH_INTERVAL, flush_chars=FLUSH_CHARS, started_at=None):
+        self.placeholder = placeholder
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self.completion_tokens = None  # reported by Groq on the last chunk, if available
+        self.chunks = 0
+        self.renders = 0
+        self._parts = []
+        self._pending_chars = 0
+        self._last_flush = self.started_at
+
+    def feed(self, delta):
+        """Add one streamed text delta, redrawing if the cadence is due"""
+        now = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = now
+        self._parts.append(delta)
+        self.chunks += 1
+        self._pending_chars += len(delta)
+        if self._pending_chars >= self.flush_chars or now - self._last_flush >= self.flush_interval:
+            self._render(CURSOR)
+            self._last_flush = now
+
+    def finish(self):
+        """Draw the final text without the cursor and return it"""
+        self.finished_at = time.perf_counter()
+        return self._render("")
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    def stats(self):
+        """Time-to-first-token, throughput and render counts for this stream"""
+        end = self.finished_at or time.perf_counter()
+        ttft = (self.first_token_at - self.started_at) if self.first_token_at is not None else None
+        generation_time = (end - self.first_token_at) if self.first_token_at is not None else 0.0
+        tokens = self.completion_tokens if self.completion_tokens is not None else self.chunks
+        return {
+            "ttft_s": ttft,
+            "total_s": end - self.started_at,
+            "chunks": self.chunks,
+            "completion_tokens": tokens,
+            "tokens_per_s": tokens / generation_time if generation_time > 0 else None,
+            "renders": self.renders,
+        }
+
+    def _render(self, suffix):
+        text = "".join(self._parts)
+        # Keep the joined prefix so the next join only appends the new chunks
+        self._parts = [text]
+        self.placeholder.markdown(text + suffix)
+        self.renders += 1
+        self._pending_chars = 0
+        return text
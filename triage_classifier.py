@@ -0,0 +1,380 @@
+"""
+Local urgency and department classifier trained on logged triage replies.
+
+Every final triage reply ends in a "### Recommendation" (department) and an
+"### Urgency Level" (EMERGENCY, URGENT, STANDARD or ROUTINE) section. This
+module harvests those labels from the conversation store, pairs each with the
+user messages that led to it, and trains two softmax regressions on TF-IDF
+word and bigram features, using NumPy only. Prediction takes tens of
+microseconds on the CPU, so the chat shows a provisional urgency and
+department while the LLM streams. When Groq is unreachable, the chat shows the
+same estimate as an offline fallback.
+
+    python triage_classifier.py --db conversations.db --output triage_classifier.npz
+
+Training holds out a share of the conversations and prints accuracy against
+the held-out LLM labels. The app loads the model from TRIAGE_CLASSIFIER_PATH,
+picks up a retrained one without a restart, and works without one.
+"""
+import argparse
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import Counter
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+TRIAGE_CLASSIFIER_PATH = os.getenv("TRIAGE_CLASSIFIER_PATH", "triage_classifier.npz")
+
+# In order of severity
+URGENCY_LEVELS = ("EMERGENCY", "URGENT", "STANDARD", "ROUTINE")
+
+# Vocabulary: terms in at least MIN_DF training texts, the MAX_FEATURES most frequent
+MIN_DF = 2
+MAX_FEATURES = 20000
+
+# Departments with fewer training examples are merged into OTHER_DEPARTMENT
+DEPARTMENT_MIN_EXAMPLES = 5
+OTHER_DEPARTMENT = "Other"
+
+_SECTION = re.compile(r"^#{2,4}[ \t]*(Recommendation|Urgency Level)[ \t]*:?[ \t]*$", re.MULTILINE | re.IGNORECASE)
+_URGENCY = re.compile(r"\b(" + "|".join(URGENCY_LEVELS) + r")\b")
+_WORD = re.compile(r"\w+")
+_MARKUP = re.compile(r"[*_`#>\[\]]")
+_HOSPITAL = re.compile(r"\s*(?:at|in|u)\s+ASA\s+bolnic\w*.*$", re.IGNORECASE)
+_DEPARTMENT_SUFFIX = re.compile(r"\s+(?:department|dept\.?|clinic|unit)$", re.IGNORECASE)
+
+
+def normalize_department(text):
+    """'**Cardiology Department at ASA bolnica**' -> 'Cardiology'"""
+    text = _MARKUP.sub("", text).strip(" -•:.")
+    text = _HOSPITAL.sub("", text)
+    text = re.sub(r"^the\s+", "", text, flags=re.IGNORECASE)
+    text = _DEPARTMENT_SUFFIX.sub("", text).strip(" -:.")
+    return text.title() if text else None
+
+
+def parse_triage_labels(reply):
+    """(department, urgency) of a final triage reply; None for replies without both sections"""
+    parts = _SECTION.split(reply)
+    sections = {}
+    for name, body in zip(parts[1::2], parts[2::2]):
+        lines = [line.strip() for line in body.splitlines()]
+        lines = [line for line in lines if line and not line.startswith(("#", "```"))]
+        if lines:
+            sections[name.lower()] = lines[0]
+    urgency = _URGENCY.search(sections.get("urgency level", "").upper())
+    department = normalize_department(sections.get("recommendation", ""))
+    if urgency is None or not department:
+        return None
+    return department, urgency.group(1)
+
+
+def pending_user_text(history, prompt=None):
+    """
+    The user messages since the last triage recommendation in 'history'
+    (API messages), plus 'prompt': what the next recommendation will be based on
+    """
+    texts = [] if prompt is None else [prompt]
+    for message in reversed(history):
+        if message["role"] == "assistant" and parse_triage_labels(message["content"]) is not None:
+            break
+        if message["role"] == "user":
+            texts.append(message["content"])
+    return "\n".join(reversed(texts))
+
+
+def harvest_examples(store):
+    """
+    Labelled examples from every stored conversation:
+    [{"conversation_id", "text", "department", "urgency"}, ...]
+    """
+    examples = []
+    conversation_id, pending = None, []
+    for message in store.iter_messages():
+        if message["conversation_id"] != conversation_id:
+            conversation_id, pending = message["conversation_id"], []
+        if message["role"] == "user":
+            pending.append(message["content"])
+            continue
+        labels = parse_triage_labels(message["content"]) if pending else None
+        if labels is not None:
+            department, urgency = labels
+            examples.append({
+                "conversation_id": conversation_id,
+                "text": "\n".join(pending),
+                "department": department,
+                "urgency": urgency,
+            })
+            pending = []
+    return examples
+
+
+def split_holdout(examples, holdout=0.2):
+    """(train, test), split by conversation so no conversation is in both"""
+    train, test = [], []
+    for example in examples:
+        digest = hashlib.blake2b(example["conversation_id"].encode("utf-8"), digest_size=8).digest()
+        (test if int.from_bytes(digest, "big") / 2**64 < holdout else train).append(example)
+    return train, test
+
+
+def _terms(text):
+    """Lower-cased words and word bigrams"""
+    words = _WORD.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class TriageClassifier:
+    """TF-IDF features and one softmax-regression head per label (urgency, department)"""
+
+    def __init__(self, vocabulary, idf, weights, bias, heads):
+        """
+        'weights' is (features, classes of every head side by side) and
+        'heads' maps each head name to its labels, in column order.
+        """
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+        self.heads = heads
+
+    @classmethod
+    def fit(cls, texts, urgencies, departments, epochs=30, learning_rate=0.5, l2=1e-4, batch_size=256, seed=0):
+        """Train on parallel lists of user texts and their LLM labels"""
+        import numpy as np
+
+        documents = [Counter(_terms(text)) for text in texts]
+        df = Counter(term for document in documents for term in document)
+        terms = [term for term, count in df.most_common(MAX_FEATURES) if count >= MIN_DF]
+        vocabulary = {term: index for index, term in enumerate(terms)}
+        idf = np.log((1 + len(documents)) / (1 + np.array([df[term] for term in terms], dtype=np.float64))) + 1
+
+        department_counts = Counter(departments)
+        departments = [
+            d if department_counts[d] >= DEPARTMENT_MIN_EXAMPLES else OTHER_DEPARTMENT for d in departments
+        ]
+        heads = {
+            "urgency": [level for level in URGENCY_LEVELS if level in set(urgencies)],
+            "department": sorted(set(departments)),
+        }
+        model = cls(vocabulary, idf.astype(np.float32), None, None, heads)
+        rows = [model._features(document) for document in documents]
+
+        weights, bias = [], []
+        for labels, values in ((heads["urgency"], urgencies), (heads["department"], departments)):
+            index = {label: i for i, label in enumerate(labels)}
+            w, b = _train_softmax(
+                rows, np.array([index[v] for v in values]), len(terms), len(labels),
+                epochs, learning_rate, l2, batch_size, seed
+            )
+            weights.append(w)
+            bias.append(b)
+        model.weights = np.ascontiguousarray(np.hstack(weights), dtype=np.float32)
+        model.bias = np.concatenate(bias).astype(np.float32)
+        return model
+
+    def _features(self, document):
+        """(feature indices, L2-normalized sublinear TF-IDF values) of a term Counter"""
+        import numpy as np
+        indices, counts = [], []
+        for term, count in document.items():
+            index = self.vocabulary.get(term)
+            if index is not None:
+                indices.append(index)
+                counts.append(count)
+        if not indices:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+        indices = np.array(indices, dtype=np.intp)
+        counts = np.array(counts, dtype=np.float32)
+        values = (1 + np.log(counts)) * self.idf[indices]
+        return indices, values / np.sqrt(values @ values)
+
+    def predict(self, text):
+        """
+        {"urgency", "urgency_confidence", "department", "department_confidence"}
+        for the user text; department is None when the best match is OTHER_DEPARTMENT
+        """
+        import numpy as np
+        indices, values = self._features(Counter(_terms(text)))
+        scores = values @ self.weights[indices] + self.bias
+        prediction = {}
+        start = 0
+        for head, labels in self.heads.items():
+            logits = scores[start:start + len(labels)]
+            start += len(labels)
+            best = int(logits.argmax())
+            exp = np.exp(logits - logits[best])
+            label = labels[best]
+            prediction[head] = None if label == OTHER_DEPARTMENT else label
+            prediction[f"{head}_confidence"] = float(1 / exp.sum())
+        return prediction
+
+    def save(self, path):
+        """Write the model to 'path' atomically, so a running app never loads a half-written file"""
+        import numpy as np
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    terms=np.array(terms, dtype=str),
+                    idf=self.idf,
+                    weights=self.weights,
+                    bias=self.bias,
+                    urgency=np.array(self.heads["urgency"], dtype=str),
+                    department=np.array(self.heads["department"], dtype=str),
+                )
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        import numpy as np
+        # Labels and terms are stored as fixed-width unicode arrays, so nothing is unpickled
+        with np.load(path, allow_pickle=False) as data:
+            vocabulary = {term: index for index, term in enumerate(data["terms"].tolist())}
+            heads = {"urgency": data["urgency"].tolist(), "department": data["department"].tolist()}
+            return cls(vocabulary, data["idf"], data["weights"], data["bias"], heads)
+
+
+def _train_softmax(rows, y, n_features, n_classes, epochs, learning_rate, l2, batch_size, seed):
+    """Class-balanced softmax regression on sparse rows, by mini-batch Adagrad"""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    weights = np.zeros((n_features, n_classes), dtype=np.float32)
+    bias = np.zeros(n_classes, dtype=np.float32)
+    grad_sq_w = np.full_like(weights, 1e-8)
+    grad_sq_b = np.full_like(bias, 1e-8)
+    counts = np.bincount(y, minlength=n_classes)
+    sample_weight = (len(y) / (n_classes * np.maximum(counts, 1)))[y].astype(np.float32)
+    for _ in range(epochs):
+        order = rng.permutation(len(rows))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            x = np.zeros((len(batch), n_features), dtype=np.float32)
+            for i, row in enumerate(batch):
+                indices, values = rows[row]
+                x[i, indices] = values
+            logits = x @ weights + bias
+            logits -= logits.max(axis=1, keepdims=True)
+            p = np.exp(logits)
+            p /= p.sum(axis=1, keepdims=True)
+            p[np.arange(len(batch)), y[batch]] -= 1
+            p *= sample_weight[batch, None] / len(batch)
+            grad_w = x.T @ p + l2 * weights
+            grad_b = p.sum(axis=0)
+            grad_sq_w += grad_w ** 2
+            grad_sq_b += grad_b ** 2
+            weights -= learning_rate * grad_w / np.sqrt(grad_sq_w)
+            bias -= learning_rate * grad_b / np.sqrt(grad_sq_b)
+    return weights, bias
+
+
+def evaluate(model, examples):
+    """Accuracy of each head against the LLM labels, per-class recall and the urgency under-triage rate"""
+    report = {"examples": len(examples)}
+    if not examples:
+        return report
+    predictions = [model.predict(example["text"]) for example in examples]
+    for head in ("urgency", "department"):
+        known = set(model.heads[head])
+        pairs = [
+            (example[head] if example[head] in known else OTHER_DEPARTMENT, prediction[head] or OTHER_DEPARTMENT)
+            for example, prediction in zip(examples, predictions)
+        ]
+        support = Counter(truth for truth, _ in pairs)
+        hits = Counter(truth for truth, predicted in pairs if truth == predicted)
+        report[head] = {
+            "accuracy": sum(hits.values()) / len(pairs),
+            "recall": {label: (hits[label] / count, count) for label, count in support.most_common()},
+        }
+    severity = {level: rank for rank, level in enumerate(URGENCY_LEVELS)}
+    under = sum(
+        severity[prediction["urgency"]] > severity[example["urgency"]]
+        for example, prediction in zip(examples, predictions)
+    )
+    report["urgency"]["under_triage_rate"] = under / len(examples)
+    return report
+
+
+def format_report(report):
+    lines = [f"held-out examples: {report['examples']}"]
+    for head in ("urgency", "department"):
+        if head not in report:
+            continue
+        lines.append(f"{head}: accuracy {report[head]['accuracy']:.1%}")
+        if "under_triage_rate" in report[head]:
+            lines.append(f"  predicted less urgent than the LLM: {report[head]['under_triage_rate']:.1%}")
+        for label, (recall, count) in report[head]["recall"].items():
+            lines.append(f"  {label:<24} recall {recall:6.1%}  (n={count})")
+    return "\n".join(lines)
+
+
+@lru_cache(maxsize=1)
+def _load_classifier(path, mtime_ns):
+    return TriageClassifier.load(path)
+
+
+def get_classifier(path=TRIAGE_CLASSIFIER_PATH):
+    """
+    The trained classifier; None if there is no model file. It is loaded
+    again when the file changes, so a model trained while the app runs is
+    picked up without a restart.
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    return _load_classifier(path, mtime_ns)
+
+
+def provisional_triage(text):
+    """Local prediction for the user text, or None without a trained model or text, or if the model fails"""
+    if not text.strip():
+        return None
+    try:
+        model = get_classifier()
+        return None if model is None else model.predict(text)
+    except Exception:
+        logger.exception("triage classifier: no provisional triage")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=os.getenv("CONVERSATION_DB_PATH", "conversations.db"),
+                        help="conversation store to harvest labelled triage replies from")
+    parser.add_argument("--output", default=TRIAGE_CLASSIFIER_PATH, help="where to write the model")
+    parser.add_argument("--holdout", type=float, default=0.2, help="share of conversations held out for the report")
+    parser.add_argument("--epochs", type=int, default=30)
+    args = parser.parse_args()
+
+    from conversation_store import ConversationStore
+    examples = harvest_examples(ConversationStore(args.db))
+    train, test = split_holdout(examples, args.holdout)
+    print(f"harvested {len(examples)} labelled replies: {len(train)} for training, {len(test)} held out")
+    if not train:
+        raise SystemExit("no labelled triage replies to train on")
+
+    started = time.perf_counter()
+    model = TriageClassifier.fit(
+        [e["text"] for e in train], [e["urgency"] for e in train], [e["department"] for e in train],
+        epochs=args.epochs
+    )
+    print(f"trained in {time.perf_counter() - started:.1f}s: {len(model.vocabulary)} features, "
+          f"{len(model.heads['department'])} departments")
+    print(format_report(evaluate(model, test)))
+    model.save(args.output)
+    print(f"saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()